@@ -1,6 +1,7 @@
 import time
 
 from kafi.functional import Functional
+from kafi.message import Message
 
 # Constants
 
@@ -20,11 +21,12 @@ class AddOns(Functional):
             key_hash_int_message_dict_dict = acc
             #
             key = message_dict["key"]
-            value = message_dict["value"]
             #
             if key is not None:
                 key_hash_int = hash(str(key))
-                if value is None:
+                # Lazy messages can check for tombstones without deserializing the value.
+                value_is_null_bool = message_dict.is_null("value") if isinstance(message_dict, Message) else message_dict["value"] is None
+                if value_is_null_bool:
                     if key_hash_int in key_hash_int_message_dict_dict:
                         del key_hash_int_message_dict_dict[key_hash_int]
                 else:
@@ -33,18 +35,30 @@ class AddOns(Functional):
             return key_hash_int_message_dict_dict
         #
 
+        # Only deserialize the keys while compacting (only the values of the retained messages are deserialized, and the retained messages are returned as dicts unless another message class was asked for explicitly).
+        to_dict_bool = "message_class" not in kwargs
+        if to_dict_bool:
+            kwargs["message_class"] = "lazy"
+        #
         (key_hash_int_message_dict_dict, _) = self.foldl(topic, foldl_function, {}, n, **kwargs)
         #
         message_dict_list = list(key_hash_int_message_dict_dict.values())
+        if to_dict_bool:
+            message_dict_list = [dict(message_dict) for message_dict in message_dict_list]
         #
         return message_dict_list
 
     def compact_to(self, topic, target_storage, target_topic, n=ALL_MESSAGES, **kwargs):
-        source_kwargs = self.get_source_kwargs(**kwargs)
-        target_kwargs = self.get_target_kwargs(**kwargs)
+        source_kwargs = self.copy_kwargs("source", **kwargs)
+        target_kwargs = self.copy_kwargs("target", **kwargs)
+        #
+        (source_kwargs, target_kwargs, remap_schema_ids_function) = self.get_raw_kwargs(source_kwargs, target_kwargs, target_storage, target_topic, **kwargs)
         #
         message_dict_list = self.compact(topic, n, **source_kwargs)
         #
+        if remap_schema_ids_function is not None:
+            message_dict_list = [remap_schema_ids_function(message_dict) for message_dict in message_dict_list]
+        #
         target_producer = target_storage.producer(target_topic, **target_kwargs)
         key_bytes_list_value_bytes_list_tuple = target_producer.produce_list(message_dict_list, **target_kwargs)
         target_producer.close()
@@ -1,8 +1,4 @@
-import os
-import importlib
 import json
-import sys
-import tempfile
 
 from confluent_kafka.schema_registry.avro import AvroDeserializer
 from confluent_kafka.schema_registry.json_schema import JSONDeserializer
@@ -13,8 +9,10 @@ from google.protobuf.json_format import MessageToDict
 from kafi.schemaregistry import SchemaRegistry
 
 class Deserializer(SchemaRegistry):
-    def __init__(self, schema_registry_config_dict):
-        super().__init__(schema_registry_config_dict)
+    def __init__(self, schema_registry_config_dict, serdeCache=None, schemaRegistryClient=None):
+        super().__init__(schema_registry_config_dict, serdeCache, schemaRegistryClient)
+        #
+        self.schema_id_int_generalizedProtocolMessageType_protobuf_schema_str_tuple_dict = {}
 
     def deserialize(self, payload_bytes, type_str, topic_str, key_bool):
         if type_str.lower() == "bytes":
@@ -54,13 +52,17 @@ class Deserializer(SchemaRegistry):
             return None
         #
         schema_id_int = int.from_bytes(bytes[1:5], "big")
-        if schema_id_int in self.schema_id_int_generalizedProtocolMessageType_protobuf_schema_str_tuple_dict:
-            generalizedProtocolMessageType, protobuf_schema_str = self.schema_id_int_generalizedProtocolMessageType_protobuf_schema_str_tuple_dict[schema_id_int]
-        else:
-            generalizedProtocolMessageType, protobuf_schema_str = self.schema_id_int_to_generalizedProtocolMessageType_protobuf_schema_str_tuple(schema_id_int)
-            self.schema_id_int_generalizedProtocolMessageType_protobuf_schema_str_tuple_dict[schema_id_int] = (generalizedProtocolMessageType, protobuf_schema_str)
+        protobufDeserializer = self.serdeCache.get(("protobuf", "deserializer", schema_id_int))
+        if protobufDeserializer is None:
+            if schema_id_int in self.schema_id_int_generalizedProtocolMessageType_protobuf_schema_str_tuple_dict:
+                generalizedProtocolMessageType, protobuf_schema_str = self.schema_id_int_generalizedProtocolMessageType_protobuf_schema_str_tuple_dict[schema_id_int]
+            else:
+                generalizedProtocolMessageType, protobuf_schema_str = self.schema_id_int_to_protobuf_generalizedProtocolMessageType_schema_str_tuple(schema_id_int)
+                self.schema_id_int_generalizedProtocolMessageType_protobuf_schema_str_tuple_dict[schema_id_int] = (generalizedProtocolMessageType, protobuf_schema_str)
+            #
+            protobufDeserializer = ProtobufDeserializer(generalizedProtocolMessageType, {"use.deprecated.format": False})
+            self.serdeCache.put(("protobuf", "deserializer", schema_id_int), protobufDeserializer)
         #
-        protobufDeserializer = ProtobufDeserializer(generalizedProtocolMessageType, {"use.deprecated.format": False})
         serializationContext = SerializationContext(topic_str, MessageField.KEY if key_bool else MessageField.VALUE)
         protobuf_message = protobufDeserializer(bytes, serializationContext)
         dict = MessageToDict(protobuf_message)
@@ -71,10 +73,14 @@ class Deserializer(SchemaRegistry):
             return None
         #
         schema_id_int = int.from_bytes(bytes[1:5], "big")
-        schema_dict = self.get_schema(schema_id_int)
-        schema_str = schema_dict["schema_str"]
+        avroDeserializer = self.serdeCache.get(("avro", "deserializer", schema_id_int))
+        if avroDeserializer is None:
+            schema_dict = self.get_schema(schema_id_int)
+            schema_str = schema_dict["schema_str"]
+            #
+            avroDeserializer = AvroDeserializer(self.schemaRegistryClient, schema_str)
+            self.serdeCache.put(("avro", "deserializer", schema_id_int), avroDeserializer)
         #
-        avroDeserializer = AvroDeserializer(self.schemaRegistryClient, schema_str)
         serializationContext = SerializationContext(topic_str, MessageField.KEY if key_bool else MessageField.VALUE)
         dict = avroDeserializer(bytes, serializationContext)
         return dict
@@ -84,37 +90,14 @@ class Deserializer(SchemaRegistry):
             return None
         #
         schema_id_int = int.from_bytes(bytes[1:5], "big")
-        schema_dict = self.get_schema(schema_id_int)
-        schema_str = schema_dict["schema_str"]
+        jsonDeserializer = self.serdeCache.get(("jsonschema", "deserializer", schema_id_int))
+        if jsonDeserializer is None:
+            schema_dict = self.get_schema(schema_id_int)
+            schema_str = schema_dict["schema_str"]
+            #
+            jsonDeserializer = JSONDeserializer(schema_str)
+            self.serdeCache.put(("jsonschema", "deserializer", schema_id_int), jsonDeserializer)
         #
-        jsonDeserializer = JSONDeserializer(schema_str)
         serializationContext = SerializationContext(topic_str, MessageField.KEY if key_bool else MessageField.VALUE)
         dict = jsonDeserializer(bytes, serializationContext)
         return dict
-
-    # Helpers
-
-    def schema_id_int_to_generalizedProtocolMessageType_protobuf_schema_str_tuple(self, schema_id_int):
-        schema_dict = self.get_schema(schema_id_int)
-        schema_str = schema_dict["schema_str"]
-        #
-        generalizedProtocolMessageType = self.schema_id_int_and_schema_str_to_generalizedProtocolMessageType(schema_id_int, schema_str)
-        #
-        return generalizedProtocolMessageType, schema_str
-
-    def schema_id_int_and_schema_str_to_generalizedProtocolMessageType(self, schema_id_int, schema_str):
-        path_str = f"/{tempfile.gettempdir()}/kafi/protobuf/{self.storage_obj.config_str}"
-        os.makedirs(path_str, exist_ok=True)
-        file_str = f"schema_{schema_id_int}.proto"
-        file_path_str = f"{path_str}/{file_str}"
-        with open(file_path_str, "w") as textIOWrapper:
-            textIOWrapper.write(schema_str)
-        #
-        import grpc_tools.protoc
-        grpc_tools.protoc.main(["protoc", f"-I{path_str}", f"--python_out={path_str}", f"{file_str}"])
-        #
-        sys.path.insert(1, path_str)
-        schema_module = importlib.import_module(f"schema_{schema_id_int}_pb2")
-        schema_name_str = list(schema_module.DESCRIPTOR.message_types_by_name.keys())[0]
-        generalizedProtocolMessageType = getattr(schema_module, schema_name_str)
-        return generalizedProtocolMessageType
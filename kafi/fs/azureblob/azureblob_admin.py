@@ -2,6 +2,15 @@ import os
 
 from kafi.fs.fs_admin import FSAdmin
 
+# Constants
+
+POOL_MAXSIZE = 10
+PART_SIZE = 8388608
+UPLOAD_CONCURRENCY = 4
+DOWNLOAD_CONCURRENCY = 4
+CONNECT_TIMEOUT = 300
+READ_TIMEOUT = 300
+
 #
 
 class AzureBlobAdmin(FSAdmin):
@@ -11,7 +20,16 @@ class AzureBlobAdmin(FSAdmin):
 
         super().__init__(azureblob_obj)
         #
-        blobServiceClient = BlobServiceClient.from_connection_string(azureblob_obj.azure_blob_config_dict["connection.string"])
+        # One long-lived (thread-safe) client with a connection pool for all requests of this storage object - the container and blob clients derived from it share its pipeline.
+        #
+        # part.size: size of the blocks of block uploads and the chunks of ranged downloads (blobs up to this size are uploaded/downloaded with a single request).
+        # upload.concurrency: number of blocks uploaded in parallel.
+        # download.concurrency: number of chunks downloaded in parallel.
+        part_size_int = int(azureblob_obj.azure_blob_config_dict["part.size"]) if "part.size" in azureblob_obj.azure_blob_config_dict else PART_SIZE
+        self.upload_concurrency_int = int(azureblob_obj.azure_blob_config_dict["upload.concurrency"]) if "upload.concurrency" in azureblob_obj.azure_blob_config_dict else UPLOAD_CONCURRENCY
+        self.download_concurrency_int = int(azureblob_obj.azure_blob_config_dict["download.concurrency"]) if "download.concurrency" in azureblob_obj.azure_blob_config_dict else DOWNLOAD_CONCURRENCY
+        #
+        blobServiceClient = BlobServiceClient.from_connection_string(azureblob_obj.azure_blob_config_dict["connection.string"], transport=get_requestsTransport(azureblob_obj.azure_blob_config_dict), max_single_put_size=part_size_int, max_block_size=part_size_int, max_single_get_size=part_size_int, max_chunk_get_size=part_size_int)
         self.containerClient = blobServiceClient.get_container_client(azureblob_obj.container_name())
 
     # Topics/Files
@@ -42,22 +60,22 @@ class AzureBlobAdmin(FSAdmin):
         pass
 
     def exists_file(self, abs_path_file_str):
-        from azure.storage.blob import BlobClient
-        #
-
-        blobClient = BlobClient.from_connection_string(self.storage_obj.azure_blob_config_dict["connection.string"], container_name=self.storage_obj.azure_blob_config_dict["container.name"], blob_name=abs_path_file_str)
+        blobClient = self.containerClient.get_blob_client(abs_path_file_str)
         #
         return blobClient.exists()
 
     # Metadata
     
     def read_str(self, abs_path_file_str):
-        from azure.storage.blob import BlobClient
+        from azure.core.exceptions import ResourceNotFoundError
         #
 
-        blobClient = BlobClient.from_connection_string(conn_str=self.storage_obj.azure_blob_config_dict["connection.string"], container_name=self.storage_obj.azure_blob_config_dict["container.name"], blob_name=abs_path_file_str)
+        blobClient = self.containerClient.get_blob_client(abs_path_file_str)
         #
-        storageStreamDownloader = blobClient.download_blob()
+        try:
+            storageStreamDownloader = blobClient.download_blob()
+        except ResourceNotFoundError:
+            return None
         blob_bytes = storageStreamDownloader.read()
         #
         blob_str = blob_bytes.decode("utf-8")
@@ -65,10 +83,7 @@ class AzureBlobAdmin(FSAdmin):
         return blob_str
 
     def write_str(self, abs_path_file_str, data_str):
-        from azure.storage.blob import BlobClient
-        #
-
-        blobClient = BlobClient.from_connection_string(conn_str=self.storage_obj.azure_blob_config_dict["connection.string"], container_name=self.storage_obj.azure_blob_config_dict["container.name"], blob_name=abs_path_file_str)
+        blobClient = self.containerClient.get_blob_client(abs_path_file_str)
         #
         data_bytes = data_str.encode("utf-8")
         #
@@ -76,21 +91,48 @@ class AzureBlobAdmin(FSAdmin):
 
     #
 
-    def read_bytes(self, abs_path_file_str):
-        from azure.storage.blob import BlobClient
-        #
-
-        blobClient = BlobClient.from_connection_string(conn_str=self.storage_obj.azure_blob_config_dict["connection.string"], container_name=self.storage_obj.azure_blob_config_dict["container.name"], blob_name=abs_path_file_str)
+    def read_bytes(self, abs_path_file_str, position_int=0, length_int=-1):
+        blobClient = self.containerClient.get_blob_client(abs_path_file_str)
         #
-        storageStreamDownloader = blobClient.download_blob()
+        # Blobs (or ranges) larger than part.size are downloaded with download.concurrency parallel ranged GETs. Whole blobs are downloaded without a range (a range starting at 0 fails with HTTP 416 for empty blobs).
+        offset_int = None if position_int == 0 and length_int <= 0 else position_int
+        storageStreamDownloader = blobClient.download_blob(offset=offset_int, length=length_int if length_int > 0 else None, max_concurrency=self.download_concurrency_int)
         blob_bytes = storageStreamDownloader.read()
         #
         return blob_bytes
 
     def write_bytes(self, abs_path_file_str, data_bytes):
-        from azure.storage.blob import BlobClient
+        blobClient = self.containerClient.get_blob_client(abs_path_file_str)
         #
+        # Blobs larger than part.size are uploaded as blocks with upload.concurrency parallel block uploads.
+        blobClient.upload_blob(data_bytes, max_concurrency=self.upload_concurrency_int)
 
-        blobClient = BlobClient.from_connection_string(conn_str=self.storage_obj.azure_blob_config_dict["connection.string"], container_name=self.storage_obj.azure_blob_config_dict["container.name"], blob_name=abs_path_file_str)
-        #
-        blobClient.upload_blob(data_bytes)
+#
+
+def get_requestsTransport(azure_blob_config_dict):
+    from azure.core.pipeline.transport import RequestsTransport
+    import requests
+    from requests.adapters import HTTPAdapter
+    import socket
+    import urllib3
+    from urllib3 import Retry
+    #
+
+    # pool.maxsize: maximum number of pooled (keep-alive) connections to the blob endpoint (should be >= fetch.concurrency of the consumers).
+    pool_maxsize_int = int(azure_blob_config_dict["pool.maxsize"]) if "pool.maxsize" in azure_blob_config_dict else POOL_MAXSIZE
+    # keep.alive: enable TCP keep-alive on the pooled connections (so that idle connections are not silently dropped by NATs/load balancers).
+    keep_alive_bool = str(azure_blob_config_dict["keep.alive"]).lower() == "true" if "keep.alive" in azure_blob_config_dict else True
+    connect_timeout_float = float(azure_blob_config_dict["connect.timeout"]) if "connect.timeout" in azure_blob_config_dict else CONNECT_TIMEOUT
+    read_timeout_float = float(azure_blob_config_dict["read.timeout"]) if "read.timeout" in azure_blob_config_dict else READ_TIMEOUT
+    #
+    session = requests.Session()
+    # Retries are handled by the Azure SDK pipeline.
+    httpAdapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize_int, max_retries=Retry(total=False, redirect=False, raise_on_status=False))
+    socket_options_tuple_list = urllib3.connection.HTTPConnection.default_socket_options + ([(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)] if keep_alive_bool else [])
+    httpAdapter.init_poolmanager(1, pool_maxsize_int, socket_options=socket_options_tuple_list)
+    session.mount("http://", httpAdapter)
+    session.mount("https://", httpAdapter)
+    #
+    requestsTransport = RequestsTransport(session=session, session_owner=False, connection_timeout=connect_timeout_float, read_timeout=read_timeout_float)
+    #
+    return requestsTransport
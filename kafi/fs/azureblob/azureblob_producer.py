@@ -8,4 +8,5 @@ class AzureBlobProducer(FSProducer):
     #
 
     def close(self):
+        self.flush()
         return self.topic_str
@@ -1,5 +1,7 @@
 from kafi.storage import Storage
 from kafi.files import Files
+from kafi.deserializer import Deserializer
+from kafi.helpers import to_bytes
 
 #
 
@@ -52,6 +54,33 @@ class FS(Storage):
         #
         self.admin = self.get_admin()
 
+    #
+
+    def lookup(self, topic, key, **kwargs):
+        # Get the latest message with the given key (or None), only reading the partition files whose Bloom filters might contain the key.
+        topic_str = topic
+        #
+        (key_type_str, value_type_str) = self.get_key_value_type_tuple(**kwargs)
+        # The key is compared in its serialized form - keys of Schema Registry-based types have to be given as serialized bytes.
+        if not isinstance(key, bytes) and key_type_str.lower() not in ["bytes", "str", "json"]:
+            raise Exception(f"Lookups by key of type \"{key_type_str}\" require the serialized key (bytes).")
+        key_bytes = to_bytes(key)
+        #
+        message_dict = self.admin.lookup(topic_str, key_bytes)
+        #
+        if message_dict is not None:
+            deserializer = Deserializer(self.schema_registry_config_dict, self.serdeCache, self.schemaRegistryClient)
+            message_dict["key"] = deserializer.deserialize(message_dict["key"], key_type_str, topic_str=topic_str, key_bool=True)
+            message_dict["value"] = deserializer.deserialize(message_dict["value"], value_type_str, topic_str=topic_str, key_bool=False)
+        #
+        return message_dict
+
+    def async_admin(self, **kwargs):
+        from kafi.fs.fs_async_admin import AsyncFSAdmin
+        #
+
+        return AsyncFSAdmin(self, **kwargs)
+
     # azure_blob
 
     def container_name(self, new_value=None): # str
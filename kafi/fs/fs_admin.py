@@ -1,15 +1,38 @@
 import ast
 from fnmatch import fnmatch
 import os
+import time
+import uuid
 
 from kafi.storage_admin import StorageAdmin
+from kafi.fs.fs_segment import bloom_filter_may_contain, decode_index, decode_segment, decode_time_index, get_compression_codec_int, get_segment_format_str, is_segment_file_str, lookup_index, lookup_time_index, BLOOM_FILTER_SUFFIX_STR, INDEX_SUFFIX_STR, TIME_INDEX_SUFFIX_STR
 from kafi.helpers import get_millis, pattern_match
 
+# Constants
+
+GROUP_LOG_COMPACTION_ENTRIES = 100
+METADATA_MAX_AGE_MS = 300000
+
+#
+
 class FSAdmin(StorageAdmin):
     def __init__(self, fs_obj, **kwargs):
         super().__init__(fs_obj, **kwargs)
         #
         self.default_state_str = "stable"
+        #
+        # group.log.compaction.entries: compact the offset log of a consumer group once it has more entries than this (since the last compaction).
+        self.group_log_compaction_entries_int = int(fs_obj.kafi_config_dict["group.log.compaction.entries"]) if "group.log.compaction.entries" in fs_obj.kafi_config_dict else GROUP_LOG_COMPACTION_ENTRIES
+        #
+        # Consumer groups already checked for a legacy group file (see set_group_dict()).
+        self.migrated_group_str_set = set()
+        self.last_group_log_entry_nanos_int = 0
+        #
+        # metadata.max.age.ms: keep the metadata of a topic cached for up to this long before reading it again (0 = do not cache). The cache is invalidated by create(), delete(), config() and partitions(..., partitions=n) of this storage object.
+        self.metadata_max_age_ms_int = int(fs_obj.kafi_config_dict["metadata.max.age.ms"]) if "metadata.max.age.ms" in fs_obj.kafi_config_dict else METADATA_MAX_AGE_MS
+        #
+        # Cached topic metadata, keyed by topic: (millis when read, metadata dictionary).
+        self.topic_str_millis_int_metadata_dict_tuple_dict = {}
 
     #
 
@@ -17,7 +40,8 @@ class FSAdmin(StorageAdmin):
         root_dir_str = self.storage_obj.root_dir()
         rel_dir_str_list = self.list_dirs(os.path.join(root_dir_str, "topics"))
         #
-        all_topic_str_list = [rel_dir_str for rel_dir_str in rel_dir_str_list if not rel_dir_str.endswith("partitions")]
+        # Skip the subdirectories of the topics (partition files and manifests).
+        all_topic_str_list = [rel_dir_str for rel_dir_str in rel_dir_str_list if os.path.basename(rel_dir_str) not in ["partitions", "manifests"]]
         #
         topic_or_file_str_list = pattern_match(all_topic_str_list, pattern)
         #
@@ -27,7 +51,8 @@ class FSAdmin(StorageAdmin):
         root_dir_str = self.storage_obj.root_dir()
         rel_file_str_list = self.list_files(os.path.join(root_dir_str, "groups"))
         #
-        all_group_str_list = [rel_file_str for rel_file_str in rel_file_str_list]
+        # Skip hidden (temporary) files. Consumer groups are either directories with offset log entries ("<group>/<entry>") or legacy group files ("<group>").
+        all_group_str_list = [rel_file_str.split("/")[0] for rel_file_str in rel_file_str_list if not os.path.basename(rel_file_str).startswith(".")]
         all_group_str_set = set(all_group_str_list)
         all_group_str_list = list(all_group_str_set)
         #
@@ -63,8 +88,15 @@ class FSAdmin(StorageAdmin):
         config_dict = config
         partitions_int = partitions
         #
+        # Fail early for unsupported compression types and segment formats.
+        compression_codec_int = get_compression_codec_int(config_dict["compression.type"] if "compression.type" in config_dict else None)
+        get_segment_format_str(config_dict["segment.format"] if "segment.format" in config_dict else None, compression_codec_int)
+        #
         metadata_dict = {"topic": topic_str, "partitions": partitions_int, "config": config_dict}
         self.set_metadata(topic_str, metadata_dict)
+        #
+        for partition_int in range(partitions_int):
+            self.set_partition_manifest(topic_str, partition_int, {"segments": []})
     
     #
 
@@ -72,6 +104,8 @@ class FSAdmin(StorageAdmin):
         topic_str_list = self.list_topics(pattern)
         #
         for topic_str in topic_str_list:
+            self.invalidate_metadata(topic_str)
+            #
             topic_abs_dir_str = self.get_topic_abs_path_str(topic_str)
             #
             rel_file_str_list = self.list_files(topic_abs_dir_str)
@@ -105,24 +139,19 @@ class FSAdmin(StorageAdmin):
             topic_str_offsets_dict_dict[topic_str] = {partition_int: -1 for partition_int in range(partitions_int)}
             offsets_dict = topic_str_offsets_dict_dict[topic_str]
             #
-            abs_topic_dir_str = self.get_topic_abs_path_str(topic_str)
+            partition_int_rel_file_str_list_dict = self.get_partition_files(topic_str)
             #
             for partition_int in range(partitions_int):
-                rel_file_str = self.find_partition_file_str_by_timestamp(topic_str, partition_int, topic_str_partition_int_timestamp_int_dict_dict[topic_str][partition_int])
+                timestamp_int = topic_str_partition_int_timestamp_int_dict_dict[topic_str][partition_int]
+                rel_file_str_list = partition_int_rel_file_str_list_dict[partition_int]
+                #
+                rel_file_str = self.find_partition_file_str_by_timestamp(topic_str, partition_int, timestamp_int, rel_file_str_list)
                 #
-                if rel_file_str == -1:
+                if rel_file_str == -1 or rel_file_str is None:
                     offsets_dict[partition_int] = -1
                 else:
-                    messages_bytes = self.read_bytes(os.path.join(abs_topic_dir_str, "partitions", rel_file_str))
-                    #
-                    message_bytes_list = messages_bytes.split(b"\n")[:-1]
-                    #
-                    for message_bytes in message_bytes_list:
-                        message_dict = ast.literal_eval(message_bytes.decode("utf-8"))
-                        #
-                        if message_dict["timestamp"][1] >= offsets_dict[partition_int]:
-                            offsets_dict[partition_int] = message_dict["offset"]
-                            break
+                    # Start looking in the found partition file, and continue with the following ones if the timestamps in the file names were misleading (e.g. for non-monotonic timestamps).
+                    offsets_dict[partition_int] = self.find_offset_by_timestamp(topic_str, rel_file_str_list[rel_file_str_list.index(rel_file_str):], timestamp_int)
         #
         if replace_not_found_bool:
             topic_str_offsets_dict_dict = self.replace_not_found(topic_str_offsets_dict_dict)
@@ -141,10 +170,14 @@ class FSAdmin(StorageAdmin):
             for topic_str in topic_str_list:
                 metadata_dict = self.get_metadata(topic_str)
                 #
+                old_partitions_int = metadata_dict["partitions"]
                 metadata_dict["partitions"] = partitions_int
                 #
                 self.set_metadata(topic_str, metadata_dict)
                 #
+                for partition_int in range(old_partitions_int, partitions_int):
+                    self.set_partition_manifest(topic_str, partition_int, {"segments": []})
+                #
                 topic_str_partitions_int_dict[topic_str] = partitions_int
         #
         topic_str_partitions_int_dict = {topic_str: self.get_partitions(topic_str) for topic_str in topic_str_list}
@@ -157,27 +190,12 @@ class FSAdmin(StorageAdmin):
         topic_str_list = self.list_topics(pattern)
         filtered_topic_str_list = pattern_match(topic_str_list, pattern)
         #
-        def get_watermark_offsets(topic_str, partition_int):
-            topic_abs_dir_str = self.get_topic_abs_path_str(topic_str)
-            rel_file_str_list = self.list_files(os.path.join(topic_abs_dir_str, "partitions"))
-            partition_rel_file_str_list = [rel_file_str for rel_file_str in rel_file_str_list if int(rel_file_str.split(",")[0]) == partition_int]
-            partition_rel_file_str_list.sort()
-            low_offset_int = 0
-            high_offset_int = 0
-            if len(partition_rel_file_str_list) > 0:
-                first_partition_rel_file_str = partition_rel_file_str_list[0]
-                last_partition_rel_file_str = partition_rel_file_str_list[-1]
-                #
-                low_offset_int = int(first_partition_rel_file_str.split(",")[1])
-                high_offset_int = int(last_partition_rel_file_str.split(",")[2]) + 1
-            #
-            return (low_offset_int, high_offset_int)
-        #
-
         topic_str_partition_int_offsets_tuple_dict_dict = {}
         for topic_str in filtered_topic_str_list:
             partitions_int = self.get_partitions(topic_str)
-            partition_int_offsets_tuple_dict = {partition_int: get_watermark_offsets(topic_str, partition_int) for partition_int in range(partitions_int)}
+            # Get the watermarks of all partitions from the manifest of the topic (partitions without any partition files yet have watermarks (0, 0)).
+            partition_int_partition_dict_dict = self.get_manifest(topic_str)["partitions"]
+            partition_int_offsets_tuple_dict = {partition_int: partition_int_partition_dict_dict[partition_int]["watermarks"] if partition_int in partition_int_partition_dict_dict else (0, 0) for partition_int in range(partitions_int)}
             topic_str_partition_int_offsets_tuple_dict_dict[topic_str] = partition_int_offsets_tuple_dict
         #
         return topic_str_partition_int_offsets_tuple_dict_dict
@@ -203,10 +221,9 @@ class FSAdmin(StorageAdmin):
         #
         return file_abs_file_str
 
-    def find_partition_file_str_by_offset(self, topic_str, partition_int, to_find_offset_int):
-        # Get sorted list of all relative file names rel_file_str_list for the partition files for partition_int of topic_str.
-        topic_abs_dir_str = self.get_topic_abs_path_str(topic_str)
-        rel_file_str_list1 = self.list_files(os.path.join(topic_abs_dir_str, "partitions"))
+    def find_partition_file_str_by_offset(self, topic_str, partition_int, to_find_offset_int, rel_file_str_list=None):
+        # Get sorted list of all relative file names rel_file_str_list for the partition files for partition_int of topic_str (unless they have been passed in already).
+        rel_file_str_list1 = self.get_manifest_partition_files(topic_str) if rel_file_str_list is None else rel_file_str_list
         rel_file_str_list = [rel_file_str for rel_file_str in rel_file_str_list1 if int(rel_file_str.split(",")[0]) == partition_int]
         if rel_file_str_list == []:
             return None
@@ -223,10 +240,9 @@ class FSAdmin(StorageAdmin):
         #
         return found_rel_file_str
 
-    def find_partition_file_str_by_timestamp(self, topic_str, partition_int, to_find_timestamp_int):
-        # Get sorted list of all relative file names rel_file_str_list for the partition files for partition_int of topic_str.
-        topic_abs_dir_str = self.get_topic_abs_path_str(topic_str)
-        rel_file_str_list1 = self.list_files(os.path.join(topic_abs_dir_str, "partitions"))
+    def find_partition_file_str_by_timestamp(self, topic_str, partition_int, to_find_timestamp_int, rel_file_str_list=None):
+        # Get sorted list of all relative file names rel_file_str_list for the partition files for partition_int of topic_str (unless they have been passed in already).
+        rel_file_str_list1 = self.get_manifest_partition_files(topic_str) if rel_file_str_list is None else rel_file_str_list
         rel_file_str_list = [rel_file_str for rel_file_str in rel_file_str_list1 if int(rel_file_str.split(",")[0]) == partition_int]
         if rel_file_str_list == []:
             return -1
@@ -260,12 +276,33 @@ class FSAdmin(StorageAdmin):
         #
         return found_rel_file_str
 
-    def get_partition_files(self, topic_str):
-        topic_abs_dir_str = self.get_topic_abs_path_str(topic_str)
+    def find_offset_by_timestamp(self, topic_str, rel_file_str_list, to_find_timestamp_int):
+        # Find the offset of the first message with a timestamp >= to_find_timestamp_int in the partition files rel_file_str_list (or -1 if there is none).
+        partitions_abs_dir_str = os.path.join(self.get_topic_abs_path_str(topic_str), "partitions")
         #
+        for rel_file_str in rel_file_str_list:
+            time_index_abs_path_file_str = os.path.join(partitions_abs_dir_str, rel_file_str + TIME_INDEX_SUFFIX_STR)
+            if self.exists_file(time_index_abs_path_file_str):
+                # Binary search on the time index of the partition file.
+                timestamp_int_offset_int_tuple_list = decode_time_index(self.read_bytes(time_index_abs_path_file_str))
+                offset_int = lookup_time_index(timestamp_int_offset_int_tuple_list, to_find_timestamp_int)
+            else:
+                # Legacy partition files without time index have to be scanned.
+                offset_int = None
+                for message_dict in self.read_messages(topic_str, rel_file_str):
+                    if message_dict["timestamp"][1] >= to_find_timestamp_int:
+                        offset_int = message_dict["offset"]
+                        break
+            #
+            if offset_int is not None:
+                return offset_int
+        #
+        return -1
+
+    def get_partition_files(self, topic_str):
         partitions_int = self.get_partitions(topic_str)
         #
-        rel_file_str_list = self.list_files(os.path.join(topic_abs_dir_str, "partitions"))
+        rel_file_str_list = self.get_manifest_partition_files(topic_str)
         #
         def sort(list):
             list.sort()
@@ -276,16 +313,144 @@ class FSAdmin(StorageAdmin):
         #
         return partition_int_rel_file_str_list_dict
 
+    def list_segment_files(self, topic_str):
+        topic_abs_dir_str = self.get_topic_abs_path_str(topic_str)
+        #
+        rel_file_str_list = self.list_files(os.path.join(topic_abs_dir_str, "partitions"))
+        #
+        segment_rel_file_str_list = [rel_file_str for rel_file_str in rel_file_str_list if is_segment_file_str(rel_file_str)]
+        #
+        return segment_rel_file_str_list
+
+    # Manifest
+
+    def get_manifest(self, topic_str):
+        # Each partition has its own manifest ("manifests/<partition>") caching its partition files together with their watermarks, timestamp bounds and sizes. get_manifest() assembles them into one dict for all partitions (partitions without any partition files yet are left out) - one read per partition instead of one listing of all partition files, and the price for producers of different partitions never overwriting each other's manifests. Producers only read the manifests of the partitions they write to (see get_partition_manifest()), e.g.:
+        # {"partitions": {0: {"watermarks": (0, 3), "timestamps": (1700000000000, 1700000000042), "size": 1234, "segments": [{"name": "000000000,...", "start_offset": 0, "end_offset": 2, "start_timestamp": 1700000000000, "end_timestamp": 1700000000042, "size": 1234}]}}}
+        partitions_int = self.get_partitions(topic_str)
+        #
+        manifest_dict = {"partitions": {}}
+        for partition_int in range(partitions_int):
+            partition_dict = self.get_partition_manifest(topic_str, partition_int)
+            if len(partition_dict["segments"]) > 0:
+                manifest_dict["partitions"][partition_int] = partition_dict
+        #
+        return manifest_dict
+
+    def get_partition_manifest(self, topic_str, partition_int):
+        partition_dict = self.read_dict_from_file(self.get_manifest_abs_path_str(topic_str, partition_int))
+        #
+        if partition_dict == {}:
+            # Topics written by earlier versions of kafi do not have manifests yet - build them from the partition files (they will be persisted on the next write to the partition).
+            segment_dict_list = [rel_file_str_to_segment_dict(rel_file_str) for rel_file_str in self.list_segment_files(topic_str) if int(rel_file_str.split(",")[0]) == partition_int]
+            partition_dict = add_segments_to_manifest({"partitions": {}}, segment_dict_list)["partitions"].get(partition_int, {"segments": []})
+        #
+        return partition_dict
+
+    def set_partition_manifest(self, topic_str, partition_int, partition_dict):
+        # A single write (atomic on all backends).
+        self.write_dict_to_file(self.get_manifest_abs_path_str(topic_str, partition_int), partition_dict)
+
+    def add_segments(self, topic_str, segment_dict_list):
+        # Only the manifests of the partitions written to are read, updated and written (one write per partition), i.e. producers writing to different partitions at the same time never lose each other's partition files.
+        partition_int_segment_dict_list_dict = {}
+        for segment_dict in segment_dict_list:
+            partition_int_segment_dict_list_dict.setdefault(segment_dict["partition"], []).append(segment_dict)
+        #
+        for partition_int, partition_segment_dict_list in partition_int_segment_dict_list_dict.items():
+            partition_dict = self.get_partition_manifest(topic_str, partition_int)
+            #
+            manifest_dict = add_segments_to_manifest({"partitions": {partition_int: partition_dict} if len(partition_dict["segments"]) > 0 else {}}, partition_segment_dict_list)
+            #
+            self.set_partition_manifest(topic_str, partition_int, manifest_dict["partitions"][partition_int])
+
+    def get_manifest_partition_files(self, topic_str):
+        partition_int_partition_dict_dict = self.get_manifest(topic_str)["partitions"]
+        #
+        rel_file_str_list = [segment_dict["name"] for partition_dict in partition_int_partition_dict_dict.values() for segment_dict in partition_dict["segments"]]
+        #
+        return rel_file_str_list
+
+    def get_manifest_abs_path_str(self, topic_str, partition_int):
+        manifest_abs_path_str = os.path.join(self.get_topic_abs_path_str(topic_str), "manifests", f"{partition_int:09}")
+        #
+        return manifest_abs_path_str
+
+    # Segments
+
+    def read_messages(self, topic_str, rel_file_str, start_offset_int=0):
+        (segment_view, position_int) = self.fetch_segment(topic_str, rel_file_str, start_offset_int)
+        #
+        return decode_segment(segment_view, topic_str, position_int)
+
+    def fetch_segment(self, topic_str, rel_file_str, start_offset_int=0):
+        # Fetch a segment (without decoding it - this is the I/O-bound part of reading messages, see FSConsumer for prefetching). If the segment has an offset index and start_offset_int lies behind the first message of the segment, only fetch the segment from the last indexed message before start_offset_int on.
+        # Returns the segment and the position of the first record to decode (None = decode the whole segment including its header).
+        partitions_abs_dir_str = os.path.join(self.get_topic_abs_path_str(topic_str), "partitions")
+        abs_path_file_str = os.path.join(partitions_abs_dir_str, rel_file_str)
+        #
+        segment_start_offset_int = int(rel_file_str.split(",")[1])
+        if start_offset_int > segment_start_offset_int:
+            index_abs_path_file_str = abs_path_file_str + INDEX_SUFFIX_STR
+            if self.exists_file(index_abs_path_file_str):
+                offset_int_position_int_tuple_list = decode_index(self.read_bytes(index_abs_path_file_str))
+                position_int = lookup_index(offset_int_position_int_tuple_list, start_offset_int)
+                if position_int is not None:
+                    return self.read_view(abs_path_file_str, position_int)
+        #
+        (segment_view, _) = self.read_view(abs_path_file_str)
+        #
+        return (segment_view, None)
+
+    def read_view(self, abs_path_file_str, position_int=0):
+        # Return a bytes-like view of the file from position_int on, and the position in the view where the requested part starts. Backends which can map files into memory override this (see LocalAdmin).
+        return (self.read_bytes(abs_path_file_str, position_int), 0)
+
+    def lookup(self, topic_str, key_bytes):
+        # Find the latest message with the given (serialized) key, walking the partition files of each partition newest-first and skipping those whose Bloom filter does not contain the key.
+        # Returns the (not yet deserialized) message or None.
+        partitions_abs_dir_str = os.path.join(self.get_topic_abs_path_str(topic_str), "partitions")
+        #
+        latest_message_dict = None
+        for rel_file_str_list in self.get_partition_files(topic_str).values():
+            for rel_file_str in reversed(rel_file_str_list):
+                bloom_filter_abs_path_file_str = os.path.join(partitions_abs_dir_str, rel_file_str + BLOOM_FILTER_SUFFIX_STR)
+                # Partition files without a Bloom filter (e.g. written with bloom.filter.fpp = 0 or by earlier versions of kafi) have to be scanned.
+                if self.exists_file(bloom_filter_abs_path_file_str) and not bloom_filter_may_contain(self.read_bytes(bloom_filter_abs_path_file_str), key_bytes):
+                    continue
+                #
+                found_message_dict = None
+                for message_dict in self.read_messages(topic_str, rel_file_str):
+                    if message_dict["key"] == key_bytes:
+                        found_message_dict = message_dict
+                #
+                if found_message_dict is not None:
+                    # Keys are usually only written to one partition - otherwise, the message with the latest timestamp wins.
+                    if latest_message_dict is None or found_message_dict["timestamp"][1] > latest_message_dict["timestamp"][1]:
+                        latest_message_dict = found_message_dict
+                    break
+        #
+        return latest_message_dict
+
     #
 
     def delete_groups(self, pattern, state_pattern="*"):
         group_str_list = self.groups(pattern, state_pattern)
         #
-        root_dir_str = self.storage_obj.root_dir()
         for group_str in group_str_list:
-            group_abs_path_file_str = os.path.join(root_dir_str, "groups", f"{group_str}")
+            group_abs_dir_str = self.get_group_abs_path_str(group_str)
+            #
+            # List with a trailing slash - on S3/Azure Blob Storage, listing is by prefix, i.e. "groups/g1" would also list the entries of "groups/g10".
+            for rel_file_str in self.list_files(group_abs_dir_str + "/"):
+                self.delete_file(os.path.join(group_abs_dir_str, rel_file_str))
             #
-            self.delete_file(group_abs_path_file_str)
+            if self.exists_file(group_abs_dir_str):
+                # Legacy group file.
+                self.delete_file(group_abs_dir_str)
+            else:
+                self.delete_dir(group_abs_dir_str)
+            #
+            self.migrated_group_str_set.discard(group_str)
         #
         return group_str_list
 
@@ -330,13 +495,11 @@ class FSAdmin(StorageAdmin):
     # Metadata/Groups
 
     def read_dict_from_file(self, abs_path_file_str):
-        if self.exists_file(abs_path_file_str):
-            data_str = self.read_str(abs_path_file_str)
-            #
-            if data_str is not None:
-                data_dict = ast.literal_eval(data_str)
-            else:
-                data_dict = {}
+        # read_str() returns None if the file does not exist (saves an extra exists_file() request on object stores).
+        data_str = self.read_str(abs_path_file_str)
+        #
+        if data_str is not None:
+            data_dict = ast.literal_eval(data_str)
         else:
             data_dict = {}
         #
@@ -350,10 +513,18 @@ class FSAdmin(StorageAdmin):
     # Metadata
 
     def get_metadata(self, topic_str):
-        topic_dir_str = self.get_topic_abs_path_str(topic_str)
-        metadata_dict = self.read_dict_from_file(os.path.join(topic_dir_str, "metadata"))
+        millis_int_metadata_dict_tuple = self.topic_str_millis_int_metadata_dict_tuple_dict.get(topic_str)
+        if millis_int_metadata_dict_tuple is not None and get_millis() - millis_int_metadata_dict_tuple[0] < self.metadata_max_age_ms_int:
+            metadata_dict = millis_int_metadata_dict_tuple[1]
+        else:
+            topic_dir_str = self.get_topic_abs_path_str(topic_str)
+            metadata_dict = self.read_dict_from_file(os.path.join(topic_dir_str, "metadata"))
+            # Do not cache the (empty) metadata of topics which do not exist (yet).
+            if metadata_dict != {} and self.metadata_max_age_ms_int > 0:
+                self.topic_str_millis_int_metadata_dict_tuple_dict[topic_str] = (get_millis(), metadata_dict)
         #
-        return metadata_dict
+        # Return a copy so that callers can modify the metadata without changing the cache.
+        return metadata_dict.copy()
 
     def get_partitions(self, topic_str):
         metadata_dict = self.get_metadata(topic_str)
@@ -363,13 +534,18 @@ class FSAdmin(StorageAdmin):
 
     def get_config(self, topic_str):
         metadata_dict = self.get_metadata(topic_str)
-        config_dict = metadata_dict["config"]
+        config_dict = metadata_dict["config"].copy()
         #
         return config_dict
 
     def set_metadata(self, topic_str, metadata_dict):
         topic_dir_str = self.get_topic_abs_path_str(topic_str)
         self.write_dict_to_file(os.path.join(topic_dir_str, "metadata"), metadata_dict)
+        #
+        self.invalidate_metadata(topic_str)
+
+    def invalidate_metadata(self, topic_str):
+        self.topic_str_millis_int_metadata_dict_tuple_dict.pop(topic_str, None)
 
     # Groups
 
@@ -380,38 +556,134 @@ class FSAdmin(StorageAdmin):
         #
         return state_str
 
+    # Consumer groups are stored as append-only offset logs (like Kafka's __consumer_offsets topic): each commit (set_group_dict()) writes a new small entry "groups/<group>/<nanoseconds>,<uuid>" with just the changes,
+    # and get_group_dict() folds all entries (in the order of their names) into the current group dict. Once there are more than group.log.compaction.entries entries,
+    # get_group_dict() compacts the log by writing the folded group dict as a snapshot entry ("<name of the last folded entry>,snapshot") and deleting the folded entries.
+
     def get_group_dict(self, group_str):
-        root_dir_str = self.storage_obj.root_dir()
-        abs_path_file_str = os.path.join(root_dir_str, "groups", f"{group_str}")
+        group_abs_dir_str = self.get_group_abs_path_str(group_str)
+        #
+        entry_rel_file_str_list = [rel_file_str for rel_file_str in self.list_files(group_abs_dir_str) if not rel_file_str.startswith(".")]
+        if entry_rel_file_str_list == []:
+            # Legacy group file (or a new group).
+            return self.read_dict_from_file(group_abs_dir_str)
+        #
+        entry_rel_file_str_list.sort()
+        # Only fold the entries from the last snapshot on.
+        snapshot_index_int_list = [index_int for index_int, entry_rel_file_str in enumerate(entry_rel_file_str_list) if entry_rel_file_str.endswith(",snapshot")]
+        first_index_int = snapshot_index_int_list[-1] if snapshot_index_int_list != [] else 0
         #
-        group_dict = self.read_dict_from_file(abs_path_file_str)
+        group_dict = {}
+        for entry_rel_file_str in entry_rel_file_str_list[first_index_int:]:
+            group_dict = fold_group_dict(group_dict, self.read_dict_from_file(os.path.join(group_abs_dir_str, entry_rel_file_str)))
+        #
+        if len(entry_rel_file_str_list) - first_index_int > self.group_log_compaction_entries_int:
+            self.compact_group_log(group_abs_dir_str, entry_rel_file_str_list, group_dict)
         #
         return group_dict
 
     def set_group_dict(self, group_str, new_group_dict):
-        root_dir_str = self.storage_obj.root_dir()
-        abs_path_file_str = os.path.join(root_dir_str, "groups", f"{group_str}")
+        group_abs_dir_str = self.get_group_abs_path_str(group_str)
         #
-        group_dict = self.read_dict_from_file(abs_path_file_str)
+        if group_str not in self.migrated_group_str_set:
+            self.migrate_legacy_group_file(group_abs_dir_str)
+            self.migrated_group_str_set.add(group_str)
         #
-        if "offsets" in new_group_dict:
-            for topic_str, offsets_dict in new_group_dict["offsets"].items():
-                if "offsets" not in group_dict:
-                    group_dict["offsets"] = {}
-                if topic_str not in group_dict["offsets"]:
-                    group_dict["offsets"][topic_str] = {}
-                #
-                for partition_int, offset_int in offsets_dict.items():
-                    group_dict["offsets"][topic_str][partition_int] = offset_int
+        entry_dict = new_group_dict.copy()
+        if "last_update" not in entry_dict:
+            entry_dict["last_update"] = get_millis()
         #
-        if "last_update" in new_group_dict:
-            group_dict["last_update"] = new_group_dict["last_update"]
-        else:
-            group_dict["last_update"] = get_millis()
+        # Entries written by this storage object are strictly ordered (even within the same millisecond).
+        nanos_int = max(time.time_ns(), self.last_group_log_entry_nanos_int + 1)
+        self.last_group_log_entry_nanos_int = nanos_int
         #
-        if "state" in new_group_dict:
-            group_dict["state"] = new_group_dict["state"]
+        # A single write (no read-modify-write) - the latency of a commit does not depend on the number of commits or topics/partitions of the group.
+        self.write_dict_to_file(os.path.join(group_abs_dir_str, f"{nanos_int:019},{uuid.uuid4().hex}"), entry_dict)
         #
-        self.write_dict_to_file(abs_path_file_str, group_dict)
+        return entry_dict
+
+    def get_group_abs_path_str(self, group_str):
+        group_abs_path_str = os.path.join(self.storage_obj.root_dir(), "groups", group_str)
         #
-        return group_dict
+        return group_abs_path_str
+
+    def migrate_legacy_group_file(self, group_abs_dir_str):
+        # Move a group file written by an earlier version of kafi into the offset log (as a snapshot).
+        if self.exists_file(group_abs_dir_str):
+            group_dict = self.read_dict_from_file(group_abs_dir_str)
+            self.delete_file(group_abs_dir_str)
+            self.write_dict_to_file(os.path.join(group_abs_dir_str, f"{0:019},legacy,snapshot"), group_dict)
+
+    def compact_group_log(self, group_abs_dir_str, entry_rel_file_str_list, group_dict):
+        # Write the snapshot first (sorting right after the last folded entry) so that readers always see a consistent group dict, and only then delete the folded entries.
+        snapshot_rel_file_str = entry_rel_file_str_list[-1] if entry_rel_file_str_list[-1].endswith(",snapshot") else entry_rel_file_str_list[-1] + ",snapshot"
+        self.write_dict_to_file(os.path.join(group_abs_dir_str, snapshot_rel_file_str), group_dict)
+        #
+        for entry_rel_file_str in entry_rel_file_str_list:
+            if entry_rel_file_str != snapshot_rel_file_str:
+                # Other consumers of the group might be compacting the offset log at the same time and have already deleted the entry (compaction is best effort - entries not deleted now are deleted by the next compaction).
+                try:
+                    self.delete_file(os.path.join(group_abs_dir_str, entry_rel_file_str))
+                except Exception:
+                    pass
+
+#
+
+def rel_file_str_to_segment_dict(rel_file_str, size_int=None):
+    # Partition file names: "<partition>,<start offset>,<end offset>,<start timestamp>,<end timestamp>"
+    (partition_str, start_offset_str, end_offset_str, start_timestamp_str, end_timestamp_str) = rel_file_str.split(",")
+    #
+    segment_dict = {"name": rel_file_str, "partition": int(partition_str), "start_offset": int(start_offset_str), "end_offset": int(end_offset_str), "start_timestamp": int(start_timestamp_str), "end_timestamp": int(end_timestamp_str), "size": size_int}
+    #
+    return segment_dict
+
+
+def add_segments_to_manifest(manifest_dict, segment_dict_list):
+    partition_int_partition_dict_dict = manifest_dict["partitions"]
+    #
+    for segment_dict in segment_dict_list:
+        partition_int = segment_dict["partition"]
+        #
+        if partition_int not in partition_int_partition_dict_dict:
+            partition_int_partition_dict_dict[partition_int] = {"watermarks": (segment_dict["start_offset"], segment_dict["start_offset"]), "timestamps": (segment_dict["start_timestamp"], segment_dict["end_timestamp"]), "size": 0, "segments": []}
+        partition_dict = partition_int_partition_dict_dict[partition_int]
+        #
+        # Skip partition files already in the manifest (e.g. if the manifest of a legacy topic was just built from the partition files).
+        if any(segment_dict1["name"] == segment_dict["name"] for segment_dict1 in partition_dict["segments"]):
+            continue
+        #
+        partition_dict["segments"].append(segment_dict)
+        partition_dict["segments"].sort(key=lambda segment_dict: segment_dict["name"])
+        #
+        (low_offset_int, high_offset_int) = partition_dict["watermarks"]
+        partition_dict["watermarks"] = (min(low_offset_int, segment_dict["start_offset"]), max(high_offset_int, segment_dict["end_offset"] + 1))
+        #
+        (min_timestamp_int, max_timestamp_int) = partition_dict["timestamps"]
+        partition_dict["timestamps"] = (min(min_timestamp_int, segment_dict["start_timestamp"]), max(max_timestamp_int, segment_dict["end_timestamp"]))
+        #
+        if segment_dict["size"] is not None and partition_dict["size"] is not None:
+            partition_dict["size"] += segment_dict["size"]
+        else:
+            partition_dict["size"] = None
+    #
+    return manifest_dict
+
+
+def fold_group_dict(group_dict, entry_dict):
+    # Apply an entry of the offset log of a consumer group to the group dict (offsets are updated per partition).
+    if "offsets" in entry_dict:
+        if "offsets" not in group_dict:
+            group_dict["offsets"] = {}
+        #
+        for topic_str, offsets_dict in entry_dict["offsets"].items():
+            if topic_str not in group_dict["offsets"]:
+                group_dict["offsets"][topic_str] = {}
+            #
+            for partition_int, offset_int in offsets_dict.items():
+                group_dict["offsets"][topic_str][partition_int] = offset_int
+    #
+    for key_str in ["last_update", "state"]:
+        if key_str in entry_dict:
+            group_dict[key_str] = entry_dict[key_str]
+    #
+    return group_dict
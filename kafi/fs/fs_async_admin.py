@@ -0,0 +1,155 @@
+import ast
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import os
+
+from kafi.deserializer import Deserializer
+from kafi.fs.fs_segment import decode_segment
+
+# Constants
+
+MAX_REQUESTS = 100
+
+#
+
+class AsyncFSAdmin:
+    def __init__(self, fs_obj, **kwargs):
+        self.storage_obj = fs_obj
+        self.admin = fs_obj.admin
+        #
+        # max_requests: maximum number of object requests in flight. Backends with native coroutines (async_read_bytes() etc., see S3Admin) run them on the event loop, all others run their blocking I/O primitives in a thread pool of this size.
+        self.max_requests_int = kwargs["max_requests"] if "max_requests" in kwargs else MAX_REQUESTS
+        #
+        self.semaphore = asyncio.Semaphore(self.max_requests_int)
+        self.threadPoolExecutor = None
+        self.httpxAsyncClient = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
+
+    async def close(self):
+        if self.httpxAsyncClient is not None:
+            await self.httpxAsyncClient.aclose()
+            self.httpxAsyncClient = None
+        #
+        if self.threadPoolExecutor is not None:
+            self.threadPoolExecutor.shutdown(wait=False)
+            self.threadPoolExecutor = None
+
+    # I/O primitives
+
+    async def list_files(self, abs_path_dir_str):
+        return await self.call("list_files", abs_path_dir_str)
+
+    async def read_bytes(self, abs_path_file_str):
+        return await self.call("read_bytes", abs_path_file_str)
+
+    async def write_bytes(self, abs_path_file_str, data_bytes):
+        return await self.call("write_bytes", abs_path_file_str, data_bytes)
+
+    async def delete_file(self, abs_path_file_str):
+        return await self.call("delete_file", abs_path_file_str)
+
+    async def exists_file(self, abs_path_file_str):
+        return await self.call("exists_file", abs_path_file_str)
+
+    # Consumer/producer front-ends
+
+    async def messages(self, topic, **kwargs):
+        # Yield the (deserialized) messages of all partition files of a topic (partition by partition), keeping up to max_requests partition files in flight. Does not use/commit any consumer group offsets.
+        topic_str = topic
+        #
+        (key_type_str, value_type_str) = self.storage_obj.get_key_value_type_tuple(**kwargs)
+        deserializer = Deserializer(self.storage_obj.schema_registry_config_dict, self.storage_obj.serdeCache, self.storage_obj.schemaRegistryClient)
+        #
+        partition_int_rel_file_str_list_dict = await self.run_in_executor(self.admin.get_partition_files, topic_str)
+        partitions_abs_dir_str = os.path.join(self.admin.get_topic_abs_path_str(topic_str), "partitions")
+        abs_path_file_str_list = [os.path.join(partitions_abs_dir_str, rel_file_str) for partition_int in sorted(partition_int_rel_file_str_list_dict.keys()) for rel_file_str in partition_int_rel_file_str_list_dict[partition_int]]
+        #
+        task_deque = deque()
+        try:
+            next_index_int = 0
+            while True:
+                while next_index_int < len(abs_path_file_str_list) and len(task_deque) < self.max_requests_int:
+                    task_deque.append(asyncio.create_task(self.read_bytes(abs_path_file_str_list[next_index_int])))
+                    next_index_int += 1
+                #
+                if len(task_deque) == 0:
+                    break
+                #
+                segment_bytes = await task_deque.popleft()
+                for message_dict in decode_segment(segment_bytes, topic_str):
+                    message_dict["key"] = deserializer.deserialize(message_dict["key"], key_type_str, topic_str=topic_str, key_bool=True)
+                    message_dict["value"] = deserializer.deserialize(message_dict["value"], value_type_str, topic_str=topic_str, key_bool=False)
+                    #
+                    yield message_dict
+        finally:
+            # Cancel the pending requests if the iteration is stopped early.
+            for task in task_deque:
+                task.cancel()
+
+    async def copy_topic(self, topic, target_async_fs_admin, target_topic=None):
+        # Copy all files of a topic (metadata, partition files and their sidecars) to another (or the same) FS storage with up to max_requests requests in flight, e.g. for backups and restores. The manifests are copied last, i.e. readers of the target topic never see partition files missing.
+        topic_str = topic
+        target_topic_str = topic_str if target_topic is None else target_topic
+        #
+        if await target_async_fs_admin.run_in_executor(target_async_fs_admin.admin.list_topics, target_topic_str) != []:
+            raise Exception(f"Topic \"{target_topic_str}\" already exists.")
+        #
+        topic_abs_dir_str = self.admin.get_topic_abs_path_str(topic_str)
+        target_topic_abs_dir_str = target_async_fs_admin.admin.get_topic_abs_path_str(target_topic_str)
+        #
+        # List with a trailing slash - on S3/Azure Blob Storage, listing is by prefix, i.e. "topics/t1" would also list the files of "topics/t10".
+        rel_file_str_list = [rel_file_str for rel_file_str in await self.list_files(topic_abs_dir_str + "/") if not os.path.basename(rel_file_str).startswith(".")]
+        #
+        async def copy_file(rel_file_str):
+            data_bytes = await self.read_bytes(os.path.join(topic_abs_dir_str, rel_file_str))
+            if rel_file_str == "metadata" and target_topic_str != topic_str:
+                metadata_dict = ast.literal_eval(data_bytes.decode("utf-8"))
+                metadata_dict["topic"] = target_topic_str
+                data_bytes = str(metadata_dict).encode("utf-8")
+            await target_async_fs_admin.write_bytes(os.path.join(target_topic_abs_dir_str, rel_file_str), data_bytes)
+        #
+        await asyncio.gather(*[copy_file(rel_file_str) for rel_file_str in rel_file_str_list if not rel_file_str.startswith("manifests/")])
+        await asyncio.gather(*[copy_file(rel_file_str) for rel_file_str in rel_file_str_list if rel_file_str.startswith("manifests/")])
+        #
+        target_async_fs_admin.admin.invalidate_metadata(target_topic_str)
+        #
+        return len(rel_file_str_list)
+
+    # Helpers
+
+    async def call(self, function_str, *args):
+        async with self.semaphore:
+            async_function = getattr(self.admin, f"async_{function_str}", None)
+            if async_function is not None:
+                httpxAsyncClient = self.get_httpxAsyncClient()
+                if httpxAsyncClient is not None:
+                    return await async_function(httpxAsyncClient, *args)
+            #
+            return await self.run_in_executor(getattr(self.admin, function_str), *args)
+
+    async def run_in_executor(self, function, *args):
+        if self.threadPoolExecutor is None:
+            self.threadPoolExecutor = ThreadPoolExecutor(max_workers=self.max_requests_int)
+        #
+        return await asyncio.get_running_loop().run_in_executor(self.threadPoolExecutor, functools.partial(function, *args))
+
+    def get_httpxAsyncClient(self):
+        # The native coroutines of the storages (see e.g. S3Admin) need httpx - without it, fall back to running the blocking functions in the thread pool.
+        try:
+            import httpx
+        except ImportError:
+            return None
+        #
+
+        if self.httpxAsyncClient is None:
+            self.httpxAsyncClient = httpx.AsyncClient(limits=httpx.Limits(max_connections=self.max_requests_int, max_keepalive_connections=self.max_requests_int), timeout=None)
+        #
+        return self.httpxAsyncClient
+
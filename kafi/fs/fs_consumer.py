@@ -1,12 +1,24 @@
-import ast
-import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing
+import copy
+from functools import partial, reduce
 
+from kafi.deserializer import Deserializer
+from kafi.message import LazyMessage, Message
 from kafi.storage_consumer import StorageConsumer
+from kafi.fs.fs_segment import decode_segment
+from kafi.helpers import get_millis
 
 # Constants
 
 ALL_MESSAGES = -1
 OFFSET_INVALID = -1001
+FETCH_CONCURRENCY = 1
+AUTO_COMMIT_INTERVAL_MS = 5000
+AUTO_COMMIT_INTERVAL_MESSAGES = 10000
+AUTO_COMMIT_INTERVAL_BYTES = 10485760
+DECODE_PROCESSES = 0
 
 #
 
@@ -26,10 +38,38 @@ class FSConsumer(StorageConsumer):
                 # if there are no offsets for the topic yet, use the defaults.
                 group_dict["offsets"][topic_str] = self.next_topic_str_offsets_dict_dict[topic_str]
         self.storage_obj.admin.set_group_dict(self.group_str, group_dict)
+        #
+        # fetch.concurrency: number of threads fetching partition files concurrently (1 = fetch them one after the other while consuming).
+        # prefetch.segments: maximum number of partition files fetched ahead of the one currently consumed (default: fetch.concurrency).
+        self.fetch_concurrency_int = int(self.consumer_config_dict["fetch.concurrency"]) if "fetch.concurrency" in self.consumer_config_dict else FETCH_CONCURRENCY
+        self.prefetch_segments_int = int(self.consumer_config_dict["prefetch.segments"]) if "prefetch.segments" in self.consumer_config_dict else self.fetch_concurrency_int
+        #
+        # decode.processes: number of processes decoding and deserializing partition files in parallel (0 = decode them in the consuming thread). The messages are still passed on in the same order.
+        self.decode_processes_int = int(self.consumer_config_dict["decode.processes"]) if "decode.processes" in self.consumer_config_dict else DECODE_PROCESSES
+        self.processPoolExecutor = None
+        #
+        # Batch the commits of enable.auto.commit/commit.after.processing - commit once any of the following has been reached (and at the end of foldl() and on close()):
+        # auto.commit.interval.ms: time since the last commit.
+        # auto.commit.interval.messages: number of messages since the last commit.
+        # auto.commit.interval.bytes: number of (serialized key and value) bytes since the last commit.
+        self.auto_commit_interval_ms_int = int(self.consumer_config_dict["auto.commit.interval.ms"]) if "auto.commit.interval.ms" in self.consumer_config_dict else AUTO_COMMIT_INTERVAL_MS
+        self.auto_commit_interval_messages_int = int(self.consumer_config_dict["auto.commit.interval.messages"]) if "auto.commit.interval.messages" in self.consumer_config_dict else AUTO_COMMIT_INTERVAL_MESSAGES
+        self.auto_commit_interval_bytes_int = int(self.consumer_config_dict["auto.commit.interval.bytes"]) if "auto.commit.interval.bytes" in self.consumer_config_dict else AUTO_COMMIT_INTERVAL_BYTES
+        #
+        self.pending_topic_str_offsets_dict_dict = {}
+        self.pending_messages_int = 0
+        self.pending_bytes_int = 0
+        self.last_commit_millis_int = get_millis()
             
     #
 
     def close(self):
+        self.commit_pending()
+        #
+        if self.processPoolExecutor is not None:
+            self.processPoolExecutor.shutdown(wait=False, cancel_futures=True)
+            self.processPoolExecutor = None
+        #
         new_group_dict = {"state": "empty"}
         self.storage_obj.admin.set_group_dict(self.group_str, new_group_dict)
         #
@@ -38,6 +78,23 @@ class FSConsumer(StorageConsumer):
     #
   
     def foldl(self, foldl_function, initial_acc, n=ALL_MESSAGES, commit_after_processing=None, **kwargs):
+        acc = initial_acc
+        # Close the iterator explicitly to commit the offsets of the messages processed so far (also if foldl_function raised an exception).
+        with closing(self.iter(n, commit_after_processing, **kwargs)) as message_dict_generator:
+            for message_dict in message_dict_generator:
+                acc = foldl_function(acc, message_dict)
+        #
+        return acc
+
+    def iter(self, n=ALL_MESSAGES, commit_after_processing=None, **kwargs):
+        # Lazily yield the messages one by one (fetching one partition file at a time, or up to prefetch.segments ahead). With commit.after.processing, a message counts as processed once the caller asks for the next one.
+        try:
+            yield from self.iter_partition_files(n, commit_after_processing, **kwargs)
+        finally:
+            # Commit the offsets of the messages processed so far (also if the iteration is stopped early).
+            self.commit_pending()
+
+    def iter_partition_files(self, n=ALL_MESSAGES, commit_after_processing=None, **kwargs):
         n_int = n
         #
         commit_after_processing_bool = self.storage_obj.commit_after_processing() if commit_after_processing is None else commit_after_processing
@@ -45,8 +102,6 @@ class FSConsumer(StorageConsumer):
         auto_offset_reset_str = self.consumer_config_dict["auto.offset.reset"]
         #
         message_counter_int = 0
-        acc = initial_acc
-        rel_file_str_list = []
         for topic_str in self.topic_str_list:
             partitions_int = self.topic_str_partitions_int_dict[topic_str]
             #
@@ -82,8 +137,8 @@ class FSConsumer(StorageConsumer):
             # Get partition files for all partitions.
             partition_int_rel_file_str_list_dict = self.storage_obj.admin.get_partition_files(topic_str)
             #
-            # Get first partition files for all partitions.
-            partition_int_first_partition_rel_file_str_dict = {partition_int: self.storage_obj.admin.find_partition_file_str_by_offset(topic_str, partition_int, offset_int) for partition_int, offset_int in start_offsets_dict.items()}
+            # Get first partition files for all partitions (reusing the partition files from above instead of listing them again).
+            partition_int_first_partition_rel_file_str_dict = {partition_int: self.storage_obj.admin.find_partition_file_str_by_offset(topic_str, partition_int, offset_int, partition_int_rel_file_str_list_dict[partition_int]) for partition_int, offset_int in start_offsets_dict.items()}
             #
             # Filter out partitions not corresponding to any filee listed by get_partition_files() above.
             partition_int_first_partition_rel_file_str_dict = {partition_int: first_partition_rel_file_str for partition_int, first_partition_rel_file_str in partition_int_first_partition_rel_file_str_dict.items() if first_partition_rel_file_str is not None}
@@ -91,8 +146,13 @@ class FSConsumer(StorageConsumer):
             # Get all partition files to be consumed for all partitions.
             partition_int_to_be_consume_rel_file_str_list_dict = {partition_int: [rel_file_str for rel_file_str in rel_file_str_list if partition_int in partition_int_first_partition_rel_file_str_dict and rel_file_str >= partition_int_first_partition_rel_file_str_dict[partition_int]] for partition_int, rel_file_str_list in partition_int_rel_file_str_list_dict.items()}
             #
-            # Create list of partition files to read.
-            file_counter_int = 0
+            # Prune the partition files starting behind the end offsets (end_offsets/end_ts) - their start offsets are encoded in their names, i.e. they are never fetched.
+            end_offsets_dict = self.topic_str_end_offsets_dict_dict[topic_str] if self.topic_str_end_offsets_dict_dict is not None and topic_str in self.topic_str_end_offsets_dict_dict else None
+            if end_offsets_dict is not None:
+                partition_int_to_be_consume_rel_file_str_list_dict = {partition_int: [rel_file_str for rel_file_str in to_be_consume_rel_file_str_list if partition_int not in end_offsets_dict or int(rel_file_str.split(",")[1]) <= end_offsets_dict[partition_int]] for partition_int, to_be_consume_rel_file_str_list in partition_int_to_be_consume_rel_file_str_list_dict.items()}
+            #
+            # Create list of partition files to read (round-robin over the partitions).
+            rel_file_str_list = []
             max_num_files_int = max([len(to_be_consume_rel_file_str_list) for to_be_consume_rel_file_str_list in partition_int_to_be_consume_rel_file_str_list_dict.values()])
             #
             for file_counter_int in range(max_num_files_int):
@@ -101,53 +161,53 @@ class FSConsumer(StorageConsumer):
                         if len(partition_int_to_be_consume_rel_file_str_list_dict[partition_int]) > file_counter_int:
                             rel_file_str_list.append(partition_int_to_be_consume_rel_file_str_list_dict[partition_int][file_counter_int])
             #
-            abs_topic_dir_str = self.storage_obj.admin.get_topic_abs_path_str(topic_str)
-            for rel_file_str in rel_file_str_list:
-                messages_bytes = self.storage_obj.admin.read_bytes(os.path.join(abs_topic_dir_str, "partitions", rel_file_str))
-                #
-                message_bytes_list = messages_bytes.split(b"\n")[:-1]
-                #
-                for message_bytes in message_bytes_list:
-                    message_dict = ast.literal_eval(message_bytes.decode("utf-8"))
-                    #
-                    message_dict["key"] = self.deserialize(message_dict["key"], self.topic_str_key_type_str_dict[message_dict["topic"]], topic_str=topic_str, key_bool=True)
-                    #
-                    message_dict["value"] = self.deserialize(message_dict["value"], self.topic_str_value_type_str_dict[message_dict["topic"]], topic_str=topic_str, key_bool=False)
-                    #
+            # Only the first partition file of a partition can contain messages before the start offset - use its offset index (if any) to skip them.
+            rel_file_str_start_offset_int_tuple_list = [(rel_file_str, start_offsets_dict[int(rel_file_str.split(",")[0])] if rel_file_str == partition_int_first_partition_rel_file_str_dict[int(rel_file_str.split(",")[0])] else 0) for rel_file_str in rel_file_str_list]
+            #
+            with closing(self.decode_segments(topic_str, rel_file_str_start_offset_int_tuple_list, start_offsets_dict, end_offsets_dict)) as message_dict_message_bytes_int_tuple_generator:
+                for (message_dict, message_bytes_int) in message_dict_message_bytes_int_tuple_generator:
                     partition_int = message_dict["partition"]
                     offset_int = message_dict["offset"]
                     self.next_topic_str_offsets_dict_dict[topic_str][partition_int] = offset_int + 1
                     if self.enable_auto_commit_bool:
-                        # Commit immediately after reading the message if enable.auto.commit == True
-                        self.commit()
+                        # Commit after reading the message if enable.auto.commit == True
+                        self.auto_commit(topic_str, partition_int, offset_int, message_bytes_int)
+                    #
+                    yield message_dict
                     #
-                    if self.topic_str_end_offsets_dict_dict is not None and topic_str in self.topic_str_end_offsets_dict_dict:
-                        end_offsets_dict = self.topic_str_end_offsets_dict_dict[topic_str]
-                        if offset_int > end_offsets_dict[partition_int]:
-                            continue
+                    message_counter_int += 1
                     #
-                    if offset_int >= start_offsets_dict[partition_int]:
-                        acc = foldl_function(acc, message_dict)
-                        #
-                        message_counter_int += 1
-                        #
-                        if not self.enable_auto_commit_bool and commit_after_processing_bool:
-                            # Only commit once the message has been processed if enable.auto.commit == False and commit.after.processing == True
-                            self.commit()
+                    if not self.enable_auto_commit_bool and commit_after_processing_bool:
+                        # Only commit once the message has been processed if enable.auto.commit == False and commit.after.processing == True
+                        self.auto_commit(topic_str, partition_int, offset_int, message_bytes_int)
                     #
-                    if self.topic_str_end_offsets_dict_dict is not None and topic_str in self.topic_str_end_offsets_dict_dict:
-                        end_offsets_dict = self.topic_str_end_offsets_dict_dict[topic_str]
+                    if end_offsets_dict is not None:
                         offsets_dict = self.next_topic_str_offsets_dict_dict[topic_str]
                         if all(offsets_dict[partition_int] > end_offset_int for partition_int, end_offset_int in end_offsets_dict.items() if partition_int in offsets_dict):
-                            return acc
+                            return
                     #
                     if n_int != ALL_MESSAGES and message_counter_int >= n_int:
-                        return acc
-        #
-        return acc
+                        return
 
     #
 
+    def foldl_partitions(self, foldl_function, initial_acc, merge_function, n=ALL_MESSAGES, commit_after_processing=None, **kwargs):
+        # Like foldl(), but fold the messages of each partition separately (starting with a copy of initial_acc each), and then combine the accumulators of the partitions with merge_function(acc1, acc2).
+        topic_str_partition_int_tuple_acc_dict = {}
+        #
+        def foldl_function1(_, message_dict):
+            topic_str_partition_int_tuple = (message_dict["topic"], message_dict["partition"])
+            if topic_str_partition_int_tuple not in topic_str_partition_int_tuple_acc_dict:
+                topic_str_partition_int_tuple_acc_dict[topic_str_partition_int_tuple] = copy.deepcopy(initial_acc)
+            #
+            topic_str_partition_int_tuple_acc_dict[topic_str_partition_int_tuple] = foldl_function(topic_str_partition_int_tuple_acc_dict[topic_str_partition_int_tuple], message_dict)
+        #
+        self.foldl(foldl_function1, None, n, commit_after_processing, **kwargs)
+        #
+        acc_list = [topic_str_partition_int_tuple_acc_dict[topic_str_partition_int_tuple] for topic_str_partition_int_tuple in sorted(topic_str_partition_int_tuple_acc_dict.keys())]
+        #
+        return reduce(merge_function, acc_list, copy.deepcopy(initial_acc))
+
     def consume(self, n=ALL_MESSAGES):
         def foldl_function(message_dict_list, message_dict):
             message_dict_list.append(message_dict)
@@ -169,6 +229,8 @@ class FSConsumer(StorageConsumer):
     def commit(self, offsets=None):
         if offsets is None:
             new_group_dict = {"offsets": self.next_topic_str_offsets_dict_dict}
+            # The pending (batched) offsets are committed, too.
+            self.pending_topic_str_offsets_dict_dict = {}
             #
             topic_str_offsets_dict_dict = {topic_str: self.next_topic_str_offsets_dict_dict[topic_str] for topic_str in self.topic_str_list}
         else:
@@ -183,3 +245,131 @@ class FSConsumer(StorageConsumer):
         self.storage_obj.admin.set_group_dict(self.group_str, new_group_dict)
         #
         return topic_str_offsets_dict_dict
+
+    # Helpers
+
+    def auto_commit(self, topic_str, partition_int, offset_int, message_bytes_int):
+        # Remember the offset to commit, and only commit if any of the auto.commit.interval.* thresholds has been reached.
+        if topic_str not in self.pending_topic_str_offsets_dict_dict:
+            self.pending_topic_str_offsets_dict_dict[topic_str] = {}
+        self.pending_topic_str_offsets_dict_dict[topic_str][partition_int] = offset_int + 1
+        #
+        self.pending_messages_int += 1
+        self.pending_bytes_int += message_bytes_int
+        #
+        if self.pending_messages_int >= self.auto_commit_interval_messages_int or self.pending_bytes_int >= self.auto_commit_interval_bytes_int or get_millis() - self.last_commit_millis_int >= self.auto_commit_interval_ms_int:
+            self.commit_pending()
+
+    def commit_pending(self):
+        if self.pending_topic_str_offsets_dict_dict != {}:
+            self.commit(self.pending_topic_str_offsets_dict_dict)
+        #
+        self.pending_topic_str_offsets_dict_dict = {}
+        self.pending_messages_int = 0
+        self.pending_bytes_int = 0
+        self.last_commit_millis_int = get_millis()
+
+    def decode_segments(self, topic_str, rel_file_str_start_offset_int_tuple_list, start_offsets_dict, end_offsets_dict):
+        # Yield the (deserialized) messages of the partition files in the given order together with their serialized sizes. If decode.processes > 0, a process pool decodes and deserializes up to decode.processes partition files ahead (the messages are still yielded in the given order).
+        key_type_str = self.topic_str_key_type_str_dict[topic_str]
+        value_type_str = self.topic_str_value_type_str_dict[topic_str]
+        #
+        with closing(self.fetch_segments(topic_str, rel_file_str_start_offset_int_tuple_list)) as segment_view_position_int_tuple_generator:
+            if self.decode_processes_int <= 0:
+                for (segment_view, position_int) in segment_view_position_int_tuple_generator:
+                    yield from decode_messages(segment_view, topic_str, position_int, start_offsets_dict, end_offsets_dict, key_type_str, value_type_str, self, self.message_constructor)
+                return
+            #
+            # The decode processes deserialize the keys and values anyway (lazy messages would have to be sent back to the deserializer of this process).
+            message_class = Message if self.message_constructor is LazyMessage else self.message_constructor
+            #
+            if self.processPoolExecutor is None:
+                self.processPoolExecutor = ProcessPoolExecutor(max_workers=self.decode_processes_int, initializer=init_decode_process, initargs=(self.storage_obj.schema_registry_config_dict,))
+            #
+            future_deque = deque()
+            try:
+                for (segment_view, position_int) in segment_view_position_int_tuple_generator:
+                    # Memory-mapped partition files cannot be sent to other processes - copy them.
+                    future_deque.append(self.processPoolExecutor.submit(decode_segment_in_process, bytes(segment_view), topic_str, position_int, start_offsets_dict, end_offsets_dict, key_type_str, value_type_str, message_class))
+                    if len(future_deque) > self.decode_processes_int:
+                        yield from future_deque.popleft().result()
+                #
+                while len(future_deque) > 0:
+                    yield from future_deque.popleft().result()
+            finally:
+                # Do not decode partition files which are not needed anymore if the consumer stops early (e.g. after n messages).
+                for future in future_deque:
+                    future.cancel()
+
+    def fetch_segments(self, topic_str, rel_file_str_start_offset_int_tuple_list):
+        # Fetch the partition files in the given order. If fetch.concurrency > 1, a thread pool fetches up to prefetch.segments partition files ahead while the current one is consumed (the partition files are still returned in the given order).
+        fetch_segment_function = self.storage_obj.admin.fetch_segment
+        #
+        if self.fetch_concurrency_int <= 1 or self.prefetch_segments_int <= 0:
+            for rel_file_str, start_offset_int in rel_file_str_start_offset_int_tuple_list:
+                yield fetch_segment_function(topic_str, rel_file_str, start_offset_int)
+            return
+        #
+        threadPoolExecutor = ThreadPoolExecutor(max_workers=self.fetch_concurrency_int)
+        try:
+            future_deque = deque()
+            next_index_int = 0
+            while True:
+                # Keep the partition file currently consumed plus up to prefetch.segments partition files in flight.
+                while next_index_int < len(rel_file_str_start_offset_int_tuple_list) and len(future_deque) <= self.prefetch_segments_int:
+                    (rel_file_str, start_offset_int) = rel_file_str_start_offset_int_tuple_list[next_index_int]
+                    future_deque.append(threadPoolExecutor.submit(fetch_segment_function, topic_str, rel_file_str, start_offset_int))
+                    next_index_int += 1
+                #
+                if len(future_deque) == 0:
+                    break
+                #
+                yield future_deque.popleft().result()
+        finally:
+            # Do not wait for (and cancel) pending fetches if the consumer stops early (e.g. after n messages).
+            threadPoolExecutor.shutdown(wait=False, cancel_futures=True)
+
+#
+
+def decode_messages(segment_view, topic_str, position_int, start_offsets_dict, end_offsets_dict, key_type_str, value_type_str, deserializer, message_class=dict):
+    # Decode and deserialize the messages of a partition file, and yield them together with their serialized sizes.
+    lazy_bool = message_class is LazyMessage
+    if lazy_bool:
+        # One deserialization context for all the messages of the partition file.
+        message_class = partial(LazyMessage, (deserializer, topic_str, key_type_str, value_type_str))
+    #
+    for message_dict in decode_segment(segment_view, topic_str, position_int, message_class):
+        # Skip messages before the start offset before deserializing them.
+        if message_dict["offset"] < start_offsets_dict[message_dict["partition"]]:
+            continue
+        # Stop reading the partition file at the first message behind the end offset (the offsets within a partition file are increasing, and later partition files of the partition have been pruned).
+        if end_offsets_dict is not None and message_dict["partition"] in end_offsets_dict and message_dict["offset"] > end_offsets_dict[message_dict["partition"]]:
+            break
+        #
+        if lazy_bool:
+            message_bytes_int = (len(message_dict.key_bytes) if message_dict.key_bytes is not None else 0) + (len(message_dict.value_bytes) if message_dict.value_bytes is not None else 0)
+            #
+            yield (message_dict, message_bytes_int)
+            continue
+        #
+        message_bytes_int = (len(message_dict["key"]) if message_dict["key"] is not None else 0) + (len(message_dict["value"]) if message_dict["value"] is not None else 0)
+        #
+        message_dict["key"] = deserializer.deserialize(message_dict["key"], key_type_str, topic_str=topic_str, key_bool=True)
+        #
+        message_dict["value"] = deserializer.deserialize(message_dict["value"], value_type_str, topic_str=topic_str, key_bool=False)
+        #
+        yield (message_dict, message_bytes_int)
+
+# Decode processes (decode.processes > 0)
+
+process_deserializer = None
+
+
+def init_decode_process(schema_registry_config_dict):
+    global process_deserializer
+    # One deserializer per process (keeps its Schema Registry client and schema caches across partition files).
+    process_deserializer = Deserializer(schema_registry_config_dict)
+
+
+def decode_segment_in_process(segment_bytes, topic_str, position_int, start_offsets_dict, end_offsets_dict, key_type_str, value_type_str, message_class=dict):
+    return list(decode_messages(segment_bytes, topic_str, position_int, start_offsets_dict, end_offsets_dict, key_type_str, value_type_str, process_deserializer, message_class))
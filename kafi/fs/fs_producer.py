@@ -1,6 +1,8 @@
 import os
 
 from kafi.storage_producer import StorageProducer
+from kafi.fs.fs_admin import rel_file_str_to_segment_dict
+from kafi.fs.fs_segment import compress_segment, encode_bloom_filter, encode_columnar_segment, encode_index_entry, encode_record, encode_segment_header, encode_time_index_entry, get_codec, get_compression_codec_int, get_segment_format_str, import_pyarrow, BLOOM_FILTER_SUFFIX_STR, INDEX_SUFFIX_STR, TIME_INDEX_SUFFIX_STR
 from kafi.helpers import get_millis
 
 # Constants
@@ -8,6 +10,11 @@ from kafi.helpers import get_millis
 CURRENT_TIME = 0
 RD_KAFKA_PARTITION_UA = -1
 TIMESTAMP_CREATE_TIME = 1
+INDEX_INTERVAL_BYTES = 4096
+SEGMENT_BYTES = 1073741824
+SEGMENT_MS = 604800000
+LINGER_MS = -1
+BLOOM_FILTER_FPP = 0.01
 
 #
 
@@ -17,18 +24,62 @@ class FSProducer(StorageProducer):
         #
         if not fs_obj.exists(self.topic_str):
             fs_obj.create(self.topic_str)
+        #
+        # Producer config (overrides the topic config)
+        #
+        # segment.bytes: roll to a new partition file once the open one has reached this size.
+        # segment.ms: roll to a new partition file once the timestamps of the messages in the open one span more than this.
+        # linger.ms: keep the open partition files in memory for up to this long before writing them (0 = write them at the end of each produce() call, -1 = default = only write them when rolling to a new partition file and on flush()/close(), i.e. buffer up to segment.bytes per partition).
+        # compression.type: compress the partition files with none, gzip, snappy, lz4 or zstd.
+        # bloom.filter.fpp: false positive probability of the Bloom filters of the keys written next to the partition files (0 = do not write Bloom filters, see FS.lookup()).
+        # segment.format: write the partition files in the binary kafi format (default), or as Arrow IPC ("arrow") or Parquet ("parquet") files.
+        #
+        # Buffered messages are only written on flush()/close() (or when rolling to a new partition file or lingering for linger.ms) - producers must be closed (or flushed) explicitly, they are not flushed when garbage collected.
+        #
+        producer_config_dict = self.storage_obj.admin.get_config(self.topic_str).copy()
+        #
+        if "config" in kwargs:
+            for key_str, value in kwargs["config"].items():
+                producer_config_dict[key_str] = value
+        #
+        self.segment_bytes_int = int(producer_config_dict["segment.bytes"]) if "segment.bytes" in producer_config_dict else SEGMENT_BYTES
+        self.segment_ms_int = int(producer_config_dict["segment.ms"]) if "segment.ms" in producer_config_dict else SEGMENT_MS
+        self.linger_ms_int = int(producer_config_dict["linger.ms"]) if "linger.ms" in producer_config_dict else LINGER_MS
+        self.bloom_filter_fpp_float = float(producer_config_dict["bloom.filter.fpp"]) if "bloom.filter.fpp" in producer_config_dict else BLOOM_FILTER_FPP
+        self.index_interval_bytes_int = int(producer_config_dict["index.interval.bytes"]) if "index.interval.bytes" in producer_config_dict else INDEX_INTERVAL_BYTES
+        self.compression_codec_int = get_compression_codec_int(producer_config_dict["compression.type"] if "compression.type" in producer_config_dict else None)
+        self.segment_format_str = get_segment_format_str(producer_config_dict["segment.format"] if "segment.format" in producer_config_dict else None, self.compression_codec_int)
+        # Fail early if the codec or pyarrow is not available.
+        if self.segment_format_str != "kafi":
+            import_pyarrow(self.segment_format_str)
+        elif self.compression_codec_int != 0:
+            get_codec(self.compression_codec_int)
+        #
+        # Open (not yet written) partition files, keyed by partition.
+        self.partition_int_segment_dict_dict = {}
+        self.first_buffered_millis_int = None
+        # Next offsets of the partitions written to. They are read from the manifest of a partition when the producer first writes to it (one manifest read per partition written to, not per partition of the topic), and then kept up to date by the producer itself. Other producers might write to the same partitions, though - hence, the high watermark is checked again when a partition file is written (see write_segment()).
+        self.partition_int_offset_counter_int_dict = {}
 
     #
 
-    def produce(self, value, **kwargs):
-        partition_int_offsets_tuple_dict = self.storage_obj.watermarks(self.topic_str)[self.topic_str]
-        last_offsets_dict = {partition_int: offsets_tuple[1] for partition_int, offsets_tuple in partition_int_offsets_tuple_dict.items()}
+    def flush(self):
+        segment_dict_list = [self.write_segment(partition_int) for partition_int in list(self.partition_int_segment_dict_dict.keys())]
+        #
+        self.add_segments(segment_dict_list)
+        #
+        self.first_buffered_millis_int = None
         #
+        return self.topic_str
+
+    def produce(self, value, **kwargs):
         key = kwargs["key"] if "key" in kwargs else None
         partition = kwargs["partition"] if "partition" in kwargs else RD_KAFKA_PARTITION_UA
         timestamp = kwargs["timestamp"] if "timestamp" in kwargs else CURRENT_TIME
         headers = kwargs["headers"] if "headers" in kwargs else None
         #
+        flush_bool = kwargs["flush"] if "flush" in kwargs else False
+        #
         value_list = value if isinstance(value, list) else [value]
         #
         key_list = key if isinstance(key, list) else [key for _ in value_list]
@@ -41,10 +92,15 @@ class FSProducer(StorageProducer):
         headers_str_bytes_tuple_list_list = [self.storage_obj.headers_to_headers_str_bytes_tuple_list(headers) for headers in headers_list]
         #
         partitions_int = self.storage_obj.admin.get_partitions(self.topic_str)
-        partition_int_message_dict_list_dict = {partition_int: [] for partition_int in range(partitions_int)}
-        round_robin_counter_int = 0
-        partition_int_offset_counter_int_dict = {partition_int: last_offset_int if last_offset_int > 0 else 0 for partition_int, last_offset_int in last_offsets_dict.items()}
         #
+        partition_int_offset_counter_int_dict = self.partition_int_offset_counter_int_dict
+        partition_int_segment_dict_dict = self.partition_int_segment_dict_dict
+        serialize_function = self.serialize
+        #
+        # All messages of a produce() call without an explicit timestamp get the same timestamp.
+        current_timestamp_tuple = (TIMESTAMP_CREATE_TIME, get_millis())
+        #
+        round_robin_counter_int = 0
         for value, key, timestamp, headers_str_bytes_tuple_list, partition_int in zip(value_list, key_list, timestamp_list, headers_str_bytes_tuple_list_list, partition_int_list):
             if partition_int is RD_KAFKA_PARTITION_UA:
                 if key is None:
@@ -57,32 +113,110 @@ class FSProducer(StorageProducer):
                     partition_int = hash(str(key)) % partitions_int
             #
             if timestamp == CURRENT_TIME:
-                timestamp = (TIMESTAMP_CREATE_TIME, get_millis())
+                timestamp = current_timestamp_tuple
+            timestamp_int = timestamp[1] if isinstance(timestamp, tuple) else timestamp
+            #
+            # Serialize first (no half-added message if serialization fails).
+            key_bytes = serialize_function(key, True)
+            value_bytes = serialize_function(value, False)
+            #
+            segment_dict = partition_int_segment_dict_dict.get(partition_int)
+            if segment_dict is not None:
+                # Roll to a new partition file if the open one is full or its messages would span too much time (and register it in the manifest right away - the next partition file of the partition continues from its high watermark).
+                if len(segment_dict["bytes"]) >= self.segment_bytes_int or timestamp_int - segment_dict["start_timestamp"] > self.segment_ms_int:
+                    self.add_segments([self.write_segment(partition_int)])
+                    segment_dict = None
             #
-            message_dict = {"topic": self.topic_str, "value": value, "key": key, "timestamp": timestamp, "headers": headers_str_bytes_tuple_list, "partition": partition_int, "offset": partition_int_offset_counter_int_dict[partition_int]}
+            offset_int = partition_int_offset_counter_int_dict.get(partition_int)
+            if offset_int is None:
+                offset_int = self.read_high_watermark(partition_int)
             #
-            partition_int_message_dict_list_dict[partition_int].append(message_dict)
+            if segment_dict is None:
+                segment_dict = self.open_segment(offset_int, timestamp_int)
+                partition_int_segment_dict_dict[partition_int] = segment_dict
+                if self.first_buffered_millis_int is None:
+                    self.first_buffered_millis_int = current_timestamp_tuple[1]
             #
-            partition_int_offset_counter_int_dict[partition_int] += 1
-        #
-        topic_abs_dir_str = self.storage_obj.admin.get_topic_abs_path_str(self.topic_str)
-        for partition_int, message_dict_list in partition_int_message_dict_list_dict.items():
-            if len(message_dict_list) > 0:
-                start_timestamp_int = message_dict_list[0]["timestamp"][1]
-                end_timestamp_int = message_dict_list[-1]["timestamp"][1]
-                #
-                messages_bytes = b""
-                for message_dict in message_dict_list:
-                    message_dict["key"] = self.serialize(message_dict["key"], True)
-                    message_dict["value"] = self.serialize(message_dict["value"], False)
-                    #
-                    start_offset_int = last_offsets_dict[partition_int]
-                    end_offset_int = start_offset_int + len(message_dict_list) - 1
-                    #
-                    abs_path_file_str = os.path.join(topic_abs_dir_str, "partitions", f"{partition_int:09},{start_offset_int:021},{end_offset_int:021},{start_timestamp_int},{end_timestamp_int}")
-                    #
-                    message_bytes = str(message_dict).encode("utf-8") + b"\n"
-                    #
-                    messages_bytes += message_bytes
-                #
-                self.storage_obj.admin.write_bytes(abs_path_file_str, messages_bytes)
+            self.append_record(segment_dict, partition_int, offset_int, timestamp, key_bytes, value_bytes, headers_str_bytes_tuple_list)
+            #
+            partition_int_offset_counter_int_dict[partition_int] = offset_int + 1
+        #
+        # Write the open partition files if they have been lingering long enough (there is no background thread - this is checked on each produce() call and on flush()/close()).
+        if flush_bool or self.linger_ms_int >= 0 and self.first_buffered_millis_int is not None and get_millis() - self.first_buffered_millis_int >= self.linger_ms_int:
+            self.flush()
+
+    # Helpers
+
+    def open_segment(self, start_offset_int, timestamp_int):
+        segment_dict = {"bytes": bytearray(encode_segment_header()), "index_bytes": bytearray(), "last_index_position": None, "time_index_bytes": bytearray(), "max_timestamp": None, "key_bytes_list": [], "record_tuple_list": [], "start_offset": start_offset_int, "end_offset": None, "start_timestamp": timestamp_int, "end_timestamp": timestamp_int}
+        #
+        return segment_dict
+
+    def append_record(self, segment_dict, partition_int, offset_int, timestamp, key_bytes, value_bytes, headers_str_bytes_tuple_list):
+        timestamp_int = timestamp[1] if isinstance(timestamp, tuple) else timestamp
+        #
+        message_bytes = encode_record(offset_int, timestamp, partition_int, key_bytes, value_bytes, headers_str_bytes_tuple_list)
+        #
+        # Add a sparse offset index entry for the first message of the partition file and then every index.interval.bytes bytes.
+        position_int = len(segment_dict["bytes"])
+        if segment_dict["last_index_position"] is None or position_int - segment_dict["last_index_position"] >= self.index_interval_bytes_int:
+            segment_dict["index_bytes"] += encode_index_entry(offset_int, position_int)
+            segment_dict["last_index_position"] = position_int
+        #
+        # Add a time index entry whenever the maximum timestamp of the partition file grows.
+        if segment_dict["max_timestamp"] is None or timestamp_int > segment_dict["max_timestamp"]:
+            segment_dict["time_index_bytes"] += encode_time_index_entry(timestamp_int, offset_int)
+            segment_dict["max_timestamp"] = timestamp_int
+        #
+        segment_dict["bytes"] += message_bytes
+        if key_bytes is not None and self.bloom_filter_fpp_float > 0:
+            segment_dict["key_bytes_list"].append(key_bytes)
+        # Keep the (serialized) messages to be able to re-encode them with other offsets (see write_segment()).
+        segment_dict["record_tuple_list"].append((timestamp, key_bytes, value_bytes, headers_str_bytes_tuple_list))
+        segment_dict["end_offset"] = offset_int
+        segment_dict["end_timestamp"] = timestamp_int
+
+    def write_segment(self, partition_int):
+        segment_dict = self.partition_int_segment_dict_dict.pop(partition_int)
+        #
+        # If other producers have written to the partition since the partition file was opened, re-encode its messages to continue from their high watermark (instead of writing duplicate offsets).
+        high_watermark_int = self.read_high_watermark(partition_int)
+        if high_watermark_int != segment_dict["start_offset"]:
+            rebased_segment_dict = self.open_segment(high_watermark_int, segment_dict["start_timestamp"])
+            for offset_int, (timestamp, key_bytes, value_bytes, headers_str_bytes_tuple_list) in enumerate(segment_dict["record_tuple_list"], high_watermark_int):
+                self.append_record(rebased_segment_dict, partition_int, offset_int, timestamp, key_bytes, value_bytes, headers_str_bytes_tuple_list)
+            segment_dict = rebased_segment_dict
+        #
+        start_offset_int = segment_dict["start_offset"]
+        end_offset_int = segment_dict["end_offset"]
+        self.partition_int_offset_counter_int_dict[partition_int] = end_offset_int + 1
+        #
+        rel_file_str = f"{partition_int:09},{start_offset_int:021},{end_offset_int:021},{segment_dict['start_timestamp']},{segment_dict['end_timestamp']}"
+        abs_path_file_str = os.path.join(self.storage_obj.admin.get_topic_abs_path_str(self.topic_str), "partitions", rel_file_str)
+        #
+        # Columnar partition files are converted from the binary ones (and compressed by Arrow/Parquet itself).
+        if self.segment_format_str != "kafi":
+            segment_bytes = encode_columnar_segment(bytes(segment_dict["bytes"]), self.segment_format_str, self.compression_codec_int)
+        else:
+            segment_bytes = compress_segment(bytes(segment_dict["bytes"]), self.compression_codec_int)
+        self.storage_obj.admin.write_bytes(abs_path_file_str, segment_bytes)
+        # The byte positions in the offset index refer to the uncompressed binary records, i.e. compressed or columnar partition files cannot be read from the middle and do not get an offset index.
+        if self.compression_codec_int == 0 and self.segment_format_str == "kafi":
+            self.storage_obj.admin.write_bytes(abs_path_file_str + INDEX_SUFFIX_STR, bytes(segment_dict["index_bytes"]))
+        self.storage_obj.admin.write_bytes(abs_path_file_str + TIME_INDEX_SUFFIX_STR, bytes(segment_dict["time_index_bytes"]))
+        # Also write (empty) Bloom filters for partition files without keys - lookups can skip them, too.
+        if self.bloom_filter_fpp_float > 0:
+            self.storage_obj.admin.write_bytes(abs_path_file_str + BLOOM_FILTER_SUFFIX_STR, encode_bloom_filter(segment_dict["key_bytes_list"], self.bloom_filter_fpp_float))
+        #
+        return rel_file_str_to_segment_dict(rel_file_str, len(segment_bytes))
+
+    def read_high_watermark(self, partition_int):
+        # Only read the manifest of the partition (not those of all partitions as watermarks() does).
+        partition_dict = self.storage_obj.admin.get_partition_manifest(self.topic_str, partition_int)
+        #
+        return partition_dict["watermarks"][1] if len(partition_dict["segments"]) > 0 else 0
+
+    def add_segments(self, segment_dict_list):
+        # Register the written partition files in the manifest of the topic (one manifest write per partition).
+        if len(segment_dict_list) > 0:
+            self.storage_obj.admin.add_segments(self.topic_str, segment_dict_list)
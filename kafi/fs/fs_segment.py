@@ -0,0 +1,413 @@
+import ast
+import bisect
+import hashlib
+import math
+import struct
+
+# Constants
+
+TIMESTAMP_CREATE_TIME = 1
+
+# Binary segment format (version 1)
+#
+# Segment header:
+#   magic (4 bytes, b"KAFI") | version (int8) | attributes (int8, bits 0-2: compression codec as in Kafka, 0 = none, 1 = gzip, 2 = snappy, 3 = lz4, 4 = zstd)
+#
+# Compressed segments (attributes != 0):
+#   segment header | uncompressed length of the records (int64) | compressed records
+#
+# Record (repeated until the end of the segment):
+#   length (uint32, number of bytes following the length field)
+#   offset (int64) | timestamp type (int8) | timestamp (int64) | partition (int32)
+#   key length (int32, -1 = None) | value length (int32, -1 = None) | number of headers (int32, -1 = None)
+#   key bytes | value bytes
+#   for each header: name length (uint16) | name bytes (UTF-8) | value length (int32, -1 = None) | value bytes
+#
+# Columnar segments (topic config "segment.format" = "arrow" or "parquet"):
+#   an Arrow IPC file (starting with b"ARROW1") or a Parquet file (starting with b"PAR1") with one row per record and the columns
+#   offset (int64) | timestamp_type (int8) | timestamp (int64) | partition (int32) | key (binary) | value (binary) | headers (list of struct key (string), value (binary))
+#   Columnar segments can be opened directly by Arrow/pandas (e.g. pandas.read_parquet()), and do not get an offset index.
+#
+# Bloom filter (sidecar file "<segment>.bloom"):
+#   number of hash functions (int8) | bit array
+#   The bit positions of a key are (h1 + i * h2) mod (number of bits) for i < number of hash functions, where h1 and h2 are the two halves (uint64) of the 16-byte BLAKE2b digest of the serialized key.
+#   Messages without a key are not added. A segment whose Bloom filter does not contain a key does not contain any message with this key.
+#
+# Segments not starting with any of the magic bytes are legacy segments (one Python repr of the message dictionary per line).
+#
+# Offset index (sidecar file "<segment>.index", like Kafka's ".index" files):
+#   sparse list of entries offset (int64) | byte position of the record in the segment (int64), sorted by offset.
+#   An entry is written for the first record of a segment and then whenever at least "index.interval.bytes" bytes were written since the last entry.
+#
+# Time index (sidecar file "<segment>.timeindex", like Kafka's ".timeindex" files):
+#   list of entries timestamp (int64) | offset (int64).
+#   An entry is written whenever the maximum timestamp seen so far in the segment grows. Hence, the offset of the first entry with a timestamp >= t
+#   is exactly the offset of the first message in the segment with a timestamp >= t (even if the timestamps are not monotonic).
+
+SEGMENT_MAGIC_BYTES = b"KAFI"
+SEGMENT_VERSION_INT = 1
+
+SEGMENT_HEADER_STRUCT = struct.Struct(">4sbb")
+RECORD_LENGTH_STRUCT = struct.Struct(">I")
+RECORD_HEADER_STRUCT = struct.Struct(">qbqiiii")
+HEADER_NAME_LENGTH_STRUCT = struct.Struct(">H")
+HEADER_VALUE_LENGTH_STRUCT = struct.Struct(">i")
+RECORD_LENGTH_AND_HEADER_STRUCT = struct.Struct(">Iqbqiiii")
+INDEX_ENTRY_STRUCT = struct.Struct(">qq")
+TIME_INDEX_ENTRY_STRUCT = struct.Struct(">qq")
+UNCOMPRESSED_LENGTH_STRUCT = struct.Struct(">q")
+BLOOM_FILTER_HEADER_STRUCT = struct.Struct(">b")
+BLOOM_FILTER_HASH_STRUCT = struct.Struct(">QQ")
+
+COMPRESSION_CODEC_MASK_INT = 0x07
+COMPRESSION_TYPE_STR_COMPRESSION_CODEC_INT_DICT = {"none": 0, "uncompressed": 0, "producer": 0, "gzip": 1, "snappy": 2, "lz4": 3, "zstd": 4}
+COMPRESSION_CODEC_INT_COMPRESSION_TYPE_STR_DICT = {1: "gzip", 2: "snappy", 3: "lz4", 4: "zstd"}
+
+SEGMENT_FORMAT_STR_LIST = ["kafi", "arrow", "parquet"]
+ARROW_MAGIC_BYTES = b"ARROW1"
+PARQUET_MAGIC_BYTES = b"PAR1"
+# Arrow IPC files only support lz4 and zstd compression.
+ARROW_COMPRESSION_TYPE_STR_LIST = ["lz4", "zstd"]
+
+INDEX_SUFFIX_STR = ".index"
+TIME_INDEX_SUFFIX_STR = ".timeindex"
+BLOOM_FILTER_SUFFIX_STR = ".bloom"
+
+#
+
+def encode_segment_header(compression_codec_int=0):
+    return SEGMENT_HEADER_STRUCT.pack(SEGMENT_MAGIC_BYTES, SEGMENT_VERSION_INT, compression_codec_int)
+
+
+def encode_record(offset_int, timestamp, partition_int, key_bytes, value_bytes, headers_str_bytes_tuple_list):
+    (timestamp_type_int, timestamp_int) = timestamp if isinstance(timestamp, tuple) else (TIMESTAMP_CREATE_TIME, timestamp)
+    #
+    key_length_int = -1 if key_bytes is None else len(key_bytes)
+    value_length_int = -1 if value_bytes is None else len(value_bytes)
+    headers_length_int = -1 if headers_str_bytes_tuple_list is None else len(headers_str_bytes_tuple_list)
+    #
+    bytes_list = [RECORD_HEADER_STRUCT.pack(offset_int, timestamp_type_int, timestamp_int, partition_int, key_length_int, value_length_int, headers_length_int)]
+    if key_bytes is not None:
+        bytes_list.append(key_bytes)
+    if value_bytes is not None:
+        bytes_list.append(value_bytes)
+    if headers_str_bytes_tuple_list is not None:
+        for header_key_str, header_value_bytes in headers_str_bytes_tuple_list:
+            header_key_bytes = header_key_str.encode("utf-8")
+            bytes_list.append(HEADER_NAME_LENGTH_STRUCT.pack(len(header_key_bytes)))
+            bytes_list.append(header_key_bytes)
+            if header_value_bytes is None:
+                bytes_list.append(HEADER_VALUE_LENGTH_STRUCT.pack(-1))
+            else:
+                bytes_list.append(HEADER_VALUE_LENGTH_STRUCT.pack(len(header_value_bytes)))
+                bytes_list.append(header_value_bytes)
+    #
+    record_bytes = b"".join(bytes_list)
+    #
+    return RECORD_LENGTH_STRUCT.pack(len(record_bytes)) + record_bytes
+
+#
+
+def encode_index_entry(offset_int, position_int):
+    return INDEX_ENTRY_STRUCT.pack(offset_int, position_int)
+
+
+def decode_index(index_bytes):
+    offset_int_position_int_tuple_list = list(INDEX_ENTRY_STRUCT.iter_unpack(index_bytes))
+    #
+    return offset_int_position_int_tuple_list
+
+
+def lookup_index(offset_int_position_int_tuple_list, to_find_offset_int):
+    # Find the byte position of the last indexed record with an offset <= to_find_offset_int (or None if there is none).
+    offset_int_list = [offset_int for offset_int, _ in offset_int_position_int_tuple_list]
+    index_int = bisect.bisect_right(offset_int_list, to_find_offset_int) - 1
+    #
+    if index_int < 0:
+        return None
+    #
+    return offset_int_position_int_tuple_list[index_int][1]
+
+
+def encode_time_index_entry(timestamp_int, offset_int):
+    return TIME_INDEX_ENTRY_STRUCT.pack(timestamp_int, offset_int)
+
+
+def decode_time_index(time_index_bytes):
+    timestamp_int_offset_int_tuple_list = list(TIME_INDEX_ENTRY_STRUCT.iter_unpack(time_index_bytes))
+    #
+    return timestamp_int_offset_int_tuple_list
+
+
+def lookup_time_index(timestamp_int_offset_int_tuple_list, to_find_timestamp_int):
+    # Find the offset of the first message with a timestamp >= to_find_timestamp_int (or None if there is none).
+    timestamp_int_list = [timestamp_int for timestamp_int, _ in timestamp_int_offset_int_tuple_list]
+    index_int = bisect.bisect_left(timestamp_int_list, to_find_timestamp_int)
+    #
+    if index_int == len(timestamp_int_offset_int_tuple_list):
+        return None
+    #
+    return timestamp_int_offset_int_tuple_list[index_int][1]
+
+
+def get_bloom_filter_positions(key_bytes, num_bits_int, num_hashes_int):
+    (h1_int, h2_int) = BLOOM_FILTER_HASH_STRUCT.unpack(hashlib.blake2b(key_bytes, digest_size=16).digest())
+    #
+    return [(h1_int + i * h2_int) % num_bits_int for i in range(num_hashes_int)]
+
+
+def encode_bloom_filter(key_bytes_list, false_positive_probability_float):
+    # Size the Bloom filter for the given number of keys and false positive probability (at least one byte and one hash function).
+    num_keys_int = max(len(key_bytes_list), 1)
+    num_bits_int = max(math.ceil(-num_keys_int * math.log(false_positive_probability_float) / math.log(2) ** 2), 1)
+    num_bits_int = (num_bits_int + 7) // 8 * 8
+    num_hashes_int = min(max(round(num_bits_int / num_keys_int * math.log(2)), 1), 127)
+    #
+    bits_bytearray = bytearray(num_bits_int // 8)
+    for key_bytes in key_bytes_list:
+        for position_int in get_bloom_filter_positions(key_bytes, num_bits_int, num_hashes_int):
+            bits_bytearray[position_int >> 3] |= 1 << (position_int & 7)
+    #
+    return BLOOM_FILTER_HEADER_STRUCT.pack(num_hashes_int) + bytes(bits_bytearray)
+
+
+def bloom_filter_may_contain(bloom_filter_bytes, key_bytes):
+    (num_hashes_int,) = BLOOM_FILTER_HEADER_STRUCT.unpack_from(bloom_filter_bytes, 0)
+    bits_bytes = bloom_filter_bytes[BLOOM_FILTER_HEADER_STRUCT.size:]
+    #
+    return all(bits_bytes[position_int >> 3] & (1 << (position_int & 7)) for position_int in get_bloom_filter_positions(key_bytes, len(bits_bytes) * 8, num_hashes_int))
+
+
+def is_segment_file_str(rel_file_str):
+    # Sidecar files (e.g. offset indexes) live next to the segments and are distinguished by their suffix.
+    return "." not in rel_file_str
+
+# Compression
+
+def get_compression_codec_int(compression_type_str):
+    if compression_type_str is None:
+        return 0
+    #
+    if compression_type_str.lower() not in COMPRESSION_TYPE_STR_COMPRESSION_CODEC_INT_DICT:
+        raise Exception(f"Unsupported compression type \"{compression_type_str}\" (only {', '.join(COMPRESSION_TYPE_STR_COMPRESSION_CODEC_INT_DICT.keys())} supported).")
+    #
+    return COMPRESSION_TYPE_STR_COMPRESSION_CODEC_INT_DICT[compression_type_str.lower()]
+
+
+def get_codec(compression_codec_int):
+    # The codecs are provided by pyarrow (imported lazily - only needed for compressed segments).
+    compression_type_str = COMPRESSION_CODEC_INT_COMPRESSION_TYPE_STR_DICT[compression_codec_int]
+    #
+    try:
+        import pyarrow
+    except ImportError:
+        raise Exception(f"Compression type \"{compression_type_str}\" requires pyarrow (pip install pyarrow).")
+    #
+    if not pyarrow.Codec.is_available(compression_type_str):
+        raise Exception(f"Compression type \"{compression_type_str}\" is not available in the installed pyarrow.")
+    #
+    return pyarrow.Codec(compression_type_str)
+
+
+def compress_segment(segment_bytes, compression_codec_int):
+    # Compress all records of an uncompressed segment at once.
+    if compression_codec_int == 0:
+        return segment_bytes
+    #
+    records_bytes = segment_bytes[SEGMENT_HEADER_STRUCT.size:]
+    compressed_records_bytes = get_codec(compression_codec_int).compress(records_bytes, asbytes=True)
+    #
+    return encode_segment_header(compression_codec_int) + UNCOMPRESSED_LENGTH_STRUCT.pack(len(records_bytes)) + compressed_records_bytes
+
+
+def decompress_records(segment_bytes, compression_codec_int):
+    position_int = SEGMENT_HEADER_STRUCT.size
+    (uncompressed_length_int,) = UNCOMPRESSED_LENGTH_STRUCT.unpack_from(segment_bytes, position_int)
+    position_int += UNCOMPRESSED_LENGTH_STRUCT.size
+    #
+    records_bytes = get_codec(compression_codec_int).decompress(segment_bytes[position_int:], decompressed_size=uncompressed_length_int, asbytes=True)
+    #
+    return records_bytes
+
+# Columnar segments
+
+def get_segment_format_str(segment_format_str, compression_codec_int=0):
+    if segment_format_str is None:
+        return "kafi"
+    #
+    if segment_format_str.lower() not in SEGMENT_FORMAT_STR_LIST:
+        raise Exception(f"Unsupported segment format \"{segment_format_str}\" (only {', '.join(SEGMENT_FORMAT_STR_LIST)} supported).")
+    #
+    if segment_format_str.lower() == "arrow" and compression_codec_int != 0 and COMPRESSION_CODEC_INT_COMPRESSION_TYPE_STR_DICT[compression_codec_int] not in ARROW_COMPRESSION_TYPE_STR_LIST:
+        raise Exception(f"Segment format \"arrow\" only supports the compression types {', '.join(ARROW_COMPRESSION_TYPE_STR_LIST)}.")
+    #
+    return segment_format_str.lower()
+
+
+def import_pyarrow(segment_format_str):
+    # pyarrow is imported lazily - only needed for columnar segments.
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception(f"Segment format \"{segment_format_str}\" requires pyarrow (pip install pyarrow).")
+    #
+    return pyarrow
+
+
+def get_columnar_schema(pyarrow):
+    return pyarrow.schema([("offset", pyarrow.int64()), ("timestamp_type", pyarrow.int8()), ("timestamp", pyarrow.int64()), ("partition", pyarrow.int32()), ("key", pyarrow.binary()), ("value", pyarrow.binary()), ("headers", pyarrow.list_(pyarrow.struct([("key", pyarrow.string()), ("value", pyarrow.binary())])))])
+
+
+def encode_columnar_segment(segment_bytes, segment_format_str, compression_codec_int=0):
+    # Convert an uncompressed binary segment into an Arrow IPC or Parquet file.
+    pyarrow = import_pyarrow(segment_format_str)
+    #
+    offset_int_list = []
+    timestamp_type_int_list = []
+    timestamp_int_list = []
+    partition_int_list = []
+    key_bytes_list = []
+    value_bytes_list = []
+    headers_dict_list_list = []
+    for message_dict in decode_records(segment_bytes, None, SEGMENT_HEADER_STRUCT.size):
+        offset_int_list.append(message_dict["offset"])
+        timestamp_type_int_list.append(message_dict["timestamp"][0])
+        timestamp_int_list.append(message_dict["timestamp"][1])
+        partition_int_list.append(message_dict["partition"])
+        key_bytes_list.append(message_dict["key"])
+        value_bytes_list.append(message_dict["value"])
+        headers_dict_list_list.append(None if message_dict["headers"] is None else [{"key": header_key_str, "value": header_value_bytes} for header_key_str, header_value_bytes in message_dict["headers"]])
+    #
+    table = pyarrow.Table.from_arrays([offset_int_list, timestamp_type_int_list, timestamp_int_list, partition_int_list, key_bytes_list, value_bytes_list, headers_dict_list_list], schema=get_columnar_schema(pyarrow))
+    #
+    compression_type_str = COMPRESSION_CODEC_INT_COMPRESSION_TYPE_STR_DICT[compression_codec_int] if compression_codec_int != 0 else None
+    #
+    bufferOutputStream = pyarrow.BufferOutputStream()
+    if segment_format_str == "parquet":
+        pyarrow.parquet.write_table(table, bufferOutputStream, compression=compression_type_str or "none")
+    else:
+        with pyarrow.ipc.new_file(bufferOutputStream, table.schema, options=pyarrow.ipc.IpcWriteOptions(compression=compression_type_str)) as recordBatchFileWriter:
+            recordBatchFileWriter.write_table(table)
+    #
+    return bufferOutputStream.getvalue().to_pybytes()
+
+
+def decode_columnar_segment(segment_bytes, topic_str, segment_format_str, message_class=dict):
+    pyarrow = import_pyarrow(segment_format_str)
+    # Read the columns without copying the segment (segment_bytes can also be a memory-mapped file).
+    bufferReader = pyarrow.BufferReader(pyarrow.py_buffer(segment_bytes))
+    if segment_format_str == "parquet":
+        table = pyarrow.parquet.read_table(bufferReader)
+    else:
+        table = pyarrow.ipc.open_file(bufferReader).read_all()
+    #
+    for offset_int, timestamp_type_int, timestamp_int, partition_int, key_bytes, value_bytes, headers_dict_list in zip(*[table.column(column_str).to_pylist() for column_str in ["offset", "timestamp_type", "timestamp", "partition", "key", "value", "headers"]]):
+        headers_str_bytes_tuple_list = None if headers_dict_list is None else [(header_dict["key"], header_dict["value"]) for header_dict in headers_dict_list]
+        #
+        if message_class is dict:
+            yield {"topic": topic_str, "headers": headers_str_bytes_tuple_list, "partition": partition_int, "offset": offset_int, "timestamp": (timestamp_type_int, timestamp_int), "key": key_bytes, "value": value_bytes}
+        else:
+            yield message_class(topic_str, headers_str_bytes_tuple_list, partition_int, offset_int, (timestamp_type_int, timestamp_int), key_bytes, value_bytes)
+
+#
+
+def is_binary_segment(segment_bytes):
+    return segment_bytes[:len(SEGMENT_MAGIC_BYTES)] == SEGMENT_MAGIC_BYTES
+
+
+def decode_segment(segment_bytes, topic_str, position_int=None, message_class=dict):
+    # If position_int is given, segment_bytes is (a part of) an uncompressed binary segment, and the records are decoded from position_int on. message_class is dict or kafi.message.Message.
+    if position_int is not None:
+        return decode_records(segment_bytes, topic_str, position_int, message_class)
+    #
+    if is_binary_segment(segment_bytes):
+        (_, version_int, attributes_int) = SEGMENT_HEADER_STRUCT.unpack_from(segment_bytes, 0)
+        if version_int != SEGMENT_VERSION_INT:
+            raise Exception(f"Unsupported segment format version {version_int} (only version {SEGMENT_VERSION_INT} supported).")
+        #
+        compression_codec_int = attributes_int & COMPRESSION_CODEC_MASK_INT
+        if compression_codec_int not in COMPRESSION_CODEC_INT_COMPRESSION_TYPE_STR_DICT and compression_codec_int != 0:
+            raise Exception(f"Unsupported compression codec {compression_codec_int}.")
+        #
+        if compression_codec_int != 0:
+            return decode_records(decompress_records(segment_bytes, compression_codec_int), topic_str, 0, message_class)
+        #
+        return decode_records(segment_bytes, topic_str, SEGMENT_HEADER_STRUCT.size, message_class)
+    elif segment_bytes[:len(ARROW_MAGIC_BYTES)] == ARROW_MAGIC_BYTES:
+        return decode_columnar_segment(segment_bytes, topic_str, "arrow", message_class)
+    elif segment_bytes[:len(PARQUET_MAGIC_BYTES)] == PARQUET_MAGIC_BYTES:
+        return decode_columnar_segment(segment_bytes, topic_str, "parquet", message_class)
+    else:
+        return decode_legacy_segment(segment_bytes, message_class)
+
+
+def decode_records(segment_bytes, topic_str, position_int=0, message_class=dict):
+    # Bind the struct methods locally - this loop is the hot path when consuming from FS storages.
+    record_length_and_header_unpack_from = RECORD_LENGTH_AND_HEADER_STRUCT.unpack_from
+    record_length_and_header_struct_size_int = RECORD_LENGTH_AND_HEADER_STRUCT.size
+    record_length_struct_size_int = RECORD_LENGTH_STRUCT.size
+    header_name_length_unpack_from = HEADER_NAME_LENGTH_STRUCT.unpack_from
+    header_value_length_unpack_from = HEADER_VALUE_LENGTH_STRUCT.unpack_from
+    header_name_length_struct_size_int = HEADER_NAME_LENGTH_STRUCT.size
+    header_value_length_struct_size_int = HEADER_VALUE_LENGTH_STRUCT.size
+    #
+    segment_length_int = len(segment_bytes)
+    while position_int < segment_length_int:
+        (record_length_int, offset_int, timestamp_type_int, timestamp_int, partition_int, key_length_int, value_length_int, headers_length_int) = record_length_and_header_unpack_from(segment_bytes, position_int)
+        next_position_int = position_int + record_length_struct_size_int + record_length_int
+        position_int += record_length_and_header_struct_size_int
+        #
+        if key_length_int < 0:
+            key_bytes = None
+        else:
+            key_bytes = segment_bytes[position_int:position_int + key_length_int]
+            position_int += key_length_int
+        #
+        if value_length_int < 0:
+            value_bytes = None
+        else:
+            value_bytes = segment_bytes[position_int:position_int + value_length_int]
+            position_int += value_length_int
+        #
+        if headers_length_int < 0:
+            headers_str_bytes_tuple_list = None
+        else:
+            headers_str_bytes_tuple_list = []
+            for _ in range(headers_length_int):
+                (header_key_length_int,) = header_name_length_unpack_from(segment_bytes, position_int)
+                position_int += header_name_length_struct_size_int
+                header_key_str = str(segment_bytes[position_int:position_int + header_key_length_int], "utf-8")
+                position_int += header_key_length_int
+                #
+                (header_value_length_int,) = header_value_length_unpack_from(segment_bytes, position_int)
+                position_int += header_value_length_struct_size_int
+                if header_value_length_int < 0:
+                    header_value_bytes = None
+                else:
+                    header_value_bytes = segment_bytes[position_int:position_int + header_value_length_int]
+                    position_int += header_value_length_int
+                #
+                headers_str_bytes_tuple_list.append((header_key_str, header_value_bytes))
+        #
+        position_int = next_position_int
+        #
+        if message_class is dict:
+            yield {"topic": topic_str, "headers": headers_str_bytes_tuple_list, "partition": partition_int, "offset": offset_int, "timestamp": (timestamp_type_int, timestamp_int), "key": key_bytes, "value": value_bytes}
+        else:
+            yield message_class(topic_str, headers_str_bytes_tuple_list, partition_int, offset_int, (timestamp_type_int, timestamp_int), key_bytes, value_bytes)
+
+
+def decode_legacy_segment(segment_bytes, message_class=dict):
+    # Iterate over the lines without splitting the whole segment (segment_bytes can also be a memory-mapped file).
+    position_int = 0
+    while True:
+        newline_position_int = segment_bytes.find(b"\n", position_int)
+        if newline_position_int < 0:
+            break
+        #
+        message_dict = ast.literal_eval(segment_bytes[position_int:newline_position_int].decode("utf-8"))
+        position_int = newline_position_int + 1
+        #
+        yield message_dict if message_class is dict else message_class(**message_dict)
@@ -1,4 +1,6 @@
+import mmap
 import os
+import tempfile
 
 from kafi.fs.fs_admin import FSAdmin
 
@@ -39,14 +41,14 @@ class LocalAdmin(FSAdmin):
         os.rmdir(abs_path_dir_str)
 
     def exists_file(self, abs_path_file_str):
-        return os.path.exists(abs_path_file_str)
+        return os.path.isfile(abs_path_file_str)
 
     # Metadata
     
     def read_str(self, abs_path_file_str):
         str = None
         #
-        if os.path.exists(abs_path_file_str):
+        if os.path.isfile(abs_path_file_str):
             with open(abs_path_file_str, "r") as bufferedReader:
                 str = bufferedReader.read()
         #
@@ -54,18 +56,31 @@ class LocalAdmin(FSAdmin):
 
     def write_str(self, abs_path_file_str, data_str):
         os.makedirs(os.path.dirname(abs_path_file_str), exist_ok=True)
-        #
-        with open(abs_path_file_str, "w") as bufferedWriter:
+        # Write to a temporary file first and then atomically replace the target file (readers never see partially written metadata/manifests).
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(abs_path_file_str), prefix=".", delete=False) as bufferedWriter:
             bufferedWriter.write(data_str)
+        os.replace(bufferedWriter.name, abs_path_file_str)
 
     #
 
-    def read_bytes(self, abs_path_file_str):
+    def read_bytes(self, abs_path_file_str, position_int=0, length_int=-1):
         with open(abs_path_file_str, "rb") as bufferedReader:
-            bytes = bufferedReader.read()
+            if position_int > 0:
+                bufferedReader.seek(position_int)
+            bytes = bufferedReader.read(length_int)
         #
         return bytes
 
+    def read_view(self, abs_path_file_str, position_int=0):
+        # Memory-map the file instead of reading it (no copy of the whole file - only the slices taken from the map are materialized).
+        with open(abs_path_file_str, "rb") as bufferedReader:
+            if os.fstat(bufferedReader.fileno()).st_size == 0:
+                return (b"", 0)
+            #
+            view = mmap.mmap(bufferedReader.fileno(), 0, access=mmap.ACCESS_READ)
+        #
+        return (view, position_int)
+
     def write_bytes(self, abs_path_file_str, data_bytes):
         os.makedirs(os.path.dirname(abs_path_file_str), exist_ok=True)
         #
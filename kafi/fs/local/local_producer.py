@@ -8,5 +8,6 @@ class LocalProducer(FSProducer):
     #
 
     def close(self):
+        self.flush()
         return self.topic_str
 
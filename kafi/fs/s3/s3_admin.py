@@ -1,8 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
 import io
 import os
 
 from kafi.fs.fs_admin import FSAdmin
 
+# Constants
+
+POOL_MAXSIZE = 10
+PART_SIZE = 8388608
+UPLOAD_CONCURRENCY = 4
+DOWNLOAD_CONCURRENCY = 4
+CONNECT_TIMEOUT = 300
+READ_TIMEOUT = 300
+
 #
 
 class S3Admin(FSAdmin):
@@ -12,7 +22,15 @@ class S3Admin(FSAdmin):
 
         super().__init__(s3_obj)
         #
-        self.minio = Minio(s3_obj.s3_config_dict["endpoint"], access_key=s3_obj.s3_config_dict["access.key"], secret_key=s3_obj.s3_config_dict["secret.key"], secure=False)
+        # One long-lived (thread-safe) client with a connection pool for all requests of this storage object.
+        self.minio = Minio(s3_obj.s3_config_dict["endpoint"], access_key=s3_obj.s3_config_dict["access.key"], secret_key=s3_obj.s3_config_dict["secret.key"], secure=False, http_client=get_poolManager(s3_obj.s3_config_dict))
+        #
+        # part.size: size of the parts of multipart uploads and ranged downloads (at least 5 MiB).
+        # upload.concurrency: number of parts uploaded in parallel.
+        # download.concurrency: number of parts downloaded in parallel.
+        self.part_size_int = int(s3_obj.s3_config_dict["part.size"]) if "part.size" in s3_obj.s3_config_dict else PART_SIZE
+        self.upload_concurrency_int = int(s3_obj.s3_config_dict["upload.concurrency"]) if "upload.concurrency" in s3_obj.s3_config_dict else UPLOAD_CONCURRENCY
+        self.download_concurrency_int = int(s3_obj.s3_config_dict["download.concurrency"]) if "download.concurrency" in s3_obj.s3_config_dict else DOWNLOAD_CONCURRENCY
 
     # Topics/Files
 
@@ -53,8 +71,20 @@ class S3Admin(FSAdmin):
     # Metadata
     
     def read_str(self, abs_path_file_str):
-        response = self.minio.get_object(self.storage_obj.bucket_name(), abs_path_file_str)
-        object_bytes = response.data
+        from minio.error import S3Error
+        #
+
+        try:
+            response = self.minio.get_object(self.storage_obj.bucket_name(), abs_path_file_str)
+        except S3Error as e:
+            if e.code == "NoSuchKey":
+                return None
+            raise
+        try:
+            object_bytes = response.data
+        finally:
+            response.close()
+            response.release_conn()
         #
         object_str = object_bytes.decode("utf-8")
         #
@@ -67,21 +97,93 @@ class S3Admin(FSAdmin):
 
     #
 
-    def read_bytes(self, abs_path_file_str):
-        from minio import Minio
+    def read_bytes(self, abs_path_file_str, position_int=0, length_int=-1):
+        # Read the first part - the response also tells us the size of the object.
+        first_length_int = self.part_size_int if length_int <= 0 else min(length_int, self.part_size_int)
+        (first_part_bytes, object_size_int) = self.read_range(abs_path_file_str, position_int, first_length_int)
         #
-
-        self.minio = Minio(self.storage_obj.s3_config_dict["endpoint"], access_key=self.storage_obj.s3_config_dict["access.key"], secret_key=self.storage_obj.s3_config_dict["secret.key"], secure=False)
+        end_position_int = object_size_int if length_int <= 0 else min(object_size_int, position_int + length_int)
+        next_position_int = position_int + len(first_part_bytes)
+        if next_position_int >= end_position_int:
+            return first_part_bytes
         #
-        response = self.minio.get_object(self.storage_obj.bucket_name(), abs_path_file_str)
-        object_bytes = response.data
+        # Read the remaining parts of larger objects with parallel ranged GETs.
+        position_int_length_int_tuple_list = [(part_position_int, min(self.part_size_int, end_position_int - part_position_int)) for part_position_int in range(next_position_int, end_position_int, self.part_size_int)]
+        with ThreadPoolExecutor(max_workers=self.download_concurrency_int) as threadPoolExecutor:
+            part_bytes_list = list(threadPoolExecutor.map(lambda position_int_length_int_tuple: self.read_range(abs_path_file_str, *position_int_length_int_tuple)[0], position_int_length_int_tuple_list))
         #
-        return object_bytes
+        return b"".join([first_part_bytes] + part_bytes_list)
 
     def write_bytes(self, abs_path_file_str, data_bytes):
-        from minio import Minio
+        # Objects larger than part.size are uploaded as multipart uploads with upload.concurrency parallel part uploads.
+        self.minio.put_object(self.storage_obj.bucket_name(), abs_path_file_str, io.BytesIO(data_bytes), length=len(data_bytes), part_size=self.part_size_int, num_parallel_uploads=self.upload_concurrency_int)
+
+    # Native coroutines for AsyncFSAdmin (presigned URLs requested with the httpx client of AsyncFSAdmin - no blocking calls on the event loop, no threads).
+
+    async def async_read_bytes(self, httpxAsyncClient, abs_path_file_str):
+        response = await httpxAsyncClient.get(self.minio.presigned_get_object(self.storage_obj.bucket_name(), abs_path_file_str))
+        response.raise_for_status()
         #
+        return response.content
 
-        self.minio = Minio(self.storage_obj.s3_config_dict["endpoint"], access_key=self.storage_obj.s3_config_dict["access.key"], secret_key=self.storage_obj.s3_config_dict["secret.key"], secure=False)
+    async def async_write_bytes(self, httpxAsyncClient, abs_path_file_str, data_bytes):
+        response = await httpxAsyncClient.put(self.minio.presigned_put_object(self.storage_obj.bucket_name(), abs_path_file_str), content=data_bytes)
+        response.raise_for_status()
+
+    async def async_delete_file(self, httpxAsyncClient, abs_path_file_str):
+        response = await httpxAsyncClient.delete(self.minio.get_presigned_url("DELETE", self.storage_obj.bucket_name(), abs_path_file_str))
+        response.raise_for_status()
+
+    async def async_exists_file(self, httpxAsyncClient, abs_path_file_str):
+        response = await httpxAsyncClient.head(self.minio.get_presigned_url("HEAD", self.storage_obj.bucket_name(), abs_path_file_str))
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
         #
-        self.minio.put_object(self.storage_obj.bucket_name(), abs_path_file_str, io.BytesIO(data_bytes), length=len(data_bytes))
+        return True
+
+    # Helpers
+
+    def read_range(self, abs_path_file_str, position_int, length_int):
+        from minio.error import S3Error
+        #
+
+        try:
+            response = self.minio.get_object(self.storage_obj.bucket_name(), abs_path_file_str, offset=position_int, length=length_int)
+        except S3Error as e:
+            # Ranged GETs on empty objects fail.
+            if e.code == "InvalidRange":
+                return (b"", position_int)
+            raise
+        try:
+            range_bytes = response.data
+            content_range_str = response.headers.get("Content-Range")
+        finally:
+            # Return the connection to the pool.
+            response.close()
+            response.release_conn()
+        #
+        # Content-Range: bytes <start>-<end>/<size>
+        object_size_int = int(content_range_str.split("/")[-1]) if content_range_str is not None else position_int + len(range_bytes)
+        #
+        return (range_bytes, object_size_int)
+
+#
+
+def get_poolManager(s3_config_dict):
+    import socket
+    import urllib3
+    #
+
+    # pool.maxsize: maximum number of pooled (keep-alive) connections to the S3 endpoint (should be >= fetch.concurrency of the consumers).
+    pool_maxsize_int = int(s3_config_dict["pool.maxsize"]) if "pool.maxsize" in s3_config_dict else POOL_MAXSIZE
+    # keep.alive: enable TCP keep-alive on the pooled connections (so that idle connections are not silently dropped by NATs/load balancers).
+    keep_alive_bool = str(s3_config_dict["keep.alive"]).lower() == "true" if "keep.alive" in s3_config_dict else True
+    connect_timeout_float = float(s3_config_dict["connect.timeout"]) if "connect.timeout" in s3_config_dict else CONNECT_TIMEOUT
+    read_timeout_float = float(s3_config_dict["read.timeout"]) if "read.timeout" in s3_config_dict else READ_TIMEOUT
+    #
+    socket_options_tuple_list = urllib3.connection.HTTPConnection.default_socket_options + ([(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)] if keep_alive_bool else [])
+    #
+    poolManager = urllib3.PoolManager(maxsize=pool_maxsize_int, block=False, socket_options=socket_options_tuple_list, timeout=urllib3.Timeout(connect=connect_timeout_float, read=read_timeout_float), retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]))
+    #
+    return poolManager
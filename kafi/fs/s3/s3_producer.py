@@ -7,5 +7,6 @@ class S3Producer(FSProducer):
     #
 
     def close(self):
+        self.flush()
         return self.topic_str
 
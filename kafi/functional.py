@@ -1,3 +1,4 @@
+from contextlib import closing
 import time
 from kafi.helpers import zip2
 
@@ -32,6 +33,27 @@ class Functional:
         #
         return acc_consume_message_counter_int_tuple
 
+    def stream(self, topic, n=ALL_MESSAGES, **kwargs):
+        # Like foldl(), but lazily yield the messages instead of folding them (constant memory, the first messages are available immediately). The consumer is closed once the iteration ends or the generator is closed.
+        verbose_int = self.verbose()
+        #
+        progress_num_messages_int = self.progress_num_messages()
+        #
+        consumer = self.consumer(topic, **kwargs)
+        #
+        try:
+            consume_message_counter_int = 0
+            # Close the iterator of the consumer first to commit the offsets of the messages processed so far.
+            with closing(consumer.iter(n, **kwargs)) as message_dict_generator:
+                for message_dict in message_dict_generator:
+                    yield message_dict
+                    #
+                    consume_message_counter_int += 1
+                    if verbose_int > 0 and consume_message_counter_int % progress_num_messages_int == 0:
+                        print(f"Read: {consume_message_counter_int}")
+        finally:
+            consumer.close()
+
     #
 
     def flatmap(self, topic, flatmap_function, n=ALL_MESSAGES, **kwargs):
@@ -73,6 +95,9 @@ class Functional:
             #
             (acc, message_dict_list) = foldl_to_function(acc, message_dict)
             #
+            if remap_schema_ids_function is not None:
+                message_dict_list = [remap_schema_ids_function(message_dict) for message_dict in message_dict_list]
+            #
             consume_message_counter_int += 1
             if verbose_int > 0 and consume_message_counter_int % progress_num_messages_int == 0:
                 print(f"Read: {consume_message_counter_int}")
@@ -95,13 +120,20 @@ class Functional:
         #
         target_kwargs = self.copy_kwargs("target", **kwargs)
         #
+        (source_kwargs, target_kwargs, remap_schema_ids_function) = self.get_raw_kwargs(source_kwargs, target_kwargs, target_storage, target_topic, **kwargs)
+        #
         produce_batch_size_int = kwargs["produce_batch_size"] if "produce_batch_size" in kwargs else target_storage.produce_batch_size()
         #
         consumer = self.consumer(topic, **source_kwargs)
         #
         target_producer = target_storage.producer(target_topic, **target_kwargs)
         #
-        (acc, consume_message_counter_int, _, produce_batch_message_dict_list, produce_message_counter_int) = consumer.foldl(foldl_to_function1, (initial_acc, 0, produce_batch_size_int, [], 0), n, **kwargs)
+        try:
+            (acc, consume_message_counter_int, _, produce_batch_message_dict_list, produce_message_counter_int) = consumer.foldl(foldl_to_function1, (initial_acc, 0, produce_batch_size_int, [], 0), n, **kwargs)
+        except Exception:
+            # Still write the messages produced so far (the offsets of the messages they were produced from might already be committed).
+            target_producer.close()
+            raise
         #
         consumer.close()
         #
@@ -321,3 +353,50 @@ class Functional:
             copied_kwargs["value_schema_id"] = kwargs[f"{name_str}_value_schema_id"]
         #
         return copied_kwargs
+
+    def get_raw_kwargs(self, source_kwargs, target_kwargs, target_storage, target_topic, **kwargs):
+        # raw: copy the key, value and header bytes untouched (no deserialization/serialization, e.g. for backups/restores).
+        # schema_ids: in raw mode, replace the schema IDs of keys/values in the Schema Registry wire format according to this dictionary (source schema ID -> target schema ID).
+        # remap_schema_ids: in raw mode, register the schemas of all other schema IDs with the target Schema Registry (under the subjects of the target topic) and replace them with the IDs returned.
+        raw_bool = kwargs["raw"] if "raw" in kwargs else False
+        if not raw_bool:
+            return (source_kwargs, target_kwargs, None)
+        #
+        (raw_source_kwargs, raw_target_kwargs) = [{key_str: value for key_str, value in kwargs1.items() if key_str not in ["key_type", "value_type", "key_schema", "value_schema", "key_schema_id", "value_schema_id"]} | {"type": "bytes"} for kwargs1 in [source_kwargs, target_kwargs]]
+        #
+        schema_id_int_target_schema_id_int_dict = kwargs["schema_ids"] if "schema_ids" in kwargs else None
+        remap_schema_ids_bool = kwargs["remap_schema_ids"] if "remap_schema_ids" in kwargs else False
+        if schema_id_int_target_schema_id_int_dict is None and not remap_schema_ids_bool:
+            return (raw_source_kwargs, raw_target_kwargs, None)
+        #
+        # Cache the target schema IDs (keyed by source schema ID and key/value).
+        schema_id_int_key_bool_tuple_target_schema_id_int_dict = {}
+        #
+        def remap_schema_id(payload_bytes, key_bool):
+            # Schema Registry wire format: magic byte 0 | schema ID (int32) | payload
+            if payload_bytes is None or len(payload_bytes) < 5 or payload_bytes[0] != 0:
+                return payload_bytes
+            #
+            schema_id_int = int.from_bytes(payload_bytes[1:5], "big")
+            #
+            if (schema_id_int, key_bool) not in schema_id_int_key_bool_tuple_target_schema_id_int_dict:
+                if schema_id_int_target_schema_id_int_dict is not None and schema_id_int in schema_id_int_target_schema_id_int_dict:
+                    target_schema_id_int = schema_id_int_target_schema_id_int_dict[schema_id_int]
+                elif remap_schema_ids_bool:
+                    if self.schemaRegistryClient.get_schema(schema_id_int).references:
+                        raise Exception(f"Schema ID {schema_id_int} has references, which remap_schema_ids does not register with the target Schema Registry (use schema_ids instead).")
+                    #
+                    target_schema_id_int = target_storage.register_schema(target_storage.create_subject_name_str(target_topic, key_bool), self.get_schema(schema_id_int))
+                else:
+                    target_schema_id_int = schema_id_int
+                schema_id_int_key_bool_tuple_target_schema_id_int_dict[(schema_id_int, key_bool)] = target_schema_id_int
+            #
+            return payload_bytes[:1] + schema_id_int_key_bool_tuple_target_schema_id_int_dict[(schema_id_int, key_bool)].to_bytes(4, "big") + payload_bytes[5:]
+        #
+        def remap_schema_ids_function(message_dict):
+            message_dict["key"] = remap_schema_id(message_dict["key"], True)
+            message_dict["value"] = remap_schema_id(message_dict["value"], False)
+            #
+            return message_dict
+        #
+        return (raw_source_kwargs, raw_target_kwargs, remap_schema_ids_function)
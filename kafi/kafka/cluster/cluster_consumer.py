@@ -1,6 +1,7 @@
 from confluent_kafka import Consumer, TopicPartition
 
 from kafi.kafka.kafka_consumer import KafkaConsumer
+from kafi.message import LazyMessage
 
 # Constants
 
@@ -72,13 +73,17 @@ class ClusterConsumer(KafkaConsumer):
         for message in message_list:
             if message.error() is None:
                 try:
-                    message_dict = {"topic": message.topic(),
-                                "headers": message.headers(),
-                                "partition": message.partition(),
-                                "offset": message.offset(),
-                                "timestamp": message.timestamp(),
-                                "key": self.deserialize(message.key(), self.topic_str_key_type_str_dict[message.topic()], topic_str=message.topic(), key_bool=True),
-                                "value": self.deserialize(message.value(), self.topic_str_value_type_str_dict[message.topic()], topic_str=message.topic(), key_bool=False)}
+                    if self.message_constructor is LazyMessage:
+                        # Keep the serialized key and value - they are deserialized when they are read.
+                        message_dict = LazyMessage(self.topic_str_deserialization_context_tuple_dict[message.topic()], message.topic(), message.headers(), message.partition(), message.offset(), message.timestamp(), message.key(), message.value())
+                    else:
+                        message_dict = self.message_constructor(topic=message.topic(),
+                                    headers=message.headers(),
+                                    partition=message.partition(),
+                                    offset=message.offset(),
+                                    timestamp=message.timestamp(),
+                                    key=self.deserialize(message.key(), self.topic_str_key_type_str_dict[message.topic()], topic_str=message.topic(), key_bool=True),
+                                    value=self.deserialize(message.value(), self.topic_str_value_type_str_dict[message.topic()], topic_str=message.topic(), key_bool=False))
                 except Exception as e:
                     raise Exception(f"Error consuming topic(s) {self.topic_str_list}: {e}, topic: {message.topic()}, partition: {message.partition()}, offset: {message.offset()}") from e
             else:
@@ -1,3 +1,5 @@
+from contextlib import closing
+
 from kafi.storage_consumer import StorageConsumer
 
 # Constants
@@ -13,10 +15,25 @@ class KafkaConsumer(StorageConsumer):
     #
 
     def foldl(self, foldl_function, initial_acc, n=ALL_MESSAGES, commit_after_processing=None, **kwargs):
+        break_function = kwargs["break_function"] if "break_function" in kwargs else lambda _, _1: False
+        #
+        acc = initial_acc
+        # Close the iterator explicitly to commit the offsets of the messages processed so far (also if foldl_function raised an exception).
+        with closing(self.iter(n, commit_after_processing, **kwargs)) as message_dict_generator:
+            for message_dict in message_dict_generator:
+                if break_function(acc, message_dict):
+                    break
+                #
+                acc = foldl_function(acc, message_dict)
+        #
+        return acc
+
+    def iter(self, n=ALL_MESSAGES, commit_after_processing=None, **kwargs):
+        # Lazily yield the messages one by one (consuming one batch of consume_batch_size messages at a time). With commit.after.processing, the offsets of the messages processed so far (i.e. those the caller has asked for the next message after) are committed before the next batch is consumed and when the iteration ends or is stopped early.
         n_int = n
         #
         if n_int == 0:
-            return initial_acc
+            return
         #
         commit_after_processing_bool = self.storage_obj.commit_after_processing() if commit_after_processing is None else commit_after_processing
         #
@@ -24,58 +41,51 @@ class KafkaConsumer(StorageConsumer):
         if n != ALL_MESSAGES and consume_batch_size_int > n_int:
             consume_batch_size_int = n_int
         #
-        break_function = kwargs["break_function"] if "break_function" in kwargs else lambda _, _1: False
-        #
-        topic_str_partitions_int_dict = self.storage_obj.partitions(self.topic_str_list)
-        topic_str_offsets_dict_dict = {topic_str: {partition_int: 0 for partition_int in range(partitions_int)} for topic_str, partitions_int in topic_str_partitions_int_dict.items()}
+        # Only the offsets of the partitions actually consumed from are committed.
+        topic_str_offsets_dict_dict = {topic_str: {} for topic_str in self.topic_str_list}
         #
         message_counter_int = 0
-        #
-        acc = initial_acc
-        break_bool = False
-        while True:
-            message_dict_list = self.consume_impl(n=consume_batch_size_int, **kwargs)
-            if not message_dict_list:
-                break
-            #
-            for message_dict in message_dict_list:
-                topic_str = message_dict["topic"]
-                partition_int = message_dict["partition"]
-                offset_int = message_dict["offset"]
-                #
-                offsets_dict = topic_str_offsets_dict_dict[topic_str]
-                #
-                offsets_dict[partition_int] = offset_int + 1
-                #
-                if self.topic_str_end_offsets_dict_dict is not None and topic_str in self.topic_str_end_offsets_dict_dict:
-                    end_offsets_dict = self.topic_str_end_offsets_dict_dict[topic_str]
-                    if offset_int > end_offsets_dict[partition_int]:
-                        continue
-                #
-                if break_function(acc, message_dict):
-                    break_bool = True
+        uncommitted_bool = False
+        try:
+            while True:
+                message_dict_list = self.consume_impl(n=consume_batch_size_int, **kwargs)
+                if not message_dict_list:
                     break
                 #
-                acc = foldl_function(acc, message_dict)
-                message_counter_int += 1
-                #
-                if self.topic_str_end_offsets_dict_dict is not None and topic_str in self.topic_str_end_offsets_dict_dict:
-                    end_offsets_dict = self.topic_str_end_offsets_dict_dict[topic_str]
-                    if all(offsets_dict[partition_int] > end_offset_int for partition_int, end_offset_int in end_offsets_dict.items()):
-                        break_bool = True
-                        break
+                for message_dict in message_dict_list:
+                    topic_str = message_dict["topic"]
+                    partition_int = message_dict["partition"]
+                    offset_int = message_dict["offset"]
+                    #
+                    offsets_dict = topic_str_offsets_dict_dict[topic_str]
+                    #
+                    if self.topic_str_end_offsets_dict_dict is not None and topic_str in self.topic_str_end_offsets_dict_dict:
+                        end_offsets_dict = self.topic_str_end_offsets_dict_dict[topic_str]
+                        if offset_int > end_offsets_dict[partition_int]:
+                            offsets_dict[partition_int] = offset_int + 1
+                            continue
+                    #
+                    yield message_dict
+                    #
+                    offsets_dict[partition_int] = offset_int + 1
+                    uncommitted_bool = True
+                    message_counter_int += 1
+                    #
+                    if self.topic_str_end_offsets_dict_dict is not None and topic_str in self.topic_str_end_offsets_dict_dict:
+                        end_offsets_dict = self.topic_str_end_offsets_dict_dict[topic_str]
+                        # Partitions not consumed from yet count as being at offset 0.
+                        if all(offsets_dict.get(partition_int, 0) > end_offset_int for partition_int, end_offset_int in end_offsets_dict.items()):
+                            return
+                    #
+                    if n_int != ALL_MESSAGES and message_counter_int >= n_int:
+                        return
                 #
-                if n_int != ALL_MESSAGES and message_counter_int >= n_int:
-                    break_bool = True
-                    break
-            #
-            if not self.enable_auto_commit_bool and commit_after_processing_bool:
-                self.commit(topic_str_offsets_dict_dict)
-            #
-            if break_bool:
-                break
-        #
-        return acc
+                if not self.enable_auto_commit_bool and commit_after_processing_bool and uncommitted_bool:
+                    self.commit({topic_str: offsets_dict for topic_str, offsets_dict in topic_str_offsets_dict_dict.items() if offsets_dict != {}})
+                    uncommitted_bool = False
+        finally:
+            if not self.enable_auto_commit_bool and commit_after_processing_bool and uncommitted_bool:
+                self.commit({topic_str: offsets_dict for topic_str, offsets_dict in topic_str_offsets_dict_dict.items() if offsets_dict != {}})
 
     #
 
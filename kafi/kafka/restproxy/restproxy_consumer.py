@@ -1,4 +1,5 @@
 from kafi.kafka.kafka_consumer import KafkaConsumer
+from kafi.message import LazyMessage, Message
 
 from kafi.helpers import get, delete, post, base64_decode
 
@@ -10,6 +11,10 @@ class RestProxyConsumer(KafkaConsumer):
         #
         self.cluster_id_str = restproxy_obj.cluster_id_str
         #
+        # The REST Proxy already deserializes the keys and values (except for "bytes" and "str").
+        if self.message_constructor is LazyMessage:
+            self.message_constructor = Message
+        #
         # Consumer Config
         #
         if "fetch.min.bytes" not in self.consumer_config_dict:
@@ -147,7 +152,7 @@ class RestProxyConsumer(KafkaConsumer):
         for _ in range(0, self.storage_obj.consume_num_attempts()):
             response_dict = get(url_str, headers_dict, auth_str_tuple=auth_str_tuple, retries_int=self.storage_obj.requests_num_retries(), debug_bool=self.storage_obj.verbose() >= 2)
             #
-            message_dict_list += [{"headers": None, "topic": rest_message_dict["topic"], "partition": rest_message_dict["partition"], "offset": rest_message_dict["offset"], "timestamp": None, "key": decode(rest_message_dict["key"], True), "value": decode(rest_message_dict["value"], False)} for rest_message_dict in response_dict]
+            message_dict_list += [self.message_constructor(headers=None, topic=rest_message_dict["topic"], partition=rest_message_dict["partition"], offset=rest_message_dict["offset"], timestamp=None, key=decode(rest_message_dict["key"], True), value=decode(rest_message_dict["value"], False)) for rest_message_dict in response_dict]
         #
         return message_dict_list
 
@@ -0,0 +1,136 @@
+class Message:
+    # Compact alternative to the message dictionaries returned by the consumers (see the "message.class" setting) - no per-message dictionary, but still accessible like one (message["value"], message.keys(), dict(message) etc.).
+    __slots__ = ("topic", "headers", "partition", "offset", "timestamp", "key", "value")
+
+    def __init__(self, topic=None, headers=None, partition=None, offset=None, timestamp=None, key=None, value=None):
+        self.topic = topic
+        self.headers = headers
+        self.partition = partition
+        self.offset = offset
+        self.timestamp = timestamp
+        self.key = key
+        self.value = value
+
+    def __getitem__(self, key_str):
+        if key_str not in Message.__slots__:
+            raise KeyError(key_str)
+        #
+        return getattr(self, key_str)
+
+    def __setitem__(self, key_str, value):
+        if key_str not in Message.__slots__:
+            raise KeyError(key_str)
+        #
+        setattr(self, key_str, value)
+
+    def __contains__(self, key_str):
+        return key_str in Message.__slots__
+
+    def __iter__(self):
+        return iter(Message.__slots__)
+
+    def __len__(self):
+        return len(Message.__slots__)
+
+    def __eq__(self, other):
+        if isinstance(other, (Message, dict)):
+            return self.to_dict() == dict(other)
+        #
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    #
+
+    def keys(self):
+        return list(Message.__slots__)
+
+    def values(self):
+        return [getattr(self, key_str) for key_str in Message.__slots__]
+
+    def items(self):
+        return [(key_str, getattr(self, key_str)) for key_str in Message.__slots__]
+
+    def get(self, key_str, default=None):
+        return getattr(self, key_str) if key_str in Message.__slots__ else default
+
+    def copy(self):
+        return Message(self.topic, self.headers, self.partition, self.offset, self.timestamp, self.key, self.value)
+
+    def to_dict(self):
+        return {key_str: getattr(self, key_str) for key_str in Message.__slots__}
+
+    def is_null(self, key_str):
+        return self[key_str] is None
+
+#
+
+# Marks keys/values of LazyMessage objects which have not been deserialized yet.
+NOT_DESERIALIZED = object()
+
+MESSAGE_KEY_SLOT = Message.key
+MESSAGE_VALUE_SLOT = Message.value
+
+
+class LazyMessage(Message):
+    # Message record which keeps the serialized key and value, and only deserializes them when they are read for the first time (message["value"], message.value, dict(message) etc.). The deserialized key/value is cached, and the serialized one released.
+    __slots__ = ("deserialization_context", "key_bytes", "value_bytes")
+
+    def __init__(self, deserialization_context, topic=None, headers=None, partition=None, offset=None, timestamp=None, key=None, value=None):
+        # deserialization_context: (deserializer, topic_str, key_type_str, value_type_str) - shared by all the messages of a partition file/topic.
+        self.deserialization_context = deserialization_context
+        self.topic = topic
+        self.headers = headers
+        self.partition = partition
+        self.offset = offset
+        self.timestamp = timestamp
+        self.key_bytes = key
+        self.value_bytes = value
+        MESSAGE_KEY_SLOT.__set__(self, NOT_DESERIALIZED)
+        MESSAGE_VALUE_SLOT.__set__(self, NOT_DESERIALIZED)
+
+    @property
+    def key(self):
+        key = MESSAGE_KEY_SLOT.__get__(self)
+        if key is NOT_DESERIALIZED:
+            (deserializer, topic_str, key_type_str, _) = self.deserialization_context
+            key = deserializer.deserialize(self.key_bytes, key_type_str, topic_str=topic_str, key_bool=True)
+            MESSAGE_KEY_SLOT.__set__(self, key)
+            self.key_bytes = None
+        #
+        return key
+
+    @key.setter
+    def key(self, key):
+        MESSAGE_KEY_SLOT.__set__(self, key)
+        self.key_bytes = None
+
+    @property
+    def value(self):
+        value = MESSAGE_VALUE_SLOT.__get__(self)
+        if value is NOT_DESERIALIZED:
+            (deserializer, topic_str, _, value_type_str) = self.deserialization_context
+            value = deserializer.deserialize(self.value_bytes, value_type_str, topic_str=topic_str, key_bool=False)
+            MESSAGE_VALUE_SLOT.__set__(self, value)
+            self.value_bytes = None
+        #
+        return value
+
+    @value.setter
+    def value(self, value):
+        MESSAGE_VALUE_SLOT.__set__(self, value)
+        self.value_bytes = None
+
+    #
+
+    def is_null(self, key_str):
+        # Check for null keys/values (e.g. tombstones) without deserializing them.
+        if key_str == "key" and MESSAGE_KEY_SLOT.__get__(self) is NOT_DESERIALIZED:
+            return self.key_bytes is None
+        elif key_str == "value" and MESSAGE_VALUE_SLOT.__get__(self) is NOT_DESERIALIZED:
+            return self.value_bytes is None
+        #
+        return self[key_str] is None
@@ -1,15 +1,39 @@
+import base64
+import binascii
+from collections import OrderedDict
+import hashlib
+import importlib
+import os
+import tempfile
+import threading
+
 from confluent_kafka.schema_registry import Schema, SchemaRegistryClient
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+from google.protobuf.message import DecodeError
 
 from kafi.helpers import pattern_match, get, delete
 
+# Constants
+
+SERDE_CACHE_SIZE = 1000
+
+#
+
 class SchemaRegistry:
-    def __init__(self, schema_registry_config_dict):
+    def __init__(self, schema_registry_config_dict, serdeCache=None, schemaRegistryClient=None):
         self.schema_registry_config_dict = schema_registry_config_dict
         #
         if self.schema_registry_config_dict == {}:
             self.schemaRegistryClient = None
+        elif schemaRegistryClient is not None:
+            self.schemaRegistryClient = schemaRegistryClient
         else:
             self.schemaRegistryClient = self.get_schemaRegistryClient()
+        # Separate client for fetching Protobuf schemas as serialized FileDescriptorProtos (see get_serializedSchemaRegistryClient()).
+        self.serializedSchemaRegistryClient = None
+        #
+        # Cache for the (de)serializer objects of the Schema Registry formats (Avro, Protobuf and JSONSchema). Producers and consumers share the cache (and the Schema Registry client) of their storage object.
+        self.serdeCache = SerdeCache(SERDE_CACHE_SIZE) if serdeCache is None else serdeCache
 
     def get_schemaRegistryClient(self):
         dict = {}
@@ -18,9 +42,20 @@ class SchemaRegistry:
         if "basic.auth.user.info" in self.schema_registry_config_dict:
             dict["basic.auth.user.info"] = self.schema_registry_config_dict["basic.auth.user.info"]
         #
-        schemaRegistryClient = SchemaRegistryClient(dict)
+        # new_client() also supports "mock://" URLs (in-memory Schema Registry, e.g. for benchmarks).
+        schemaRegistryClient = SchemaRegistryClient.new_client(dict)
         return schemaRegistryClient
 
+    def get_serializedSchemaRegistryClient(self):
+        # The client caches the schemas by ID (and subject/version) only, regardless of their format - fetching the serialized format with the shared client would make get_schema() etc. return the serialized format from then on, too. The in-memory Schema Registry ("mock://") ignores the format and does not share its schemas across clients.
+        if self.serializedSchemaRegistryClient is None:
+            if self.schema_registry_config_dict["schema.registry.url"].startswith("mock://"):
+                self.serializedSchemaRegistryClient = self.schemaRegistryClient
+            else:
+                self.serializedSchemaRegistryClient = self.get_schemaRegistryClient()
+        #
+        return self.serializedSchemaRegistryClient
+
     def get_schema(self, schema_id):
         # No additional caching necessary here:
         # get_schema(schema_id)[source]
@@ -219,6 +254,192 @@ class SchemaRegistry:
     def test_comp(self, subject_name, schema, version="latest"):
         return self.test_compatibility(subject_name, schema, version)
 
+    # Protobuf
+
+    def schema_id_int_and_schema_str_to_generalizedProtocolMessageType(self, schema_id_int, schema_str):
+        # Build the message class for a Protobuf schema (text) in memory - no generated Python modules.
+        return self.protobuf_schema_to_generalizedProtocolMessageType(Schema(schema_str, "PROTOBUF"), f"schema_{schema_id_int}.proto")
+
+    def schema_id_int_to_protobuf_generalizedProtocolMessageType_schema_str_tuple(self, schema_id_int):
+        # Fetch the schema as a serialized FileDescriptorProto if the Schema Registry supports it (no compilation necessary).
+        schema = self.get_serializedSchemaRegistryClient().get_schema(schema_id_int, fmt="serialized")
+        #
+        generalizedProtocolMessageType = self.protobuf_schema_to_generalizedProtocolMessageType(schema, f"schema_{schema_id_int}.proto")
+        #
+        return generalizedProtocolMessageType, schema.schema_str
+
+    def protobuf_schema_to_generalizedProtocolMessageType(self, schema, name_str):
+        fileDescriptorProto_list = self.protobuf_schema_to_fileDescriptorProto_list(schema, name_str)
+        #
+        # One descriptor pool per schema (different versions of a schema define the same message types).
+        descriptorPool = descriptor_pool.DescriptorPool()
+        added_name_str_set = set()
+        for fileDescriptorProto in fileDescriptorProto_list:
+            add_fileDescriptorProto(descriptorPool, fileDescriptorProto, added_name_str_set)
+        #
+        fileDescriptor = descriptorPool.FindFileByName(fileDescriptorProto_list[-1].name)
+        messageDescriptor = list(fileDescriptor.message_types_by_name.values())[0]
+        generalizedProtocolMessageType = message_factory.GetMessageClass(messageDescriptor)
+        #
+        return generalizedProtocolMessageType
+
+    def protobuf_schema_to_fileDescriptorProto_list(self, schema, name_str):
+        # Get the FileDescriptorProtos of the schema and (recursively) of the schemas it references, dependencies first.
+        (fileDescriptorProto_list, name_str_schema_str_dict) = self.resolve_protobuf_references(schema)
+        #
+        fileDescriptorProto = serialized_schema_str_to_fileDescriptorProto(schema.schema_str)
+        if fileDescriptorProto is not None:
+            fileDescriptorProto.name = name_str
+            fileDescriptorProto_list.append(fileDescriptorProto)
+        else:
+            fileDescriptorProto_list += compile_protobuf_schema(schema.schema_str, name_str, name_str_schema_str_dict, self.schema_registry_config_dict.get("protobuf.descriptor.cache.dir"))
+        #
+        return fileDescriptorProto_list
+
+    def resolve_protobuf_references(self, schema):
+        fileDescriptorProto_list = []
+        name_str_schema_str_dict = {}
+        #
+        for schemaReference in schema.references if schema.references is not None else []:
+            if schemaReference.name in name_str_schema_str_dict:
+                continue
+            #
+            referenced_schema = self.get_serializedSchemaRegistryClient().get_version(schemaReference.subject, schemaReference.version, fmt="serialized").schema
+            (referenced_fileDescriptorProto_list, referenced_name_str_schema_str_dict) = self.resolve_protobuf_references(referenced_schema)
+            fileDescriptorProto_list += referenced_fileDescriptorProto_list
+            name_str_schema_str_dict.update(referenced_name_str_schema_str_dict)
+            name_str_schema_str_dict[schemaReference.name] = referenced_schema.schema_str
+            #
+            fileDescriptorProto = serialized_schema_str_to_fileDescriptorProto(referenced_schema.schema_str)
+            if fileDescriptorProto is not None:
+                fileDescriptorProto.name = schemaReference.name
+                fileDescriptorProto_list.append(fileDescriptorProto)
+        #
+        return fileDescriptorProto_list, name_str_schema_str_dict
+
+#
+
+class SerdeCache:
+    # Thread-safe LRU cache for (de)serializer objects, e.g. keyed by ("avro", "deserializer", schema_id_int). Building them parses the schema, i.e. they should not be built per message. A size of 0 disables the cache.
+    def __init__(self, size_int):
+        self.size_int = size_int
+        #
+        self.key_tuple_serde_ordereddict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key_tuple):
+        with self.lock:
+            serde = self.key_tuple_serde_ordereddict.get(key_tuple)
+            if serde is not None:
+                self.key_tuple_serde_ordereddict.move_to_end(key_tuple)
+            #
+            return serde
+
+    def put(self, key_tuple, serde):
+        with self.lock:
+            self.key_tuple_serde_ordereddict[key_tuple] = serde
+            self.key_tuple_serde_ordereddict.move_to_end(key_tuple)
+            self.evict()
+
+    def resize(self, size_int):
+        with self.lock:
+            self.size_int = size_int
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.key_tuple_serde_ordereddict.clear()
+
+    def evict(self):
+        # Evict the least recently used (de)serializers.
+        while len(self.key_tuple_serde_ordereddict) > max(self.size_int, 0):
+            self.key_tuple_serde_ordereddict.popitem(last=False)
+
+    def __len__(self):
+        return len(self.key_tuple_serde_ordereddict)
+
+#
+
+def serialized_schema_str_to_fileDescriptorProto(schema_str):
+    # Schemas fetched with format "serialized" (or registered by the confluent_kafka Protobuf serializer) are base64-encoded FileDescriptorProtos, all others are Protobuf text.
+    try:
+        fileDescriptorProto = descriptor_pb2.FileDescriptorProto()
+        fileDescriptorProto.ParseFromString(base64.b64decode(schema_str, validate=True))
+    except (binascii.Error, DecodeError, ValueError):
+        return None
+    #
+    return fileDescriptorProto
+
+
+def compile_protobuf_schema(schema_str, name_str, name_str_schema_str_dict, cache_dir_str=None):
+    # Compile a Protobuf schema (text) and the schemas it imports to FileDescriptorProtos (in-process, without generating Python code). If cache_dir_str is set, the results are cached on disk (keyed by the hash of the schemas), i.e. other processes do not have to compile the schema again.
+    hash_str = hashlib.sha256(repr((schema_str, name_str, sorted(name_str_schema_str_dict.items()))).encode("utf-8")).hexdigest()
+    cache_file_str = None if cache_dir_str is None else os.path.join(cache_dir_str, f"{hash_str}.desc")
+    #
+    if cache_file_str is not None and os.path.exists(cache_file_str):
+        with open(cache_file_str, "rb") as bufferedReader:
+            fileDescriptorSet_bytes = bufferedReader.read()
+    else:
+        import grpc_tools
+        import grpc_tools.protoc
+        #
+
+        with tempfile.TemporaryDirectory(prefix="kafi_protobuf_") as path_str:
+            for file_str, schema_str1 in list(name_str_schema_str_dict.items()) + [(name_str, schema_str)]:
+                os.makedirs(os.path.dirname(os.path.join(path_str, file_str)), exist_ok=True)
+                with open(os.path.join(path_str, file_str), "w") as textIOWrapper:
+                    textIOWrapper.write(schema_str1)
+            #
+            # Also include the well-known types (google/protobuf/*.proto) shipped with grpc_tools.
+            well_known_path_str = os.path.join(os.path.dirname(grpc_tools.__file__), "_proto")
+            descriptor_set_file_str = os.path.join(path_str, f"{hash_str}.desc")
+            if grpc_tools.protoc.main(["protoc", f"-I{path_str}", f"-I{well_known_path_str}", "--include_imports", f"--descriptor_set_out={descriptor_set_file_str}", name_str]) != 0:
+                raise Exception(f"Could not compile Protobuf schema \"{name_str}\".")
+            #
+            with open(descriptor_set_file_str, "rb") as bufferedReader:
+                fileDescriptorSet_bytes = bufferedReader.read()
+        #
+        if cache_file_str is not None:
+            os.makedirs(cache_dir_str, exist_ok=True)
+            # Write atomically (other processes might read the cache file concurrently).
+            temp_cache_file_str = f"{cache_file_str}.{os.getpid()}.tmp"
+            with open(temp_cache_file_str, "wb") as bufferedWriter:
+                bufferedWriter.write(fileDescriptorSet_bytes)
+            os.replace(temp_cache_file_str, cache_file_str)
+    #
+    fileDescriptorSet = descriptor_pb2.FileDescriptorSet()
+    fileDescriptorSet.ParseFromString(fileDescriptorSet_bytes)
+    #
+    return list(fileDescriptorSet.file)
+
+
+def add_fileDescriptorProto(descriptorPool, fileDescriptorProto, added_name_str_set):
+    if fileDescriptorProto.name in added_name_str_set:
+        return
+    #
+    # Dependencies not resolved via the Schema Registry are well-known types (google/protobuf/*.proto etc.) - take them from the default descriptor pool.
+    for dependency_name_str in fileDescriptorProto.dependency:
+        if dependency_name_str not in added_name_str_set:
+            add_fileDescriptorProto(descriptorPool, get_well_known_fileDescriptorProto(dependency_name_str), added_name_str_set)
+    #
+    descriptorPool.Add(fileDescriptorProto)
+    added_name_str_set.add(fileDescriptorProto.name)
+
+
+def get_well_known_fileDescriptorProto(name_str):
+    if name_str.startswith("google/protobuf/"):
+        importlib.import_module(f"google.protobuf.{os.path.basename(name_str)[:-len('.proto')]}_pb2")
+    #
+    try:
+        fileDescriptor = descriptor_pool.Default().FindFileByName(name_str)
+    except KeyError:
+        raise Exception(f"Could not resolve Protobuf import \"{name_str}\".")
+    #
+    fileDescriptorProto = descriptor_pb2.FileDescriptorProto()
+    fileDescriptor.CopyToProto(fileDescriptorProto)
+    #
+    return fileDescriptorProto
+
 #
 
 def registeredSchema_to_registeredSchema_dict(registeredSchema):
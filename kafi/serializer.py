@@ -1,8 +1,4 @@
-import importlib
 import json
-import os
-import sys
-import tempfile
 
 from confluent_kafka.schema_registry.avro import AvroSerializer
 from confluent_kafka.schema_registry.json_schema import JSONSerializer
@@ -15,8 +11,10 @@ from kafi.schemaregistry import SchemaRegistry
 from kafi.helpers import to_bytes
 
 class Serializer(SchemaRegistry):
-    def __init__(self, schema_registry_config_dict):
-        super().__init__(schema_registry_config_dict)
+    def __init__(self, schema_registry_config_dict, serdeCache=None, schemaRegistryClient=None):
+        super().__init__(schema_registry_config_dict, serdeCache, schemaRegistryClient)
+        #
+        self.key_bool_normalize_schemas_bool_tuple_serde_key_tuple_dict = {}
 
     def serialize(self, payload, key_bool, normalize_schemas=False):
         type_str = self.key_type_str if key_bool else self.value_type_str
@@ -54,22 +52,22 @@ class Serializer(SchemaRegistry):
             if type_str.lower() in ["bytes", "str", "json"]:
                 serialized_payload_bytes = to_bytes(payload)
             elif type_str.lower() in ["pb", "protobuf"]:
-                schema = get_schema_str()
-                generalizedProtocolMessageType = self.schema_str_to_generalizedProtocolMessageType(schema, self.topic_str, key_bool, normalize_schemas)
-                protobufSerializer = ProtobufSerializer(generalizedProtocolMessageType, self.schemaRegistryClient, {"use.deprecated.format": False})
+                def create_protobufSerializer_generalizedProtocolMessageType_tuple():
+                    schema = get_schema_str()
+                    generalizedProtocolMessageType = self.schema_str_to_generalizedProtocolMessageType(schema, self.topic_str, key_bool, normalize_schemas)
+                    return (ProtobufSerializer(generalizedProtocolMessageType, self.schemaRegistryClient, {"use.deprecated.format": False}), generalizedProtocolMessageType)
+                (protobufSerializer, generalizedProtocolMessageType) = self.get_serializer("protobuf", key_bool, normalize_schemas, create_protobufSerializer_generalizedProtocolMessageType_tuple)
                 payload_dict = payload_to_payload_dict()
                 protobuf_message = generalizedProtocolMessageType()
                 ParseDict(payload_dict, protobuf_message)
                 serialized_payload_bytes = protobufSerializer(protobuf_message, SerializationContext(self.topic_str, messageField))
             elif type_str.lower() == "avro":
-                schema = get_schema_str()
-                avroSerializer = AvroSerializer(self.schemaRegistryClient, schema)
+                avroSerializer = self.get_serializer("avro", key_bool, normalize_schemas, lambda: AvroSerializer(self.schemaRegistryClient, get_schema_str()))
                 payload_dict = payload_to_payload_dict()
                 serialized_payload_bytes = avroSerializer(payload_dict, SerializationContext(self.topic_str, messageField))
             elif type_str.lower() in ["jsonschema", "json_sr"]:
                 payload_dict = payload_to_payload_dict()
-                schema = get_schema_str()
-                jSONSerializer = JSONSerializer(schema, self.schemaRegistryClient)
+                jSONSerializer = self.get_serializer("jsonschema", key_bool, normalize_schemas, lambda: JSONSerializer(get_schema_str(), self.schemaRegistryClient))
                 serialized_payload_bytes = jSONSerializer(payload_dict, SerializationContext(self.topic_str, messageField))
             else:
                 raise Exception("Only \"bytes\", \"str\", \"json\", \"avro\", \"protobuf\" (\"pb\") and \"jsonschema\" (\"json_sr\") supported.")
@@ -78,6 +76,26 @@ class Serializer(SchemaRegistry):
 
     # Helpers
 
+    def get_serializer(self, type_str, key_bool, normalize_schemas, create_serializer_function):
+        # Get the serializer for the key/value from the serde cache (or build and cache it).
+        if (key_bool, normalize_schemas) not in self.key_bool_normalize_schemas_bool_tuple_serde_key_tuple_dict:
+            # The key/value schema of a producer does not change - only build the cache key once.
+            schema_str_or_dict = self.key_schema_str_or_dict if key_bool else self.value_schema_str_or_dict
+            if schema_str_or_dict is None:
+                schema_key = self.key_schema_id_int if key_bool else self.value_schema_id_int
+            else:
+                schema_key = schema_str_or_dict if isinstance(schema_str_or_dict, str) else json.dumps(schema_str_or_dict)
+            #
+            self.key_bool_normalize_schemas_bool_tuple_serde_key_tuple_dict[(key_bool, normalize_schemas)] = (type_str, "serializer", self.topic_str, key_bool, normalize_schemas, schema_key)
+        #
+        serde_key_tuple = self.key_bool_normalize_schemas_bool_tuple_serde_key_tuple_dict[(key_bool, normalize_schemas)]
+        serializer = self.serdeCache.get(serde_key_tuple)
+        if serializer is None:
+            serializer = create_serializer_function()
+            self.serdeCache.put(serde_key_tuple, serializer)
+        #
+        return serializer
+
     def schema_str_to_generalizedProtocolMessageType(self, schema_str, topic_str, key_bool, normalize_schemas=False):
         schema_hash_int = hash(schema_str)
         if schema_hash_int in self.schema_hash_int_generalizedProtocolMessageType_dict:
@@ -92,20 +110,3 @@ class Serializer(SchemaRegistry):
             self.schema_hash_int_generalizedProtocolMessageType_dict[schema_hash_int] = generalizedProtocolMessageType
         #
         return generalizedProtocolMessageType
-
-    def schema_id_int_and_schema_str_to_generalizedProtocolMessageType(self, schema_id_int, schema_str):
-        path_str = f"/{tempfile.gettempdir()}/kafi/protobuf/{self.storage_obj.config_str}"
-        os.makedirs(path_str, exist_ok=True)
-        file_str = f"schema_{schema_id_int}.proto"
-        file_path_str = f"{path_str}/{file_str}"
-        with open(file_path_str, "w") as textIOWrapper:
-            textIOWrapper.write(schema_str)
-        #
-        import grpc_tools.protoc
-        grpc_tools.protoc.main(["protoc", f"-I{path_str}", f"--python_out={path_str}", f"{file_str}"])
-        #
-        sys.path.insert(1, path_str)
-        schema_module = importlib.import_module(f"schema_{schema_id_int}_pb2")
-        schema_name_str = list(schema_module.DESCRIPTOR.message_types_by_name.keys())[0]
-        generalizedProtocolMessageType = getattr(schema_module, schema_name_str)
-        return generalizedProtocolMessageType
@@ -7,7 +7,7 @@ from piny import YamlLoader
 from kafi.shell import Shell
 from kafi.files import Files
 from kafi.addons import AddOns
-from kafi.schemaregistry import SchemaRegistry
+from kafi.schemaregistry import SERDE_CACHE_SIZE, SchemaRegistry
 from kafi.helpers import bytes_or_str_to_bytes, hash_dict, is_interactive
 
 class Storage(Shell, Files, AddOns, SchemaRegistry):
@@ -76,6 +76,16 @@ class Storage(Shell, Files, AddOns, SchemaRegistry):
             self.value_type("json")
         else:
             self.value_type(str(self.kafi_config_dict["value.type"]))
+        # "dict" (default), "record" (compact kafi.message.Message objects which can be accessed like the dictionaries) or "lazy" (kafi.message.LazyMessage records only deserializing their keys/values when they are read).
+        if "message.class" not in self.kafi_config_dict:
+            self.message_class("dict")
+        else:
+            self.message_class(str(self.kafi_config_dict["message.class"]))
+        # Maximum number of cached Avro/Protobuf/JSONSchema (de)serializers (shared by all producers and consumers of this storage object, 0 = build them per message).
+        if "serde.cache.size" not in self.kafi_config_dict:
+            self.serde_cache_size(SERDE_CACHE_SIZE)
+        else:
+            self.serde_cache_size(int(self.kafi_config_dict["serde.cache.size"]))
 
     #
 
@@ -109,6 +119,15 @@ class Storage(Shell, Files, AddOns, SchemaRegistry):
     def value_type(self, new_value=None): # str
         return self.get_set_config("value.type", new_value)
 
+    def message_class(self, new_value=None): # str
+        return self.get_set_config("message.class", new_value)
+
+    def serde_cache_size(self, new_value=None): # int
+        if new_value is not None:
+            self.serdeCache.resize(new_value)
+        #
+        return self.get_set_config("serde.cache.size", new_value)
+
     #
 
     def get_set_config(self, config_key_str, new_value=None, dict=None):
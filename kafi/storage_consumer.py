@@ -1,11 +1,12 @@
 from kafi.deserializer import Deserializer
+from kafi.message import LazyMessage, Message
 from kafi.helpers import get_millis, to_millis
 
 class StorageConsumer(Deserializer):
     def __init__(self, storage_obj, *topics, **kwargs):
         self.storage_obj = storage_obj
         #
-        super().__init__(storage_obj.schema_registry_config_dict)
+        super().__init__(storage_obj.schema_registry_config_dict, storage_obj.serdeCache, storage_obj.schemaRegistryClient)
         #
         # Get topics to subscribe to.
         self.topic_str_list = list(topics)
@@ -29,7 +30,12 @@ class StorageConsumer(Deserializer):
         #
         self.enable_auto_commit_bool = kwargs["enable_auto_commit"] if "enable_auto_commit" in kwargs else storage_obj.enable_auto_commit()
         #
-        self.schema_id_int_generalizedProtocolMessageType_protobuf_schema_str_tuple_dict = {}
+        # Build the consumed messages as dictionaries, as (compact) Message objects or as LazyMessage objects (deserializing their keys/values on access).
+        message_class_str = kwargs["message_class"] if "message_class" in kwargs else storage_obj.message_class()
+        if message_class_str.lower() not in ["dict", "record", "lazy"]:
+            raise Exception("Only \"dict\", \"record\" and \"lazy\" supported for \"message.class\".")
+        self.message_constructor = {"dict": dict, "record": Message, "lazy": LazyMessage}[message_class_str.lower()]
+        self.topic_str_deserialization_context_tuple_dict = {topic_str: (self, topic_str, self.topic_str_key_type_str_dict[topic_str], self.topic_str_value_type_str_dict[topic_str]) for topic_str in self.topic_str_list}
 
     #
 
@@ -20,6 +20,7 @@ setup(
                       'piny==1.1.0',
                       'requests==2.32.3',
                       'azure-storage-blob==12.24.0',
+                      'httpx==0.28.1',
                       'minio==7.2.14',
                       'lxml==5.3.0',
                       'openpyxl==3.1.5',
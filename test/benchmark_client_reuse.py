@@ -0,0 +1,85 @@
+import io
+import os
+import sys
+import time
+
+if os.path.basename(os.getcwd()) == "test":
+    sys.path.insert(1, "..")
+else:
+    sys.path.insert(1, ".")
+
+from kafi.fs.azureblob.azureblob import AzureBlob
+from kafi.fs.s3.s3 import S3
+
+# Per-object latency (write + read) of a new client (and connection pool) per object vs. the long-lived, pooled client of the storage object.
+#
+# Uses the "local" configuration of the storage (e.g. MinIO/Azurite), see test/test_fs_s3.py and test/test_fs_azureblob.py.
+#
+# Usage: python test/benchmark_client_reuse.py s3|azureblob [number of objects]
+
+# Constants
+
+NUM_OBJECTS = 200
+OBJECT_SIZE = 1024
+
+#
+
+def get_storage(storage_type_str):
+    storage = S3("local") if storage_type_str == "s3" else AzureBlob("local")
+    storage.root_dir("test")
+    #
+    return storage
+
+
+def get_new_client_write_read_function(storage, storage_type_str):
+    if storage_type_str == "s3":
+        from minio import Minio
+        #
+
+        def write_read(abs_path_file_str, data_bytes):
+            minio = Minio(storage.s3_config_dict["endpoint"], access_key=storage.s3_config_dict["access.key"], secret_key=storage.s3_config_dict["secret.key"], secure=False)
+            minio.put_object(storage.bucket_name(), abs_path_file_str, io.BytesIO(data_bytes), length=len(data_bytes))
+            return minio.get_object(storage.bucket_name(), abs_path_file_str).data
+    else:
+        from azure.storage.blob import BlobClient
+        #
+
+        def write_read(abs_path_file_str, data_bytes):
+            blobClient = BlobClient.from_connection_string(conn_str=storage.azure_blob_config_dict["connection.string"], container_name=storage.container_name(), blob_name=abs_path_file_str)
+            blobClient.upload_blob(data_bytes, overwrite=True)
+            return blobClient.download_blob().read()
+    #
+    return write_read
+
+
+def benchmark(storage, write_read_function, num_objects_int):
+    abs_path_dir_str = os.path.join(storage.root_dir(), "benchmark")
+    data_bytes = b"x" * OBJECT_SIZE
+    #
+    start_float = time.perf_counter()
+    for i in range(num_objects_int):
+        if write_read_function(os.path.join(abs_path_dir_str, str(i)), data_bytes) != data_bytes:
+            raise Exception("Read object does not match the written one.")
+    millis_float = (time.perf_counter() - start_float) * 1000 / num_objects_int
+    #
+    for i in range(num_objects_int):
+        storage.admin.delete_file(os.path.join(abs_path_dir_str, str(i)))
+    #
+    return millis_float
+
+#
+
+if __name__ == "__main__":
+    storage_type_str = sys.argv[1] if len(sys.argv) > 1 else "s3"
+    num_objects_int = int(sys.argv[2]) if len(sys.argv) > 2 else NUM_OBJECTS
+    #
+    storage = get_storage(storage_type_str)
+    #
+    def pooled_write_read(abs_path_file_str, data_bytes):
+        storage.admin.write_bytes(abs_path_file_str, data_bytes)
+        return storage.admin.read_bytes(abs_path_file_str)
+    #
+    new_client_millis_float = benchmark(storage, get_new_client_write_read_function(storage, storage_type_str), num_objects_int)
+    pooled_client_millis_float = benchmark(storage, pooled_write_read, num_objects_int)
+    #
+    print(f"Per-object latency (write + read, {num_objects_int} objects of {OBJECT_SIZE} bytes): new client per object: {new_client_millis_float:.2f}ms, pooled client: {pooled_client_millis_float:.2f}ms")
@@ -0,0 +1,82 @@
+import os
+import sys
+import tempfile
+import time
+
+if os.path.basename(os.getcwd()) == "test":
+    sys.path.insert(1, "..")
+else:
+    sys.path.insert(1, ".")
+
+from kafi.fs.local.local import Local
+
+# Per-message serialization/deserialization cost of the Schema Registry formats with and without the serde cache ("serde.cache.size" = 0 builds the (de)serializers per message).
+#
+# Uses an in-memory Schema Registry ("mock://"), i.e. no Schema Registry round-trips are included.
+#
+# Usage: python test/benchmark_serde.py [number of messages]
+
+# Constants
+
+NUM_MESSAGES = 10000
+
+AVRO_SCHEMA_DICT = {"type": "record", "name": "snack", "fields": [{"name": "name", "type": "string"}, {"name": "calories", "type": "float"}, {"name": "colour", "type": "string"}]}
+JSONSCHEMA_SCHEMA_DICT = {"title": "snack", "type": "object", "properties": {"name": {"type": "string"}, "calories": {"type": "number"}, "colour": {"type": "string"}}}
+
+#
+
+def get_storage(serde_cache_size_int):
+    l = Local({"local": {"root.dir": tempfile.mkdtemp(prefix="kafi_benchmark_serde_")},
+               "schema_registry": {"schema.registry.url": "mock://benchmark"},
+               "kafi": {"serde.cache.size": serde_cache_size_int}})
+    #
+    return l
+
+
+def benchmark(type_str, schema, consume_bool, serde_cache_size_int, num_messages_int):
+    l = get_storage(serde_cache_size_int)
+    #
+    topic_str = f"benchmark_{type_str}"
+    l.create(topic_str)
+    #
+    value_dict_list = [{"name": f"cookie {i}", "calories": 500.0 + i, "colour": "brown"} for i in range(num_messages_int)]
+    #
+    start_float = time.perf_counter()
+    producer = l.producer(topic_str, value_type=type_str, value_schema=schema)
+    producer.produce(value_dict_list)
+    producer.close()
+    produce_micros_float = (time.perf_counter() - start_float) * 1000000 / num_messages_int
+    #
+    if not consume_bool:
+        return (produce_micros_float, None)
+    #
+    start_float = time.perf_counter()
+    consumer = l.consumer(topic_str, value_type=type_str)
+    message_dict_list = consumer.consume(n=num_messages_int)
+    consumer.close()
+    consume_micros_float = (time.perf_counter() - start_float) * 1000000 / num_messages_int
+    #
+    if [message_dict["value"]["name"] for message_dict in message_dict_list] != [value_dict["name"] for value_dict in value_dict_list]:
+        raise Exception(f"Consumed {type_str} messages do not match the produced ones.")
+    #
+    return (produce_micros_float, consume_micros_float)
+
+
+def format_micros(micros_float):
+    return "-" if micros_float is None else f"{micros_float:.1f}"
+
+#
+
+if __name__ == "__main__":
+    num_messages_int = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_MESSAGES
+    #
+    type_str_schema_consume_bool_tuple_list = [("avro", AVRO_SCHEMA_DICT, True),
+                                               ("jsonschema", JSONSCHEMA_SCHEMA_DICT, True),
+                                               ("protobuf", "syntax = \"proto3\"; message Snack { string name = 1; float calories = 2; string colour = 3; }", True)]
+    #
+    print(f"Microseconds per message ({num_messages_int} messages):")
+    print(f"{'format':<12}{'serialize':>14}{'(cached)':>10}{'deserialize':>14}{'(cached)':>10}")
+    for type_str, schema, consume_bool in type_str_schema_consume_bool_tuple_list:
+        (uncached_produce_micros_float, uncached_consume_micros_float) = benchmark(type_str, schema, consume_bool, 0, num_messages_int)
+        (cached_produce_micros_float, cached_consume_micros_float) = benchmark(type_str, schema, consume_bool, 1000, num_messages_int)
+        print(f"{type_str:<12}{format_micros(uncached_produce_micros_float):>14}{format_micros(cached_produce_micros_float):>10}{format_micros(uncached_consume_micros_float):>14}{format_micros(cached_consume_micros_float):>10}")
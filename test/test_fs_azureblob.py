@@ -38,3 +38,51 @@ class Test(TestSingleStorageBase):
 
     def test_compact(self):
         pass
+
+    #
+
+    def test_client_reuse(self):
+        # The long-lived, pooled client of the storage object (see test/benchmark_client_reuse.py for its latency compared to a new client per object).
+        a = self.get_storage()
+        #
+        abs_path_dir_str = os.path.join(a.root_dir(), "client_reuse")
+        data_bytes = b"x" * 1024
+        for i in range(200):
+            a.admin.write_bytes(os.path.join(abs_path_dir_str, str(i)), data_bytes)
+            self.assertEqual(a.admin.read_bytes(os.path.join(abs_path_dir_str, str(i))), data_bytes)
+        #
+        for i in range(200):
+            a.admin.delete_file(os.path.join(abs_path_dir_str, str(i)))
+        self.assertEqual(a.admin.list_files(abs_path_dir_str + "/"), [])
+
+    def test_keep_alive(self):
+        import socket
+        from kafi.fs.azureblob.azureblob_admin import get_requestsTransport
+        #
+
+        def get_socket_options_tuple_list(azure_blob_config_dict):
+            return get_requestsTransport(azure_blob_config_dict).session.get_adapter("https://").poolmanager.connection_pool_kw["socket_options"]
+        #
+        keep_alive_socket_option_tuple = (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.assertIn(keep_alive_socket_option_tuple, get_socket_options_tuple_list({}))
+        self.assertIn(keep_alive_socket_option_tuple, get_socket_options_tuple_list({"keep.alive": "true"}))
+        # Booleans from YAML/environment variables can be strings.
+        self.assertNotIn(keep_alive_socket_option_tuple, get_socket_options_tuple_list({"keep.alive": "false"}))
+        self.assertNotIn(keep_alive_socket_option_tuple, get_socket_options_tuple_list({"keep.alive": False}))
+
+    def test_multipart_ranged_io(self):
+        a = self.get_storage()
+        a.azure_blob_config_dict["part.size"] = 4194304
+        a.admin = a.get_admin()
+        #
+        abs_path_file_str = os.path.join(a.root_dir(), "multipart", "object")
+        data_bytes = os.urandom(3 * 4194304 + 42)
+        # Block upload, parallel ranged download.
+        a.admin.write_bytes(abs_path_file_str, data_bytes)
+        self.assertEqual(a.admin.read_bytes(abs_path_file_str), data_bytes)
+        # Ranges (e.g. from the offset index of a partition file).
+        self.assertEqual(a.admin.read_bytes(abs_path_file_str, 4194300), data_bytes[4194300:])
+        self.assertEqual(a.admin.read_bytes(abs_path_file_str, 100, 6000000), data_bytes[100:6000100])
+        self.assertEqual(a.admin.read_bytes(abs_path_file_str, 42, 10), data_bytes[42:52])
+        #
+        a.admin.delete_file(abs_path_file_str)
@@ -1,5 +1,11 @@
+import asyncio
+import mmap
 import os
 import sys
+import tempfile
+import threading
+import time
+import tracemalloc
 
 if os.path.basename(os.getcwd()) == "test":
     sys.path.insert(1, "..")
@@ -8,6 +14,7 @@ else:
 
 from test.test_single_storage_base import TestSingleStorageBase
 from kafi.fs.local.local import Local
+from kafi.helpers import get_millis
 
 #
 
@@ -43,3 +50,873 @@ class Test(TestSingleStorageBase):
 
     def test_compact(self):
         pass
+
+    #
+
+    def test_segment_format(self):
+        l = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str)
+        producer = l.producer(topic_str, type="str")
+        producer.produce(self.snack_str_list, key="key", headers=self.headers_str_bytes_tuple_list)
+        producer.close()
+        # New segments are written in the binary segment format.
+        partitions_abs_dir_str = os.path.join(l.admin.get_topic_abs_path_str(topic_str), "partitions")
+        rel_file_str_list = l.admin.list_segment_files(topic_str)
+        self.assertEqual(1, len(rel_file_str_list))
+        segment_bytes = l.admin.read_bytes(os.path.join(partitions_abs_dir_str, rel_file_str_list[0]))
+        self.assertTrue(segment_bytes.startswith(b"KAFI"))
+        # Legacy segments (one Python repr per message and line) can still be read.
+        legacy_message_dict = {"topic": topic_str, "value": b"legacy", "key": None, "timestamp": (1, get_millis()), "headers": None, "partition": 0, "offset": 3}
+        legacy_segment_bytes = str(legacy_message_dict).encode("utf-8") + b"\n"
+        l.admin.write_bytes(os.path.join(partitions_abs_dir_str, f"{0:09},{3:021},{3:021},{legacy_message_dict['timestamp'][1]},{legacy_message_dict['timestamp'][1]}"), legacy_segment_bytes)
+        # Topics written by earlier versions of kafi do not have manifests.
+        l.admin.delete_file(l.admin.get_manifest_abs_path_str(topic_str, 0))
+        #
+        group_str = self.create_test_group_name()
+        message_dict_list = l.cat(topic_str, group=group_str, type="str")
+        self.assertEqual(4, len(message_dict_list))
+        self.assertEqual([message_dict["value"] for message_dict in message_dict_list], self.snack_str_list + ["legacy"])
+        self.assertEqual(message_dict_list[0]["key"], "key")
+        self.assertEqual(message_dict_list[0]["headers"], self.headers_str_bytes_tuple_list)
+        self.assertEqual(message_dict_list[3]["key"], None)
+        self.assertEqual(message_dict_list[3]["headers"], None)
+
+    def test_offset_index(self):
+        l = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str, config={"index.interval.bytes": 64})
+        producer = l.producer(topic_str, type="str")
+        producer.produce([f"message {i}" for i in range(100)])
+        producer.close()
+        # Each segment gets a sparse offset index sidecar file.
+        partitions_abs_dir_str = os.path.join(l.admin.get_topic_abs_path_str(topic_str), "partitions")
+        segment_rel_file_str_list = l.admin.list_segment_files(topic_str)
+        self.assertEqual(1, len(segment_rel_file_str_list))
+        self.assertIn(segment_rel_file_str_list[0] + ".index", l.admin.list_files(partitions_abs_dir_str))
+        #
+        index_bytes = l.admin.read_bytes(os.path.join(partitions_abs_dir_str, segment_rel_file_str_list[0] + ".index"))
+        self.assertTrue(1 < len(index_bytes) // 16 < 100)
+        # Consuming from an offset in the middle of the segment starts reading at the closest indexed position.
+        group_str1 = self.create_test_group_name()
+        message_dict_list1 = l.cat(topic_str, group=group_str1, type="str", offsets={0: 42}, n=3)
+        self.assertEqual([message_dict["value"] for message_dict in message_dict_list1], ["message 42", "message 43", "message 44"])
+        #
+        message_dict_list2 = l.tail(topic_str, type="str", n=1)
+        self.assertEqual(message_dict_list2[0]["value"], "message 99")
+        self.assertEqual(message_dict_list2[0]["offset"], 99)
+
+    def test_time_index(self):
+        l = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str)
+        # Non-monotonic timestamps: 1000, 3000, 2000, 4000, 5000
+        timestamp_int_list = [1000, 3000, 2000, 4000, 5000]
+        producer = l.producer(topic_str, type="str", keep_timestamps=True)
+        producer.produce_list([{"key": None, "value": f"message {i}", "timestamp": (1, timestamp_int), "headers": None} for i, timestamp_int in enumerate(timestamp_int_list)])
+        producer.close()
+        #
+        partitions_abs_dir_str = os.path.join(l.admin.get_topic_abs_path_str(topic_str), "partitions")
+        segment_rel_file_str = l.admin.list_segment_files(topic_str)[0]
+        self.assertIn(segment_rel_file_str + ".timeindex", l.admin.list_files(partitions_abs_dir_str))
+        #
+        self.assertEqual(l.offsets_for_times(topic_str, {0: 500})[topic_str][0], 0)
+        self.assertEqual(l.offsets_for_times(topic_str, {0: 1000})[topic_str][0], 0)
+        self.assertEqual(l.offsets_for_times(topic_str, {0: 1500})[topic_str][0], 1)
+        self.assertEqual(l.offsets_for_times(topic_str, {0: 2000})[topic_str][0], 1)
+        self.assertEqual(l.offsets_for_times(topic_str, {0: 3500})[topic_str][0], 3)
+        self.assertEqual(l.offsets_for_times(topic_str, {0: 5000})[topic_str][0], 4)
+        self.assertEqual(l.offsets_for_times(topic_str, {0: 5001})[topic_str][0], -1)
+
+    def test_manifest(self):
+        l = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str, partitions=2)
+        producer = l.producer(topic_str, type="str", config={"linger.ms": 0})
+        producer.produce("message 1", partition=0)
+        producer.produce(["message 2", "message 3"], partition=0)
+        producer.produce("message 4", partition=1)
+        producer.close()
+        #
+        manifest_dict = l.admin.get_manifest(topic_str)
+        self.assertEqual(manifest_dict["partitions"][0]["watermarks"], (0, 3))
+        self.assertEqual(len(manifest_dict["partitions"][0]["segments"]), 2)
+        self.assertEqual(manifest_dict["partitions"][1]["watermarks"], (0, 1))
+        partitions_abs_dir_str = os.path.join(l.admin.get_topic_abs_path_str(topic_str), "partitions")
+        self.assertEqual(manifest_dict["partitions"][1]["size"], len(l.admin.read_bytes(os.path.join(partitions_abs_dir_str, l.admin.get_partition_files(topic_str)[1][0]))))
+        self.assertEqual(l.watermarks(topic_str)[topic_str], {0: (0, 3), 1: (0, 1)})
+        # Topics without manifests (written by earlier versions of kafi) fall back to listing the partition files.
+        for partition_int in range(2):
+            l.admin.delete_file(l.admin.get_manifest_abs_path_str(topic_str, partition_int))
+        self.assertEqual(l.watermarks(topic_str)[topic_str], {0: (0, 3), 1: (0, 1)})
+        producer = l.producer(topic_str, type="str")
+        producer.produce("message 5", partition=1)
+        producer.close()
+        self.assertEqual(l.watermarks(topic_str)[topic_str], {0: (0, 3), 1: (0, 2)})
+        self.assertEqual(len(l.admin.get_manifest(topic_str)["partitions"][1]["segments"]), 2)
+        #
+        consumer = l.consumer(topic_str, type="str")
+        message_dict_list = consumer.consume()
+        consumer.close()
+        self.assertEqual(sorted(message_dict["value"] for message_dict in message_dict_list), ["message 1", "message 2", "message 3", "message 4", "message 5"])
+        # Producers (with their own storage objects) writing to different partitions at the same time do not lose each other's partition files.
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str, partitions=2)
+        def produce(partition_int):
+            producer = self.get_storage().producer(topic_str, type="str")
+            for i in range(200):
+                producer.produce(f"message {partition_int} {i}", partition=partition_int)
+            producer.close()
+        thread_list = [threading.Thread(target=produce, args=(partition_int,)) for partition_int in range(2)]
+        for thread in thread_list:
+            thread.start()
+        for thread in thread_list:
+            thread.join()
+        self.assertEqual(l.watermarks(topic_str)[topic_str], {0: (0, 200), 1: (0, 200)})
+        self.assertEqual(sum(len(partition_dict["segments"]) for partition_dict in l.admin.get_manifest(topic_str)["partitions"].values()), len(l.admin.list_segment_files(topic_str)))
+        # Producers only read the manifests of the partitions they write to.
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str, partitions=4)
+        producer = l.producer(topic_str, type="str")
+        read_str_function = l.admin.read_str
+        read_abs_path_file_str_list = []
+        def read_str(abs_path_file_str):
+            read_abs_path_file_str_list.append(abs_path_file_str)
+            return read_str_function(abs_path_file_str)
+        l.admin.read_str = read_str
+        producer.produce("message", partition=2)
+        l.admin.read_str = read_str_function
+        producer.close()
+        self.assertEqual(set(abs_path_file_str for abs_path_file_str in read_abs_path_file_str_list if "manifests" in abs_path_file_str), {l.admin.get_manifest_abs_path_str(topic_str, 2)})
+        self.assertEqual(l.watermarks(topic_str)[topic_str], {0: (0, 0), 1: (0, 0), 2: (0, 1), 3: (0, 0)})
+        # The manifests directories are not listed as topics (own root directory to not delete the topics of the other tests).
+        l = Local({"local": {"root.dir": tempfile.mkdtemp(prefix="kafi_test_manifest_")}})
+        l.create("t1", partitions=2)
+        self.assertEqual(l.topics(), ["t1"])
+        self.assertEqual(l.topics(size=True), {"t1": 0})
+        self.assertEqual(l.delete("*"), ["t1"])
+        self.assertEqual(l.topics(), [])
+
+    def test_metadata_cache(self):
+        l = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str, partitions=2)
+        # Count the reads of the metadata file of the topic.
+        metadata_abs_path_str = os.path.join(l.admin.get_topic_abs_path_str(topic_str), "metadata")
+        read_str_function = l.admin.read_str
+        read_path_str_list = []
+        def read_str(abs_path_file_str):
+            read_path_str_list.append(abs_path_file_str)
+            return read_str_function(abs_path_file_str)
+        l.admin.read_str = read_str
+        #
+        producer = l.producer(topic_str, type="str")
+        for i in range(10):
+            producer.produce(f"message {i}")
+        producer.close()
+        l.partitions(topic_str)
+        l.head(topic_str, type="str", n=5)
+        self.assertEqual(read_path_str_list.count(metadata_abs_path_str), 1)
+        # partitions(..., partitions=n) and config() invalidate the cache.
+        l.partitions(topic_str, partitions=3)
+        self.assertEqual(l.partitions(topic_str)[topic_str], 3)
+        l.config(topic_str, {"retention.ms": 1000})
+        self.assertEqual(l.config(topic_str)[topic_str], {"retention.ms": 1000})
+        # Modifying the returned config does not change the cache.
+        l.config(topic_str)[topic_str]["retention.ms"] = 2000
+        self.assertEqual(l.config(topic_str)[topic_str], {"retention.ms": 1000})
+        # delete() and create() invalidate the cache.
+        l.delete(topic_str)
+        l.create(topic_str, partitions=4)
+        self.assertEqual(l.partitions(topic_str)[topic_str], 4)
+        # Changes by other storage objects are picked up after metadata.max.age.ms.
+        l1 = Local({"local": {"root.dir": self.path_str}, "kafi": {"metadata.max.age.ms": 0}})
+        l1.partitions(topic_str, partitions=5)
+        self.assertEqual(l.partitions(topic_str)[topic_str], 4)
+        l.admin.metadata_max_age_ms_int = 0
+        self.assertEqual(l.partitions(topic_str)[topic_str], 5)
+
+    def test_segment_rolling(self):
+        l = self.get_storage()
+        #
+        # By default, the messages of many produce() calls are buffered and only written on flush()/close() (or when rolling to a new partition file).
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str)
+        producer = l.producer(topic_str, type="str")
+        for i in range(5):
+            producer.produce(f"message {i}")
+        self.assertEqual(l.admin.list_segment_files(topic_str), [])
+        producer.close()
+        self.assertEqual(len(l.admin.list_segment_files(topic_str)), 1)
+        self.assertEqual(l.watermarks(topic_str)[topic_str], {0: (0, 5)})
+        #
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str)
+        # Buffer the messages of many produce() calls and roll to a new partition file every ~200 bytes.
+        producer = l.producer(topic_str, type="str", config={"linger.ms": 3600000, "segment.bytes": 200})
+        for i in range(20):
+            producer.produce(f"message {i}")
+        written_segment_int = len(l.admin.list_segment_files(topic_str))
+        self.assertGreater(written_segment_int, 0)
+        self.assertLess(l.watermarks(topic_str)[topic_str][0][1], 20)
+        producer.close()
+        #
+        rel_file_str_list = l.admin.list_segment_files(topic_str)
+        self.assertEqual(len(rel_file_str_list), written_segment_int + 1)
+        self.assertLess(len(rel_file_str_list), 20)
+        self.assertEqual(l.watermarks(topic_str)[topic_str], {0: (0, 20)})
+        #
+        group_str = self.create_test_group_name()
+        message_dict_list = l.cat(topic_str, group=group_str, type="str")
+        self.assertEqual([message_dict["value"] for message_dict in message_dict_list], [f"message {i}" for i in range(20)])
+        self.assertEqual([message_dict["offset"] for message_dict in message_dict_list], list(range(20)))
+        # Roll to a new partition file whenever the timestamps in the open one would span more than segment.ms.
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str, config={"segment.ms": 1000})
+        producer = l.producer(topic_str, type="str", keep_timestamps=True)
+        producer.produce_list([{"key": None, "value": f"message {i}", "timestamp": (1, timestamp_int), "headers": None} for i, timestamp_int in enumerate([1000, 1500, 2000, 2500, 5000])])
+        producer.close()
+        self.assertEqual(len(l.admin.list_segment_files(topic_str)), 3)
+        self.assertEqual(l.offsets_for_times(topic_str, {0: 2200})[topic_str][0], 3)
+
+    def test_interleaved_producers(self):
+        l = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str)
+        # Producers pick up the messages written by other producers to the same topic (writing a partition file at the end of each produce() call).
+        producer1 = l.producer(topic_str, type="str", config={"linger.ms": 0})
+        producer2 = l.producer(topic_str, type="str", config={"linger.ms": 0})
+        producer1.produce("a")
+        producer2.produce("b")
+        producer1.produce("c")
+        producer1.close()
+        producer2.close()
+        self.assertEqual(l.watermarks(topic_str)[topic_str], {0: (0, 3)})
+        #
+        group_str = self.create_test_group_name()
+        message_dict_list = l.cat(topic_str, group=group_str, type="str")
+        self.assertEqual([message_dict["value"] for message_dict in message_dict_list], ["a", "b", "c"])
+        self.assertEqual([message_dict["offset"] for message_dict in message_dict_list], [0, 1, 2])
+        # Also if they buffer their messages (the messages of a partition file are moved behind those written by other producers in the meantime).
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str)
+        producer1 = l.producer(topic_str, type="str")
+        producer2 = l.producer(topic_str, type="str")
+        producer1.produce("a")
+        producer2.produce(["b1", "b2"])
+        producer1.flush()
+        producer2.flush()
+        producer1.produce("c")
+        producer1.close()
+        producer2.close()
+        self.assertEqual(l.watermarks(topic_str)[topic_str], {0: (0, 4)})
+        #
+        group_str = self.create_test_group_name()
+        message_dict_list = l.cat(topic_str, group=group_str, type="str")
+        self.assertEqual([message_dict["value"] for message_dict in message_dict_list], ["a", "b1", "b2", "c"])
+        self.assertEqual([message_dict["offset"] for message_dict in message_dict_list], [0, 1, 2, 3])
+        self.assertEqual(l.cat(topic_str, type="str", offsets={0: 2}, n=1)[0]["value"], "b2")
+
+    def test_segment_pruning(self):
+        l = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str, partitions=2)
+        # 10 partition files per partition with 10 messages each, and timestamps 1000 * (offset + 1).
+        producer = l.producer(topic_str, type="str", config={"linger.ms": 0})
+        for i in range(10):
+            for partition_int in range(2):
+                producer.produce([f"message {partition_int} {i * 10 + j}" for j in range(10)], partition=partition_int, timestamp=[(i * 10 + j + 1) * 1000 for j in range(10)])
+        producer.close()
+        # Count the partition files fetched.
+        fetch_segment_function = l.admin.fetch_segment
+        fetched_rel_file_str_list = []
+        def fetch_segment(topic_str, rel_file_str, start_offset_int=0):
+            fetched_rel_file_str_list.append(rel_file_str)
+            return fetch_segment_function(topic_str, rel_file_str, start_offset_int)
+        l.admin.fetch_segment = fetch_segment
+        #
+        message_dict_list = l.cat(topic_str, offsets={0: 25, 1: 25}, end_offsets={0: 34, 1: 34}, type="str")
+        self.assertEqual(sorted(message_dict["value"] for message_dict in message_dict_list), sorted([f"message 0 {i}" for i in range(25, 35)] + [f"message 1 {i}" for i in range(25, 35)]))
+        self.assertEqual(len(fetched_rel_file_str_list), 4)
+        #
+        fetched_rel_file_str_list.clear()
+        message_dict_list = l.cat(topic_str, ts=51000, end_ts=60000, type="str")
+        self.assertEqual(sorted(message_dict["offset"] for message_dict in message_dict_list), sorted(list(range(50, 60)) * 2))
+        self.assertEqual(len(fetched_rel_file_str_list), 2)
+
+    def test_lookup(self):
+        l = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str, partitions=2, config={"bloom.filter.fpp": 0.000001})
+        # 20 partition files (10 per partition) with 10 distinct keys each, and key "key 5" updated in a later partition file.
+        producer = l.producer(topic_str, type="str", config={"linger.ms": 0})
+        for i in range(10):
+            for partition_int in range(2):
+                producer.produce([f"value {partition_int} {i * 10 + j}" for j in range(10)], key=[f"key {partition_int} {i * 10 + j}" for j in range(10)], partition=partition_int)
+        producer.produce("value 0 5 updated", key="key 0 5", partition=0)
+        producer.produce("no key", partition=1)
+        producer.close()
+        # Count the partition files read.
+        read_messages_function = l.admin.read_messages
+        read_rel_file_str_list = []
+        def read_messages(topic_str, rel_file_str, start_offset_int=0):
+            read_rel_file_str_list.append(rel_file_str)
+            return read_messages_function(topic_str, rel_file_str, start_offset_int)
+        l.admin.read_messages = read_messages
+        #
+        message_dict = l.lookup(topic_str, "key 1 42", type="str")
+        self.assertEqual(message_dict["value"], "value 1 42")
+        self.assertEqual(message_dict["partition"], 1)
+        self.assertEqual(message_dict["offset"], 42)
+        self.assertEqual(len(read_rel_file_str_list), 1)
+        #
+        read_rel_file_str_list.clear()
+        self.assertEqual(l.lookup(topic_str, "key 0 5", type="str")["value"], "value 0 5 updated")
+        self.assertEqual(len(read_rel_file_str_list), 1)
+        #
+        read_rel_file_str_list.clear()
+        self.assertIsNone(l.lookup(topic_str, "key 2 0", type="str"))
+        self.assertEqual(len(read_rel_file_str_list), 0)
+        # Partition files without Bloom filters are scanned.
+        partitions_abs_dir_str = os.path.join(l.admin.get_topic_abs_path_str(topic_str), "partitions")
+        for rel_file_str in l.admin.get_partition_files(topic_str)[0]:
+            l.admin.delete_file(os.path.join(partitions_abs_dir_str, rel_file_str + ".bloom"))
+        read_rel_file_str_list.clear()
+        self.assertEqual(l.lookup(topic_str, "key 0 13", type="str")["value"], "value 0 13")
+        self.assertEqual(len(read_rel_file_str_list), 10)
+
+    def test_produce_benchmark(self):
+        l = self.get_storage()
+        # Producing 10x the messages should take roughly 10x the time (and not 100x as with quadratic byte concatenation).
+        def produce_seconds(n_int):
+            topic_str = self.create_test_topic_name()
+            l.create(topic_str)
+            message_dict_list = [{"key": f"key {i}", "value": f"value {i}", "timestamp": (1, i), "headers": None, "partition": 0} for i in range(n_int)]
+            producer = l.producer(topic_str, type="str")
+            start_float = time.perf_counter()
+            producer.produce_list(message_dict_list)
+            producer.close()
+            seconds_float = time.perf_counter() - start_float
+            self.assertEqual(l.watermarks(topic_str)[topic_str][0], (0, n_int))
+            return seconds_float
+        #
+        seconds_10k_float = produce_seconds(10000)
+        seconds_100k_float = produce_seconds(100000)
+        print(f"produce_list: 10k messages: {seconds_10k_float:.3f}s, 100k messages: {seconds_100k_float:.3f}s")
+        self.assertLess(seconds_100k_float, 25 * seconds_10k_float)
+
+    def test_compression(self):
+        l = self.get_storage()
+        #
+        value_str_list = [f"message {i} " + "x" * 100 for i in range(100)]
+        #
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str)
+        producer = l.producer(topic_str, type="str")
+        producer.produce(value_str_list)
+        producer.close()
+        uncompressed_size_int = l.admin.get_manifest(topic_str)["partitions"][0]["size"]
+        #
+        for compression_type_str in ["gzip", "snappy", "lz4", "zstd"]:
+            topic_str = self.create_test_topic_name()
+            l.create(topic_str, config={"compression.type": compression_type_str})
+            producer = l.producer(topic_str, type="str")
+            producer.produce(value_str_list)
+            producer.close()
+            #
+            partitions_abs_dir_str = os.path.join(l.admin.get_topic_abs_path_str(topic_str), "partitions")
+            segment_rel_file_str = l.admin.list_segment_files(topic_str)[0]
+            self.assertLess(len(l.admin.read_bytes(os.path.join(partitions_abs_dir_str, segment_rel_file_str))), uncompressed_size_int / 4)
+            #
+            group_str = self.create_test_group_name()
+            message_dict_list = l.cat(topic_str, group=group_str, type="str")
+            self.assertEqual([message_dict["value"] for message_dict in message_dict_list], value_str_list)
+            message_dict_list = l.cat(topic_str, offsets={0: 42}, n=3, type="str")
+            self.assertEqual([message_dict["offset"] for message_dict in message_dict_list], [42, 43, 44])
+        #
+        with self.assertRaises(Exception):
+            l.create(self.create_test_topic_name(), config={"compression.type": "brotli"})
+
+    def test_columnar_segments(self):
+        import pandas
+        import pyarrow
+        #
+        l = self.get_storage()
+        #
+        value_str_list = [f"message {i}" for i in range(100)]
+        #
+        for segment_format_str, compression_type_str in [("arrow", None), ("arrow", "zstd"), ("parquet", None), ("parquet", "snappy")]:
+            topic_str = self.create_test_topic_name()
+            l.create(topic_str, partitions=2, config={"segment.format": segment_format_str} if compression_type_str is None else {"segment.format": segment_format_str, "compression.type": compression_type_str})
+            producer = l.producer(topic_str, type="str")
+            producer.produce(value_str_list, key=[str(i) for i in range(100)], headers=[{"h": str(i)} for i in range(100)])
+            producer.close()
+            # Emulated Kafka semantics...
+            message_dict_list = l.cat(topic_str, type="str")
+            self.assertEqual(sorted(message_dict["value"] for message_dict in message_dict_list), sorted(value_str_list))
+            message_dict = [message_dict for message_dict in message_dict_list if message_dict["key"] == "42"][0]
+            self.assertEqual(message_dict["value"], "message 42")
+            self.assertEqual(message_dict["headers"], [("h", b"42")])
+            partition_int = message_dict["partition"]
+            offset_int = message_dict["offset"]
+            message_dict_list = l.cat(topic_str, offsets={partition_int: offset_int, 1 - partition_int: 1000}, n=1, type="str")
+            self.assertEqual(message_dict_list[0]["value"], "message 42")
+            self.assertEqual(l.watermarks(topic_str)[topic_str][0][1] + l.watermarks(topic_str)[topic_str][1][1], 100)
+            # ...and the partition files can be opened directly by Arrow/pandas.
+            partitions_abs_dir_str = os.path.join(l.admin.get_topic_abs_path_str(topic_str), "partitions")
+            segment_abs_path_str = os.path.join(partitions_abs_dir_str, l.admin.get_partition_files(topic_str)[partition_int][0])
+            if segment_format_str == "parquet":
+                df = pandas.read_parquet(segment_abs_path_str)
+            else:
+                df = pyarrow.ipc.open_file(segment_abs_path_str).read_pandas()
+            self.assertEqual(df[df["offset"] == offset_int]["value"].iloc[0], b"message 42")
+            self.assertEqual(list(df.columns), ["offset", "timestamp_type", "timestamp", "partition", "key", "value", "headers"])
+        #
+        with self.assertRaises(Exception):
+            l.create(self.create_test_topic_name(), config={"segment.format": "orc"})
+        with self.assertRaises(Exception):
+            l.create(self.create_test_topic_name(), config={"segment.format": "arrow", "compression.type": "gzip"})
+
+    def test_mmap(self):
+        l = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str)
+        producer = l.producer(topic_str, type="bytes")
+        producer.produce([bytes([i % 256]) * 10000 for i in range(1000)])
+        producer.close()
+        #
+        partitions_abs_dir_str = os.path.join(l.admin.get_topic_abs_path_str(topic_str), "partitions")
+        segment_rel_file_str = l.admin.list_segment_files(topic_str)[0]
+        (segment_view, _) = l.admin.read_view(os.path.join(partitions_abs_dir_str, segment_rel_file_str))
+        self.assertIsInstance(segment_view, mmap.mmap)
+        self.assertGreater(len(segment_view), 1000 * 10000)
+        # Only the messages themselves are materialized, not the whole (memory-mapped) partition file.
+        tracemalloc.start()
+        consumer = l.consumer(topic_str, type="bytes")
+        size_int = consumer.foldl(lambda acc, message_dict: acc + len(message_dict["value"]), 0)
+        consumer.close()
+        (_, peak_size_int) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.assertEqual(size_int, 1000 * 10000)
+        self.assertLess(peak_size_int, 1000000)
+
+    def test_prefetch(self):
+        l = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str, partitions=4)
+        producer = l.producer(topic_str, type="str", config={"linger.ms": 0})
+        for i in range(8):
+            producer.produce([f"message {i} {j}" for j in range(8)])
+        producer.close()
+        self.assertEqual(len(l.admin.list_segment_files(topic_str)), 32)
+        # Simulate an object store with 20ms latency per request.
+        read_view_function = l.admin.read_view
+        def slow_read_view(*args, **kwargs):
+            time.sleep(0.02)
+            return read_view_function(*args, **kwargs)
+        l.admin.read_view = slow_read_view
+        #
+        def consume(config_dict):
+            start_float = time.perf_counter()
+            consumer = l.consumer(topic_str, type="str", config=config_dict)
+            message_dict_list = consumer.consume()
+            consumer.close()
+            return ([(message_dict["partition"], message_dict["offset"], message_dict["value"]) for message_dict in message_dict_list], time.perf_counter() - start_float)
+        #
+        (message_tuple_list1, seconds_float1) = consume({})
+        (message_tuple_list2, seconds_float2) = consume({"fetch.concurrency": 8, "prefetch.segments": 16})
+        self.assertEqual(len(message_tuple_list1), 64)
+        self.assertEqual(message_tuple_list1, message_tuple_list2)
+        self.assertLess(seconds_float2, seconds_float1 / 2)
+        # Stop early (pending fetches are cancelled).
+        consumer = l.consumer(topic_str, type="str", config={"fetch.concurrency": 8})
+        self.assertEqual(len(consumer.consume(n=3)), 3)
+        consumer.close()
+
+    def test_decode_processes(self):
+        l = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str, partitions=4)
+        producer = l.producer(topic_str, type="json")
+        for i in range(8):
+            producer.produce([{"i": i, "j": j} for j in range(100)], key=[str(j) for j in range(100)])
+        producer.close()
+        #
+        def consume(config_dict, **kwargs):
+            consumer = l.consumer(topic_str, type="json", config=config_dict)
+            message_dict_list = consumer.consume(**kwargs)
+            consumer.close()
+            return [(message_dict["partition"], message_dict["offset"], message_dict["key"], message_dict["value"]) for message_dict in message_dict_list]
+        # The messages are decoded in other processes, but passed on in the same order.
+        message_tuple_list = consume({})
+        self.assertEqual(len(message_tuple_list), 800)
+        self.assertEqual(consume({"decode.processes": 2}), message_tuple_list)
+        self.assertEqual(consume({"decode.processes": 2}, n=150), message_tuple_list[:150])
+        # Fold each partition separately and merge the accumulators.
+        consumer = l.consumer(topic_str, type="json", config={"decode.processes": 2})
+        offset_int_list = consumer.foldl_partitions(lambda acc, message_dict: acc + [message_dict["offset"]], [], lambda acc1, acc2: acc1 + acc2)
+        consumer.close()
+        self.assertEqual(len(offset_int_list), 800)
+        partition_int_message_count_int_dict = {partition_int: len([message_tuple for message_tuple in message_tuple_list if message_tuple[0] == partition_int]) for partition_int in range(4)}
+        self.assertEqual(offset_int_list, sum([list(range(partition_int_message_count_int_dict[partition_int])) for partition_int in range(4)], []))
+
+    def test_async_admin(self):
+        l = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str, partitions=4)
+        producer = l.producer(topic_str, type="str", config={"linger.ms": 0})
+        for i in range(8):
+            producer.produce([f"message {i} {j}" for j in range(8)])
+        producer.close()
+        # Count the requests in flight (with a simulated latency of 20ms per request).
+        read_bytes_function = l.admin.read_bytes
+        in_flight_int_list = [0, 0]
+        def slow_read_bytes(*args, **kwargs):
+            in_flight_int_list[0] += 1
+            in_flight_int_list[1] = max(in_flight_int_list[0], in_flight_int_list[1])
+            time.sleep(0.02)
+            in_flight_int_list[0] -= 1
+            return read_bytes_function(*args, **kwargs)
+        l.admin.read_bytes = slow_read_bytes
+        #
+        target_topic_str = self.create_test_topic_name()
+        #
+        async def run():
+            async with l.async_admin(max_requests=16) as async_admin:
+                message_dict_list = [message_dict async for message_dict in async_admin.messages(topic_str, type="str")]
+                #
+                num_files_int = await async_admin.copy_topic(topic_str, async_admin, target_topic_str)
+                #
+                abs_path_file_str = os.path.join(l.admin.get_topic_abs_path_str(target_topic_str), "test")
+                await async_admin.write_bytes(abs_path_file_str, b"test")
+                exists_bool1 = await async_admin.exists_file(abs_path_file_str)
+                data_bytes = await async_admin.read_bytes(abs_path_file_str)
+                await async_admin.delete_file(abs_path_file_str)
+                exists_bool2 = await async_admin.exists_file(abs_path_file_str)
+                #
+                return (message_dict_list, num_files_int, exists_bool1, data_bytes, exists_bool2)
+        #
+        (message_dict_list, num_files_int, exists_bool1, data_bytes, exists_bool2) = asyncio.run(run())
+        self.assertEqual(sorted(message_dict["value"] for message_dict in message_dict_list), sorted(f"message {i} {j}" for i in range(8) for j in range(8)))
+        self.assertGreater(in_flight_int_list[1], 8)
+        self.assertLessEqual(in_flight_int_list[1], 16)
+        # 32 partition files with 3 sidecars each, metadata and 4 manifests.
+        self.assertEqual(num_files_int, 32 * 4 + 1 + 4)
+        self.assertEqual((exists_bool1, data_bytes, exists_bool2), (True, b"test", False))
+        #
+        l.admin.read_bytes = read_bytes_function
+        self.assertEqual(l.partitions(target_topic_str)[target_topic_str], 4)
+        self.assertEqual(l.watermarks(target_topic_str)[target_topic_str], l.watermarks(topic_str)[topic_str])
+        self.assertEqual(sorted(message_dict["value"] for message_dict in l.cat(target_topic_str, type="str")), sorted(message_dict["value"] for message_dict in message_dict_list))
+        with self.assertRaises(Exception):
+            asyncio.run(l.async_admin().copy_topic(topic_str, l.async_admin(), target_topic_str))
+        #
+        # Without httpx, the native coroutines of a backend (see S3Admin) are replaced by its blocking functions in the thread pool.
+        async def async_read_bytes(httpxAsyncClient, abs_path_file_str):
+            raise Exception("async_read_bytes() should not be called without httpx.")
+        l.admin.async_read_bytes = async_read_bytes
+        httpx_module = sys.modules.get("httpx")
+        sys.modules["httpx"] = None
+        try:
+            message_dict_list1 = asyncio.run(self.collect_async_messages(l, target_topic_str))
+        finally:
+            if httpx_module is None:
+                del sys.modules["httpx"]
+            else:
+                sys.modules["httpx"] = httpx_module
+            del l.admin.async_read_bytes
+        self.assertEqual(sorted(message_dict["value"] for message_dict in message_dict_list1), sorted(message_dict["value"] for message_dict in message_dict_list))
+
+    async def collect_async_messages(self, l, topic_str):
+        async with l.async_admin() as async_admin:
+            return [message_dict async for message_dict in async_admin.messages(topic_str, type="str")]
+
+    def test_batched_commits(self):
+        l = self.get_storage()
+        l.enable_auto_commit(False)
+        l.commit_after_processing(True)
+        #
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str)
+        producer = l.producer(topic_str, type="str")
+        producer.produce([f"message {i}" for i in range(1000)])
+        producer.close()
+        # Count the writes of the group file.
+        self.set_group_dict_counter_int = 0
+        set_group_dict_function = l.admin.set_group_dict
+        def counting_set_group_dict(*args, **kwargs):
+            self.set_group_dict_counter_int += 1
+            return set_group_dict_function(*args, **kwargs)
+        l.admin.set_group_dict = counting_set_group_dict
+        #
+        group_str = self.create_test_group_name()
+        consumer = l.consumer(topic_str, group=group_str, type="str", config={"auto.commit.interval.messages": 100})
+        self.set_group_dict_counter_int = 0
+        self.assertEqual(len(consumer.consume(n=550)), 550)
+        # 5 commits after 100 messages each plus one at the end of foldl() (instead of 550 commits).
+        self.assertEqual(self.set_group_dict_counter_int, 6)
+        self.assertEqual(l.group_offsets(group_str)[group_str][topic_str], {0: 550})
+        self.assertEqual(len(consumer.consume()), 450)
+        consumer.close()
+        self.assertEqual(l.group_offsets(group_str)[group_str][topic_str], {0: 1000})
+        # The offsets of the messages processed before an exception are committed.
+        group_str = self.create_test_group_name()
+        consumer = l.consumer(topic_str, group=group_str, type="str")
+        def foldl_function(acc, message_dict):
+            if message_dict["offset"] == 42:
+                raise Exception("Error...")
+            return acc + 1
+        with self.assertRaises(Exception):
+            consumer.foldl(foldl_function, 0)
+        consumer.close()
+        self.assertEqual(l.group_offsets(group_str)[group_str][topic_str], {0: 42})
+
+    def test_delete_groups_prefix_listing(self):
+        l = self.get_storage()
+        # Emulate the listing by prefix of S3/Azure Blob Storage, i.e. listing "groups/g1" also lists "../g10/<entry>".
+        list_files_function = l.admin.list_files
+        def prefix_list_files(abs_path_dir_str):
+            parent_abs_dir_str = os.path.dirname(abs_path_dir_str)
+            abs_path_file_str_list = [os.path.join(parent_abs_dir_str, rel_file_str) for rel_file_str in list_files_function(parent_abs_dir_str)]
+            return sorted(os.path.relpath(abs_path_file_str, abs_path_dir_str) for abs_path_file_str in abs_path_file_str_list if abs_path_file_str.startswith(abs_path_dir_str))
+        l.admin.list_files = prefix_list_files
+        #
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str)
+        #
+        group_str = self.create_test_group_name()
+        group_str1 = group_str + "0"
+        l.admin.set_group_dict(group_str, {"offsets": {topic_str: {0: 1}}, "state": "stable"})
+        l.admin.set_group_dict(group_str1, {"offsets": {topic_str: {0: 2}}, "state": "stable"})
+        self.assertIn(os.path.join("..", group_str1), [os.path.dirname(rel_file_str) for rel_file_str in l.admin.list_files(os.path.join(l.root_dir(), "groups", group_str))])
+        #
+        self.assertEqual(l.delete_groups(group_str), [group_str])
+        self.assertEqual(l.groups(group_str), [])
+        self.assertEqual(l.group_offsets(group_str1), {group_str1: {topic_str: {0: 2}}})
+        #
+        l.admin.list_files = list_files_function
+
+    def test_group_offset_log(self):
+        l = self.get_storage()
+        l.admin.group_log_compaction_entries_int = 10
+        #
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str, partitions=2)
+        #
+        group_str = self.create_test_group_name()
+        group_abs_dir_str = os.path.join(l.root_dir(), "groups", group_str)
+        # Each commit appends a new entry with only the changed offsets.
+        l.admin.set_group_dict(group_str, {"offsets": {topic_str: {0: 1, 1: 1}}, "state": "stable"})
+        for i in range(2, 9):
+            l.admin.set_group_dict(group_str, {"offsets": {topic_str: {0: i}}})
+        self.assertEqual(len(l.admin.list_files(group_abs_dir_str)), 8)
+        group_dict = l.admin.get_group_dict(group_str)
+        self.assertEqual(group_dict["offsets"], {topic_str: {0: 8, 1: 1}})
+        self.assertEqual(group_dict["state"], "stable")
+        self.assertEqual(l.groups(group_str), [group_str])
+        # Compaction into a snapshot.
+        for i in range(9, 14):
+            l.admin.set_group_dict(group_str, {"offsets": {topic_str: {1: i}}})
+        self.assertEqual(l.admin.get_group_dict(group_str)["offsets"], {topic_str: {0: 8, 1: 13}})
+        rel_file_str_list = l.admin.list_files(group_abs_dir_str)
+        self.assertEqual(len(rel_file_str_list), 1)
+        self.assertTrue(rel_file_str_list[0].endswith(",snapshot"))
+        l.admin.set_group_dict(group_str, {"offsets": {topic_str: {0: 14}}})
+        self.assertEqual(l.group_offsets(group_str)[group_str], {topic_str: {0: 14, 1: 13}})
+        # Concurrent compactions (e.g. by consumers in other processes) do not fail on entries already deleted by the other one.
+        for i in range(15, 25):
+            l.admin.set_group_dict(group_str, {"offsets": {topic_str: {0: i}}})
+        entry_rel_file_str_list = l.admin.list_files(group_abs_dir_str)
+        l1 = self.get_storage()
+        l1.admin.group_log_compaction_entries_int = 10
+        group_dict = l1.admin.get_group_dict(group_str)
+        self.assertEqual(len(l.admin.list_files(group_abs_dir_str)), 1)
+        l.admin.compact_group_log(group_abs_dir_str, entry_rel_file_str_list, group_dict)
+        self.assertEqual(l.group_offsets(group_str)[group_str], {topic_str: {0: 24, 1: 13}})
+        # Legacy group files are migrated into the offset log on the next commit.
+        legacy_group_str = self.create_test_group_name()
+        legacy_group_abs_path_str = os.path.join(l.root_dir(), "groups", legacy_group_str)
+        l.admin.write_dict_to_file(legacy_group_abs_path_str, {"offsets": {topic_str: {0: 3, 1: 4}}, "state": "stable", "last_update": 0})
+        self.assertEqual(l.group_offsets(legacy_group_str)[legacy_group_str], {topic_str: {0: 3, 1: 4}})
+        l.admin.set_group_dict(legacy_group_str, {"offsets": {topic_str: {1: 5}}})
+        self.assertTrue(os.path.isdir(legacy_group_abs_path_str))
+        self.assertEqual(l.group_offsets(legacy_group_str)[legacy_group_str], {topic_str: {0: 3, 1: 5}})
+        #
+        self.assertEqual(sorted(l.delete_groups([group_str, legacy_group_str])), sorted([group_str, legacy_group_str]))
+        self.assertEqual(l.groups([group_str, legacy_group_str]), [])
+
+    def test_message_records(self):
+        l = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str, partitions=2)
+        producer = l.producer(topic_str, type="str")
+        producer.produce([f"message {i}" for i in range(10000)], key=[str(i) for i in range(10000)], headers={"header_key": "header_value"})
+        producer.close()
+        #
+        def consume(**kwargs):
+            tracemalloc.start()
+            consumer = l.consumer(topic_str, type="str", **kwargs)
+            message_list = consumer.consume(n=-1)
+            consumer.close()
+            (size_int, _) = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            return (message_list, size_int)
+        #
+        (message_dict_list, dict_size_int) = consume()
+        (message_list, record_size_int) = consume(message_class="record")
+        self.assertEqual(len(message_list), 10000)
+        # The records can be accessed like the message dictionaries...
+        message = message_list[0]
+        self.assertNotIsInstance(message, dict)
+        self.assertEqual(message["value"], message_dict_list[0]["value"])
+        self.assertEqual(message.value, message_dict_list[0]["value"])
+        self.assertEqual(message["headers"], [("header_key", b"header_value")])
+        self.assertEqual(dict(message), message_dict_list[0])
+        self.assertEqual(message_list, message_dict_list)
+        self.assertEqual(sorted(message.keys()), sorted(message_dict_list[0].keys()))
+        with self.assertRaises(KeyError):
+            message["unknown"]
+        # ...but need significantly less memory.
+        self.assertLess(record_size_int, dict_size_int * 0.8)
+        # Also with decode processes.
+        consumer = l.consumer(topic_str, type="str", message_class="record", config={"decode.processes": 2})
+        self.assertEqual(consumer.consume(n=-1), message_dict_list)
+        consumer.close()
+        consumer = l.consumer(topic_str, type="str", message_class="lazy", config={"decode.processes": 2})
+        self.assertEqual(consumer.consume(n=-1), message_dict_list)
+        consumer.close()
+        # Lazy records.
+        consumer = l.consumer(topic_str, type="str", message_class="lazy")
+        self.assertEqual(consumer.consume(n=-1), message_dict_list)
+        consumer.close()
+
+    def test_serde_cache(self):
+        l = Local({"local": {"root.dir": self.path_str},
+                   "schema_registry": {"schema.registry.url": "mock://test_serde_cache"}})
+        #
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str)
+        producer = l.producer(topic_str, value_type="avro", value_schema=self.avro_schema_str)
+        producer.produce(self.snack_str_list)
+        producer.close()
+        # One serializer and one deserializer, shared by all the producers and consumers of the storage object.
+        self.assertEqual(len(l.serdeCache), 1)
+        self.assertEqual([message_dict["value"]["colour"] for message_dict in l.cat(topic_str, value_type="avro")], ["brown", "white", "chocolate"])
+        self.assertEqual(len(l.serdeCache), 2)
+        deserializer = list(l.serdeCache.key_tuple_serde_ordereddict.values())[1]
+        self.assertEqual(len(l.cat(topic_str, value_type="avro")), 3)
+        self.assertIs(list(l.serdeCache.key_tuple_serde_ordereddict.values())[1], deserializer)
+        # The least recently used (de)serializers are evicted.
+        l.serde_cache_size(1)
+        self.assertEqual(list(l.serdeCache.key_tuple_serde_ordereddict.values()), [deserializer])
+        l.serde_cache_size(0)
+        self.assertEqual(len(l.serdeCache), 0)
+        self.assertEqual(len(l.cat(topic_str, value_type="avro")), 3)
+        self.assertEqual(len(l.serdeCache), 0)
+        # Lookups share the cache, too.
+        l.serde_cache_size(2)
+        producer = l.producer(topic_str, key_type="str", value_type="avro", value_schema=self.avro_schema_str)
+        producer.produce(self.snack_str_list[0], key="key")
+        producer.close()
+        self.assertEqual(l.lookup(topic_str, "key", key_type="str", value_type="avro")["value"]["colour"], "brown")
+        deserializer = list(l.serdeCache.key_tuple_serde_ordereddict.values())[1]
+        self.assertEqual(l.lookup(topic_str, "key", key_type="str", value_type="avro")["value"]["colour"], "brown")
+        self.assertIs(list(l.serdeCache.key_tuple_serde_ordereddict.values())[1], deserializer)
+
+    def test_cp_raw_remap_schema_ids(self):
+        from confluent_kafka.schema_registry import Schema, SchemaReference
+        #
+        l1 = Local({"local": {"root.dir": self.path_str},
+                    "schema_registry": {"schema.registry.url": "mock://test_cp_raw_remap_schema_ids_1"}})
+        l2 = Local({"local": {"root.dir": self.path_str},
+                    "schema_registry": {"schema.registry.url": "mock://test_cp_raw_remap_schema_ids_2"}})
+        # Make the schema IDs of the two Schema Registries differ.
+        l2.register_schema("other-value", {"schema_str": '{"type": "string"}', "schema_type": "AVRO"})
+        #
+        topic_str1 = self.create_test_topic_name()
+        l1.create(topic_str1)
+        producer = l1.producer(topic_str1, value_type="avro", value_schema=self.avro_schema_str)
+        producer.produce(self.snack_str_list)
+        producer.close()
+        source_schema_id_int = int.from_bytes(l1.cat(topic_str1, type="bytes", n=1)[0]["value"][1:5], "big")
+        #
+        topic_str2 = self.create_test_topic_name()
+        l2.create(topic_str2)
+        (consume_n_int, written_n_int) = l1.cp(topic_str1, l2, topic_str2, raw=True, remap_schema_ids=True)
+        self.assertEqual((consume_n_int, written_n_int), (3, 3))
+        #
+        target_schema_id_int = l2.get_latest_version(f"{topic_str2}-value")["schema_id"]
+        self.assertNotEqual(target_schema_id_int, source_schema_id_int)
+        self.assertEqual({int.from_bytes(message_dict["value"][1:5], "big") for message_dict in l2.cat(topic_str2, type="bytes")}, {target_schema_id_int})
+        self.assertEqual([message_dict["value"]["colour"] for message_dict in l2.cat(topic_str2, value_type="avro")], ["brown", "white", "chocolate"])
+        # Schemas with references are not remapped.
+        schema_id_int = l1.schemaRegistryClient.register_schema("referencing-value", Schema('{"type": "record", "name": "referencing", "fields": [{"name": "snack", "type": "snack"}]}', "AVRO", [SchemaReference("snack", f"{topic_str1}-value", 1)]))
+        topic_str3 = self.create_test_topic_name()
+        l1.create(topic_str3)
+        producer = l1.producer(topic_str3, type="bytes")
+        producer.produce(b"\x00" + schema_id_int.to_bytes(4, "big") + b"payload")
+        producer.close()
+        #
+        topic_str4 = self.create_test_topic_name()
+        l2.create(topic_str4)
+        with self.assertRaisesRegex(Exception, "has references"):
+            l1.cp(topic_str3, l2, topic_str4, raw=True, remap_schema_ids=True)
+
+    def test_protobuf_descriptors(self):
+        from confluent_kafka.schema_registry import Schema, SchemaReference
+        import grpc_tools.protoc
+        #
+        cache_dir_str = os.path.join(self.path_str, f"descriptors_{get_millis()}")
+        def get_storage():
+            return Local({"local": {"root.dir": self.path_str},
+                          "schema_registry": {"schema.registry.url": "mock://test_protobuf_descriptors", "protobuf.descriptor.cache.dir": cache_dir_str}})
+        l = get_storage()
+        #
+        sys_path_str_list = list(sys.path)
+        topic_str = self.create_test_topic_name()
+        l.create(topic_str)
+        producer = l.producer(topic_str, value_type="protobuf", value_schema='syntax = "proto3"; import "google/protobuf/timestamp.proto"; message Snack { string name = 1; float calories = 2; string colour = 3; google.protobuf.Timestamp best_before = 4; }')
+        producer.produce([{"name": "cookie", "calories": 500.0, "colour": "brown", "best_before": "2025-01-01T00:00:00Z"}])
+        producer.close()
+        message_dict_list = l.cat(topic_str, value_type="protobuf")
+        self.assertEqual(message_dict_list[0]["value"], {"name": "cookie", "calories": 500.0, "colour": "brown", "bestBefore": "2025-01-01T00:00:00Z"})
+        # No generated modules on sys.path, but the compiled schema is cached on disk.
+        self.assertEqual(sys.path, sys_path_str_list)
+        self.assertEqual(len(os.listdir(cache_dir_str)), 1)
+        # Referenced schemas are resolved.
+        colour_schema_id_int = l.schemaRegistryClient.register_schema("colour", Schema('syntax = "proto3"; package colours; message Colour { string name = 1; }', "PROTOBUF"))
+        snack_schema_str = 'syntax = "proto3"; import "colour.proto"; message Snack { string name = 1; colours.Colour colour = 2; }'
+        snack_schema_id_int = l.schemaRegistryClient.register_schema("snack", Schema(snack_schema_str, "PROTOBUF", [SchemaReference("colour.proto", "colour", 1)]))
+        self.assertNotEqual(colour_schema_id_int, snack_schema_id_int)
+        (generalizedProtocolMessageType, _) = l.schema_id_int_to_protobuf_generalizedProtocolMessageType_schema_str_tuple(snack_schema_id_int)
+        snack_message = generalizedProtocolMessageType(name="cookie")
+        snack_message.colour.name = "brown"
+        self.assertEqual(generalizedProtocolMessageType.FromString(snack_message.SerializeToString()).colour.name, "brown")
+        # Other processes/storage objects use the on-disk cache instead of compiling the schema again.
+        self.assertEqual(len(os.listdir(cache_dir_str)), 2)
+        l.schema_id_int_and_schema_str_to_generalizedProtocolMessageType(1, 'syntax = "proto3"; message Cake { string name = 1; }')
+        protoc_main_function = grpc_tools.protoc.main
+        try:
+            grpc_tools.protoc.main = None
+            generalizedProtocolMessageType = get_storage().schema_id_int_and_schema_str_to_generalizedProtocolMessageType(1, 'syntax = "proto3"; message Cake { string name = 1; }')
+        finally:
+            grpc_tools.protoc.main = protoc_main_function
+        self.assertEqual(generalizedProtocolMessageType(name="cake").name, "cake")
+        # Serialized schemas are fetched with a separate client (the shared one caches the schemas by ID only, regardless of their format).
+        l = self.get_storage()
+        self.assertIsNot(l.get_serializedSchemaRegistryClient(), l.schemaRegistryClient)
+        l = get_storage()
+        self.assertIs(l.get_serializedSchemaRegistryClient(), l.schemaRegistryClient)
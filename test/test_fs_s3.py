@@ -1,3 +1,4 @@
+import asyncio
 import os
 import sys
 
@@ -40,3 +41,80 @@ class Test(TestSingleStorageBase):
 
     def test_compact(self):
         pass
+
+    #
+
+    def test_client_reuse(self):
+        # The long-lived, pooled client of the storage object (see test/benchmark_client_reuse.py for its latency compared to a new client per object).
+        s = self.get_storage()
+        #
+        abs_path_dir_str = os.path.join(s.root_dir(), "client_reuse")
+        data_bytes = b"x" * 1024
+        for i in range(200):
+            s.admin.write_bytes(os.path.join(abs_path_dir_str, str(i)), data_bytes)
+            self.assertEqual(s.admin.read_bytes(os.path.join(abs_path_dir_str, str(i))), data_bytes)
+        #
+        for i in range(200):
+            s.admin.delete_file(os.path.join(abs_path_dir_str, str(i)))
+        self.assertEqual(s.admin.list_files(abs_path_dir_str + "/"), [])
+
+    def test_keep_alive(self):
+        import socket
+        from kafi.fs.s3.s3_admin import get_poolManager
+        #
+
+        keep_alive_socket_option_tuple = (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.assertIn(keep_alive_socket_option_tuple, get_poolManager({}).connection_pool_kw["socket_options"])
+        self.assertIn(keep_alive_socket_option_tuple, get_poolManager({"keep.alive": "true"}).connection_pool_kw["socket_options"])
+        # Booleans from YAML/environment variables can be strings.
+        self.assertNotIn(keep_alive_socket_option_tuple, get_poolManager({"keep.alive": "false"}).connection_pool_kw["socket_options"])
+        self.assertNotIn(keep_alive_socket_option_tuple, get_poolManager({"keep.alive": False}).connection_pool_kw["socket_options"])
+
+    def test_multipart_ranged_io(self):
+        s = self.get_storage()
+        s.s3_config_dict["part.size"] = 5242880
+        s.admin = s.get_admin()
+        #
+        abs_path_file_str = os.path.join(s.root_dir(), "multipart", "object")
+        data_bytes = os.urandom(3 * 5242880 + 42)
+        # Multipart upload, parallel ranged download.
+        s.admin.write_bytes(abs_path_file_str, data_bytes)
+        self.assertEqual(s.admin.read_bytes(abs_path_file_str), data_bytes)
+        # Ranges (e.g. from the offset index of a partition file).
+        self.assertEqual(s.admin.read_bytes(abs_path_file_str, 5242800), data_bytes[5242800:])
+        self.assertEqual(s.admin.read_bytes(abs_path_file_str, 100, 6000000), data_bytes[100:6000100])
+        self.assertEqual(s.admin.read_bytes(abs_path_file_str, 42, 10), data_bytes[42:52])
+        #
+        s.admin.delete_file(abs_path_file_str)
+
+    def test_async_admin(self):
+        s = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        s.create(topic_str, partitions=2)
+        producer = s.producer(topic_str, type="str")
+        for i in range(10):
+            producer.produce([f"message {i} {j}" for j in range(10)])
+        producer.close()
+        #
+        target_topic_str = self.create_test_topic_name()
+        #
+        async def run():
+            # The S3 backend requests the objects natively with httpx (no threads).
+            async with s.async_admin(max_requests=200) as async_admin:
+                message_dict_list = [message_dict async for message_dict in async_admin.messages(topic_str, type="str")]
+                await async_admin.copy_topic(topic_str, async_admin, target_topic_str)
+                #
+                abs_path_file_str = os.path.join(s.root_dir(), "async", "object")
+                await async_admin.write_bytes(abs_path_file_str, b"test")
+                exists_bool1 = await async_admin.exists_file(abs_path_file_str)
+                data_bytes = await async_admin.read_bytes(abs_path_file_str)
+                await async_admin.delete_file(abs_path_file_str)
+                exists_bool2 = await async_admin.exists_file(abs_path_file_str)
+                #
+                return (message_dict_list, exists_bool1, data_bytes, exists_bool2)
+        #
+        (message_dict_list, exists_bool1, data_bytes, exists_bool2) = asyncio.run(run())
+        self.assertEqual(len(message_dict_list), 100)
+        self.assertEqual((exists_bool1, data_bytes, exists_bool2), (True, b"test", False))
+        self.assertEqual(s.watermarks(target_topic_str)[target_topic_str], s.watermarks(topic_str)[topic_str])
@@ -252,6 +252,11 @@ class TestSingleStorageBase(unittest.TestCase):
         consumer = s.consumer(topic_str, group=group_str, value_type="str")
         consumer.consume(n=1)
         consumer.close()
+        # A second group whose name starts with the name of the first one (e.g. "g1" and "g10").
+        group_str1 = group_str + "0"
+        consumer = s.consumer(topic_str, group=group_str1, value_type="str")
+        consumer.consume(n=2)
+        consumer.close()
         #
         group_str_list = s.groups(group_str, state_pattern="*")
         self.assertEqual(group_str_list, [group_str])
@@ -259,6 +264,8 @@ class TestSingleStorageBase(unittest.TestCase):
         self.assertEqual(group_str_list, [group_str])
         group_str_list = s.groups(group_str, state_pattern="*")
         self.assertEqual(group_str_list, [])
+        #
+        self.assertEqual(s.groups(group_str1, state_pattern="*"), [group_str1])
 
     def test_group_offsets(self):
         if self.__class__.__name__ == "TestSingleStorageBase":
@@ -588,6 +595,9 @@ class TestSingleStorageBase(unittest.TestCase):
         self.assertEqual(key_dict_list, self.snack_dict_list)
         self.assertEqual(value_dict_list, self.snack_dict_list)
         consumer.close()
+        # Consuming fetches the schemas as serialized FileDescriptorProtos, but get_schema() still returns them as text.
+        value_schema_id_int = s.get_latest_version(f"{topic_str}-value")["schema_id"]
+        self.assertIn("Snack", s.get_schema(value_schema_id_int)["schema_str"])
 
     def test_produce_consume_avro(self):
         if self.__class__.__name__ == "TestSingleStorageBase":
@@ -1074,6 +1084,44 @@ class TestSingleStorageBase(unittest.TestCase):
         self.assertEqual(7, consume_n_int1)
         self.assertEqual(7, written_n_int1)
 
+    def test_cp_raw(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        topic_str1 = self.create_test_topic_name()
+        s.create(topic_str1)
+        producer = s.producer(topic_str1, value_type="json")
+        producer.produce(self.snack_bytes_list, headers=self.headers_str_bytes_tuple_list)
+        producer.close()
+        # Copy the key, value and header bytes untouched.
+        topic_str2 = self.create_test_topic_name()
+        s.create(topic_str2)
+        (consume_n_int, written_n_int) = s.cp(topic_str1, s, topic_str2, source_type="json", target_type="json", raw=True)
+        self.assertEqual(3, consume_n_int)
+        self.assertEqual(3, written_n_int)
+        #
+        if not s.__class__.__name__ == "RestProxy":
+            message_dict_list2 = s.cat(topic_str2, type="json", n=3)
+            self.assertEqual([message_dict["value"] for message_dict in message_dict_list2], self.snack_dict_list)
+            self.assertEqual(message_dict_list2[0]["headers"], self.headers_str_bytes_tuple_list)
+        # Replace the schema IDs of values in the Schema Registry wire format.
+        topic_str3 = self.create_test_topic_name()
+        s.create(topic_str3)
+        producer = s.producer(topic_str3, type="bytes")
+        producer.produce([b"\x00" + (1).to_bytes(4, "big") + b"payload 1", b"\x00" + (3).to_bytes(4, "big") + b"payload 2", b"no wire format"], key=b"key")
+        producer.close()
+        #
+        topic_str4 = self.create_test_topic_name()
+        s.create(topic_str4)
+        s.cp(topic_str3, s, topic_str4, raw=True, schema_ids={1: 2})
+        #
+        if not s.__class__.__name__ == "RestProxy":
+            message_dict_list4 = s.cat(topic_str4, type="bytes", n=3)
+            self.assertEqual([message_dict["value"] for message_dict in message_dict_list4], [b"\x00" + (2).to_bytes(4, "big") + b"payload 1", b"\x00" + (3).to_bytes(4, "big") + b"payload 2", b"no wire format"])
+            self.assertEqual(message_dict_list4[0]["key"], b"key")
+
     def test_wc(self):
         if self.__class__.__name__ == "TestSingleStorageBase":
             return
@@ -1158,6 +1206,77 @@ class TestSingleStorageBase(unittest.TestCase):
         self.assertEqual("white", colour_str_list[1])
         self.assertEqual("chocolate", colour_str_list[2])
 
+    def test_lazy_deserialization(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        s.create(topic_str)
+        producer = s.producer(topic_str, key_type="str", value_type="bytes")
+        producer.produce([b"{\"colour\": \"brown\"}", b"not json", None, b"{\"colour\": \"white\"}"], key=["a", "b", "b", "a"])
+        producer.close()
+        # The values are only deserialized when they are read - key-only scans skip the (invalid) JSON values.
+        message_list = s.cat(topic_str, key_type="str", value_type="json", message_class="lazy")
+        self.assertEqual([message["key"] for message in message_list], ["a", "b", "b", "a"])
+        self.assertEqual(message_list[0]["value"], {"colour": "brown"})
+        self.assertTrue(message_list[2].is_null("value"))
+        with self.assertRaises(Exception):
+            message_list[1]["value"]
+        # compact() only deserializes the keys (and still returns dicts).
+        message_dict_list = s.compact(topic_str, key_type="str", value_type="json")
+        self.assertEqual(len(message_dict_list), 1)
+        self.assertIsInstance(message_dict_list[0], dict)
+        self.assertEqual(message_dict_list[0]["key"], "a")
+        self.assertEqual(message_dict_list[0]["value"], {"colour": "white"})
+        self.assertEqual(json.loads(json.dumps(message_dict_list[0]))["value"], {"colour": "white"})
+        # Unless records are asked for explicitly.
+        message_list = s.compact(topic_str, key_type="str", value_type="json", message_class="lazy")
+        self.assertNotIsInstance(message_list[0], dict)
+        self.assertEqual(message_list[0]["value"], {"colour": "white"})
+
+    def test_stream(self):
+        if self.__class__.__name__ == "TestSingleStorageBase":
+            return
+        #
+        s = self.get_storage()
+        #
+        topic_str = self.create_test_topic_name()
+        s.create(topic_str)
+        producer = s.producer(topic_str, value_type="json")
+        producer.produce(self.snack_str_list)
+        producer.close()
+        #
+        group_str = self.create_test_group_name()
+        message_dict_generator = s.stream(topic_str, group=group_str, type="json")
+        self.assertEqual("brown", next(message_dict_generator)["value"]["colour"])
+        self.assertEqual(["white", "chocolate"], [message_dict["value"]["colour"] for message_dict in message_dict_generator])
+        #
+        self.assertEqual(["brown", "white"], [message_dict["value"]["colour"] for message_dict in s.stream(topic_str, n=2, type="json")])
+        #
+        consumer = s.consumer(topic_str, type="json")
+        self.assertEqual(["brown", "white", "chocolate"], [message_dict["value"]["colour"] for message_dict in consumer.iter()])
+        consumer.close()
+        # Stopping early commits the offsets of the messages processed so far (with commit.after.processing).
+        s.enable_auto_commit(False)
+        s.commit_after_processing(True)
+        group_str = self.create_test_group_name()
+        for message_dict in s.stream(topic_str, group=group_str, type="json"):
+            if message_dict["value"]["colour"] == "white":
+                break
+        self.assertEqual(s.group_offsets(group_str)[group_str][topic_str][0], 1)
+        # End offsets for partitions not consumed from yet.
+        topic_str = self.create_test_topic_name()
+        s.create(topic_str, partitions=2)
+        producer = s.producer(topic_str, type="str")
+        producer.produce(self.snack_str_list, partition=0)
+        producer.produce(self.snack_str_list, partition=1)
+        producer.close()
+        group_str = self.create_test_group_name()
+        message_dict_list = list(s.stream(topic_str, group=group_str, type="str", end_offsets={topic_str: {0: 0, 1: 0}}))
+        self.assertEqual(sorted((message_dict["partition"], message_dict["offset"]) for message_dict in message_dict_list), [(0, 0), (1, 0)])
+
     def test_filter(self):
         if self.__class__.__name__ == "TestSingleStorageBase":
             return